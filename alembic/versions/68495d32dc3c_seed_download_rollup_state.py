@@ -0,0 +1,24 @@
+"""Seed the download rollup state row
+
+Revision ID: 68495d32dc3c
+Revises: eb3fa0b83235
+Create Date: 2026-10-18 20:12:05.418273
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '68495d32dc3c'
+down_revision = 'eb3fa0b83235'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    # roll_up locks this row for each batch, so it has to exist before the first run; INSERT IGNORE in case a run
+    # already created it.
+    op.execute("INSERT IGNORE INTO download_rollup_state (id, last_download_id) VALUES (1, 0)")
+
+
+def downgrade():
+    pass
@@ -13,6 +13,8 @@ from flask.ext.login import LoginManager
 from flask.ext.openid import OpenID
 from flask.ext.sqlalchemy import SQLAlchemy
 from raven.contrib.flask import Sentry
+from app.cache import SingleFlightCache
+from app.storage import lazy_proxy
 import steam
 from boto import sqs
 from boto.s3.connection import S3Connection
@@ -24,6 +26,7 @@ app.config.from_object("settings")
 # Load extensions
 mem_cache = Cache(app, config=app.config["CACHE_MEMCACHED"])
 fs_cache = Cache(app, config=app.config["CACHE_FS"])
+locked_mem_cache = SingleFlightCache(mem_cache)  # For expensive queries which shouldn't be recomputed concurrently
 db = SQLAlchemy(app)
 login_manager = LoginManager(app)
 oid = OpenID(app)
@@ -34,21 +37,34 @@ sentry = Sentry(app)
 steam.api.key.set(app.config['STEAM_API_KEY'])
 steam.api.socket_timeout.set(app.config['STEAM_API_TIMEOUT'])
 
-# Setup AWS SQS
-sqs_connection = sqs.connect_to_region(
-    app.config["AWS_REGION"],
-    aws_access_key_id=app.config["AWS_ACCESS_KEY_ID"],
-    aws_secret_access_key=app.config["AWS_SECRET_ACCESS_KEY"]
-)
-sqs_gc_queue = sqs_connection.create_queue(app.config["AWS_SQS_GC"])
-sqs_dl_queue = sqs_connection.create_queue(app.config["AWS_SQS_DL"])
-
-# Setup AWS S3
-s3_connection = S3Connection(
-    aws_access_key_id=app.config["AWS_ACCESS_KEY_ID"],
-    aws_secret_access_key=app.config["AWS_SECRET_ACCESS_KEY"]
-)
-dotabank_bucket = s3_connection.get_bucket(app.config["AWS_BUCKET"])
+# Setup SQS and S3.  These are proxies which connect on first use, so importing app (e.g. for a manage.py command which
+# only needs the database) doesn't cost any AWS round trips.
+if app.config.get("STORAGE_BACKEND", "aws") == "local":
+    # File-system stand-ins for SQS and S3, for running and benchmarking offline.
+    from app.storage import LocalQueue, LocalBucket
+    sqs_gc_queue = lazy_proxy(lambda: LocalQueue(
+        os.path.join(app.config["LOCAL_STORAGE_DIR"], "queues", app.config["AWS_SQS_GC"] or "gc")))
+    sqs_dl_queue = lazy_proxy(lambda: LocalQueue(
+        os.path.join(app.config["LOCAL_STORAGE_DIR"], "queues", app.config["AWS_SQS_DL"] or "dl")))
+    dotabank_bucket = lazy_proxy(lambda: LocalBucket(
+        os.path.join(app.config["LOCAL_STORAGE_DIR"], "buckets", app.config["AWS_BUCKET"] or "dotabank")))
+
+else:
+    # Setup AWS SQS
+    sqs_connection = lazy_proxy(lambda: sqs.connect_to_region(
+        app.config["AWS_REGION"],
+        aws_access_key_id=app.config["AWS_ACCESS_KEY_ID"],
+        aws_secret_access_key=app.config["AWS_SECRET_ACCESS_KEY"]
+    ))
+    sqs_gc_queue = lazy_proxy(lambda: sqs_connection.create_queue(app.config["AWS_SQS_GC"]))
+    sqs_dl_queue = lazy_proxy(lambda: sqs_connection.create_queue(app.config["AWS_SQS_DL"]))
+
+    # Setup AWS S3
+    s3_connection = lazy_proxy(lambda: S3Connection(
+        aws_access_key_id=app.config["AWS_ACCESS_KEY_ID"],
+        aws_secret_access_key=app.config["AWS_SECRET_ACCESS_KEY"]
+    ))
+    dotabank_bucket = lazy_proxy(lambda: s3_connection.get_bucket(app.config["AWS_BUCKET"]))
 
 # Setup debugtoolbar if we're in debug mode.
 if app.debug:
@@ -123,6 +139,8 @@ app.logger.setLevel(logging.INFO)  # Set root logger to handle anything info and
 
 # Database logging for warnings
 from app.handlers import SQLAlchemyHandler
-db_handler = SQLAlchemyHandler()
+db_handler = SQLAlchemyHandler(batch_size=app.config['LOG_HANDLER_BATCH_SIZE'],
+                               flush_interval=app.config['LOG_HANDLER_FLUSH_INTERVAL'],
+                               queue_size=app.config['LOG_HANDLER_QUEUE_SIZE'])
 db_handler.setLevel(logging.INFO)
 app.logger.addHandler(db_handler)
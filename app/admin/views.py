@@ -5,12 +5,15 @@ from flask.ext.login import current_user
 
 from sqlalchemy.sql import text
 from datetime import datetime, timedelta
-from math import ceil
 
-from app import db, steam, dotabank_bucket
-from app.models import Log
-from app.gc.models import GCJob, GCWorker
-from app.replays.models import Replay, ReplayPlayer, ReplayDownload
+from app import db, dotabank_bucket, mem_cache, fs_cache
+from app.models import Log, ArchivedRows
+from app.pagination import paginate_with_total
+from app import counters
+from app.gc.models import GCJobRollup, GCWorker
+from app.replays.models import Replay, ReplayPlayer, DownloadRollupState, UserDownloadRollup
+from app.users.models import User
+from app.cron.repopulate_replays import start_repopulate_replays, get_progress as get_repopulate_progress
 
 from models import MonthlyCost
 
@@ -37,6 +40,7 @@ class AdminIndex(AuthMixin, AdminIndexView):
         """ Reports the GCWorker utilization for the past 24 hrs. """
 
         gc_workers = GCWorker.query.all()
+        job_counts = GCJobRollup.job_counts(24)
 
         stats = []
         for worker in gc_workers:
@@ -44,17 +48,21 @@ class AdminIndex(AuthMixin, AdminIndexView):
             stats.append({
                 "id": worker.id,
                 "display_name": worker.display_name,
-                "match_requests_past_24hrs": GCJob.query.filter(
-                    GCJob.worker_id == worker.id,
-                    GCJob.type == "MATCH_REQUEST",
-                    GCJob.timestamp >= (datetime.utcnow() - timedelta(hours=24))
-                ).count(),
+                "match_requests_past_24hrs": job_counts.get(worker.id, {}).get("MATCH_REQUEST", 0),
                 "match_requests_capacity": current_app.config['GC_MATCH_REQUSTS_RATE_LIMIT']
             })
 
         return self.render('admin/index.html',
                            stats=stats)
 
+    @expose("/cache_stats")
+    def cache_stats(self):
+        """ AJAX endpoint reporting this process' hit/miss counters for each tier of our caches. """
+        return jsonify(
+            mem_cache=getattr(mem_cache.cache, 'stats', None),
+            fs_cache=getattr(fs_cache.cache, 'stats', None)
+        )
+
 
 class AtypicalReplays(AuthMixin, BaseView):
     """ Views for atypical-replay reports """
@@ -89,21 +97,23 @@ class AtypicalReplays(AuthMixin, BaseView):
             )
         ) if x.player_count != x.human_players]
 
-        replay_available_download_error = Replay.query.filter(
+        replay_available_download_error = Replay.lightweight_query().filter(
             Replay.replay_state == "REPLAY_AVAILABLE",
             Replay.state == "DOWNLOAD_ERROR"
         ).all()
 
-        replay_waiting_download_over24hrs = Replay.query.filter(
+        replay_waiting_download_over24hrs = Replay.lightweight_query().filter(
             Replay.state == "WAITING_DOWNLOAD",
             Replay.gc_done_time <= (datetime.utcnow() - timedelta(hours=24))  # Over 24 hrs ago
         ).all()
 
-        small_replay_files = {replay_file.key[8:-8]: replay_file.size for replay_file in dotabank_bucket.list() if replay_file.key[:8] == "replays/" and replay_file.size < (1024 * 1024)}
-        small_replays = Replay.query.filter(Replay.id.in_(small_replay_files.keys())).all()
+        small_replays = Replay.lightweight_query().filter(Replay.file_size < Replay.SMALL_FILE_SIZE).all()
 
-        all_s3_replay_ids = [replay_file.key[8:-8] for replay_file in dotabank_bucket.list() if replay_file.key[:8] == "replays/"]
-        archived_replays_no_file = Replay.query.filter(Replay.state == 'ARCHIVED', Replay.id.notin_(all_s3_replay_ids)).all()
+        # Archived replays with no file recorded against them; fix_missing_files checks these against S3.
+        archived_replays_no_file = Replay.lightweight_query().filter(
+            Replay.state == 'ARCHIVED',
+            db.or_(Replay.local_uri == None, Replay.file_size == None)
+        ).all()
 
         return self.render(
             'admin/atypical_replays.html',
@@ -111,7 +121,6 @@ class AtypicalReplays(AuthMixin, BaseView):
             replay_available_download_error=replay_available_download_error,
             replay_waiting_download_over24hrs=replay_waiting_download_over24hrs,
             small_replays=small_replays,
-            small_replay_files=small_replay_files,
             archived_replays_no_file=archived_replays_no_file
         )
 
@@ -127,30 +136,30 @@ class Logs(AuthMixin, BaseView):
         unresolved_logs = Log.query.filter(Log.resolved_by_user_id == None).\
             order_by(Log.created_at.desc()).\
             limit(current_app.config['LOGS_PER_PAGE']).all()
-        unresolved_count = Log.query.filter(Log.resolved_by_user_id == None).count()
+        unresolved_count = counters.unresolved_logs.get()
 
         resolved_logs = Log.query.filter(Log.resolved_by_user_id != None).\
             order_by(Log.resolved_at.desc()).\
             limit(current_app.config['LOGS_PER_PAGE']).\
             all()
-        resolved_count = Log.query.filter(Log.resolved_by_user_id != None).count()
+        resolved_count = counters.resolved_logs.get()
+        archived_count = ArchivedRows.total("logs")
 
         return self.render(
             'admin/logs/index.html',
             unresolved_logs=unresolved_logs,
             unresolved_count=unresolved_count,
             resolved_logs=resolved_logs,
-            resolved_count=resolved_count
+            resolved_count=resolved_count,
+            archived_count=archived_count
         )
 
     @expose('/unresolved')
     @expose('/unresolved/<int:page>')
     def unresolved(self, page=None):
         """ Paginated view for all unresolved log entries. """
-        if not page:
-            page = int(ceil(float(Log.query.filter(Log.resolved_by_user_id == None).count() or 1) / float(current_app.config["LOGS_PER_PAGE"])))  # Default to last page
-
-        logs = Log.query.filter(Log.resolved_by_user_id == None).paginate(page, current_app.config["LOGS_PER_PAGE"], False)
+        logs = paginate_with_total(Log.query.filter(Log.resolved_by_user_id == None), page,
+                                   current_app.config["LOGS_PER_PAGE"], counters.unresolved_logs.get())
 
         return self.render(
             'admin/logs/unresolved.html',
@@ -161,12 +170,8 @@ class Logs(AuthMixin, BaseView):
     @expose('/resolved/<int:page>')
     def resolved(self, page=None):
         """ Paginated view for all resolved log entries. """
-        if not page:
-            page = int(ceil(float(Log.query.filter(Log.resolved_by_user_id != None).count() or 1) / float(current_app.config["LOGS_PER_PAGE"])))  # Default to last page
-
-        logs = Log.query.filter(Log.resolved_by_user_id != None).\
-            order_by(Log.resolved_at.asc())\
-            .paginate(page, current_app.config["LOGS_PER_PAGE"], False)
+        logs = paginate_with_total(Log.query.filter(Log.resolved_by_user_id != None).order_by(Log.resolved_at.asc()), page,
+                                   current_app.config["LOGS_PER_PAGE"], counters.resolved_logs.get())
 
         return self.render(
             'admin/logs/resolved.html',
@@ -204,20 +209,13 @@ class BigDownloaders(AuthMixin, BaseView):
 
     @staticmethod
     def user_download_count(hours=None):
-        if hours:
-            _time_ago = datetime.utcnow() - timedelta(hours=hours)
-            return db.session.query(ReplayDownload, db.func.count(ReplayDownload.id)).\
-                filter(ReplayDownload.created_at >= _time_ago).\
-                group_by(ReplayDownload.user_id).\
-                order_by(db.func.count(ReplayDownload.replay_id).desc()).\
-                limit(current_app.config['USERS_PER_PAGE']).\
-                all()
-        else:
-            return db.session.query(ReplayDownload, db.func.count(ReplayDownload.id)).\
-                group_by(ReplayDownload.user_id).\
-                order_by(db.func.count(ReplayDownload.replay_id).desc()).\
-                limit(current_app.config['USERS_PER_PAGE']).\
-                all()
+        """ (user, downloads) of the top downloaders in the last `hours`, or all time, from the download rollups. """
+        top = DownloadRollupState.top(UserDownloadRollup, UserDownloadRollup.user_id, hours,
+                                      limit=current_app.config['USERS_PER_PAGE']).subquery()
+        return db.session.query(User, top.c.downloads).\
+            join(top, top.c.user_id == User.id).\
+            order_by(top.c.downloads.desc()).\
+            all()
 
     @expose('/')
     def index(self):
@@ -227,7 +225,7 @@ class BigDownloaders(AuthMixin, BaseView):
             'admin/big_downloaders.html',
             daily_downloaders=self.user_download_count(24),
             weekly_downloaders=self.user_download_count(24 * 7),
-            monthly_downloaders=self.user_download_count(24 * 7 * 30),
+            monthly_downloaders=self.user_download_count(24 * 30),
             all_time_downloaders=self.user_download_count()
         )
 
@@ -242,76 +240,59 @@ class Maintenance(AuthMixin, BaseView):
 
     @expose('/replay_repopulate')
     def replay_repopulate(self):
-        """ AJAX endpoint to repopulate WebAPI data for every replay on the site. """
-        # TODO: Accept a list of replays, rather than executing for all replays.
-        # TODO: Make asyncronous.
-        # TODO: Send progress data back to caller.
-
-        success = []
-        failed = []
-
-        # For each replay, try repopulate from WebAPI.
-        for replay in Replay.query.all():
-            try:
-                replay._populate_from_webapi()
-                db.session.add(replay)
-                success.append(replay)
-            except steam.api.HTTPError:
-                failed.append(replay)
-
-        db.session.commit()
+        """ AJAX endpoint to start repopulating WebAPI data for every replay on the site, in the background.  Poll
+        `replay_repopulate_status` for progress. """
+        started = start_repopulate_replays()
+        return jsonify(
+            success=started,
+            progress=get_repopulate_progress()
+        )
 
+    @expose('/replay_repopulate/status')
+    def replay_repopulate_status(self):
+        """ AJAX endpoint reporting the progress of the current (or last) replay repopulate job. """
         return jsonify(
             success=True,
-            replays_updated=[replay.id for replay in success],
-            replays_failed=[replay.id for replay in failed]
+            progress=get_repopulate_progress()
         )
 
     @expose('/small_replay_exodus')
     def small_replay_exodus(self):
-        small_replay_files = {replay_file.key[8:-8]: replay_file.size for replay_file in dotabank_bucket.list() if replay_file.key[:8] == "replays/" and replay_file.size < (1024 * 1024)}
-        small_replays = Replay.query.filter(Replay.id.in_(small_replay_files.keys())).all()
+        small_replays = Replay.lightweight_query().filter(Replay.file_size < Replay.SMALL_FILE_SIZE).all()
 
-        replays_removed = []  # IDs of removed replays
+        # Clean up metadata associated with an archived replay, saving local URIs so we can remove the files from S3
+        # after we've changed the database.
+        local_uris = []
         for replay in small_replays:
-            # Save local URI so we can remove the file from S3 after we've changed the databose.
-            local_uri = replay.local_uri
-
-            # Clean up metadata associated with an archived replay.
-            replay.dl_done_time = None
-            replay.local_uri = None
+            local_uris.append(replay.local_uri or "replays/{}.dem.bz2".format(replay.id))
+            replay.clear_archived_file()
             replay.state = "WAITING_DOWNLOAD"
 
-            # Save ne state to database
-            db.session.add(replay)
-            db.session.commit()
-
-            # Remove bad file from S3.
-            dotabank_bucket.delete_key(local_uri or "replays/{}.dem.bz2".format(replay.id))
+        # Save new state to database
+        db.session.commit()
 
-            # Add a new download job
-            Replay.add_dl_job(replay)
+        # Remove bad files from S3, up to 1000 per request.
+        for i in range(0, len(local_uris), 1000):
+            dotabank_bucket.delete_keys(local_uris[i:i + 1000])
 
-            # Note that we've done things to this replay.
-            replays_removed.append(replay.id)
+        # Add new download jobs
+        replays_removed, replays_failed = Replay.add_dl_jobs(small_replays)
 
         return jsonify(
             success=True,
-            replays_removed=replays_removed
+            replays_removed=replays_removed,
+            replays_failed=replays_failed
         )
 
     @expose('/requeue_waiting_downloads')
     def requeue_waiting_downloads(self):
-        waiting_downloads = Replay.query.filter(Replay.state == "WAITING_DOWNLOAD").all()
-
-        done = []
-        for replay in waiting_downloads:
-            if Replay.add_dl_job(replay):
-                done.append(replay.id)
+        waiting_downloads = Replay.lightweight_query().filter(Replay.state == "WAITING_DOWNLOAD").all()
+        done, failed = Replay.add_dl_jobs(waiting_downloads)
 
         return jsonify(
             success=True,
-            readded=done
+            readded=done,
+            failed=failed
         )
 
 
@@ -4,17 +4,32 @@ Modified FileSystemCache based upon werkzeug.contrib.cache.FileSystemCache.
 Modifications:
 - Do not delete the file-system cache object via the get method.
 - Add a an option to the get method to skip the expiry check.
+- Keep a persistent side index of entries (expiry, size, last access) so pruning doesn't have to list and unpickle the
+  whole cache directory on every write.
+
+Also provides TieredCache, a bounded in-process LRU which sits in front of the memcached and file-system backends, and
+SingleFlightCache, stampede-protected replacements for Flask-Cache's `cached` and `memoize` decorators.
 """
 
 import os
 import tempfile
+import threading
+import heapq
+from collections import OrderedDict
+from functools import wraps
 from hashlib import md5
-from time import time
+from time import time, sleep
 try:
     import cPickle as pickle
 except ImportError:
     import pickle
+try:
+    from pylibmc import NotFound as MemcachedNotFound
+except ImportError:
+    class MemcachedNotFound(Exception):
+        """ Stands in for pylibmc's NotFound when python-memcached is used instead. """
 
+from flask import request, current_app, has_app_context, has_request_context, copy_current_request_context
 from werkzeug._compat import text_type
 from werkzeug.posixemulation import rename
 from werkzeug.contrib.cache import BaseCache
@@ -32,11 +47,22 @@ class DotabankFileSystemCache(BaseCache):
     :param default_timeout: the default timeout that is used if no timeout is
                             specified on :meth:`~BaseCache.set`.
     :param mode: the file mode wanted for the cache files, default 0600
+
+    Each process keeps its own side index, written to `cache_dir` at most every `_index_sync_interval` seconds (so
+    processes sharing a directory overwrite each other's copy at most that often), and rebuilt from the cache files
+    themselves if that index is missing.  Entries written by other processes since the index was loaded aren't tracked
+    (or pruned) by this process until its next cold start.
     """
 
     #: used for temporary files by the FileSystemCache
     _fs_transaction_suffix = '.__wz_cache'
 
+    #: name of the side index file; never a valid md5 hexdigest, so it can't collide with a cache entry
+    _index_filename = '__dbfs_index'
+
+    #: seconds between writes of the side index to disk
+    _index_sync_interval = 60
+
     def __init__(self, cache_dir, threshold=500, default_timeout=300, mode=0o600):
         BaseCache.__init__(self, default_timeout)
         self._path = cache_dir
@@ -45,34 +71,145 @@ class DotabankFileSystemCache(BaseCache):
         if not os.path.exists(self._path):
             os.makedirs(self._path)
 
+        # Side index.  _entries maps filename => [expires, size, last_access] in least-recently-used-first order, and
+        # _expiry_heap is a min-heap of (expires, filename) which may contain stale pairs for rewritten or removed
+        # entries; those are skipped when popped.
+        self._lock = threading.RLock()
+        self._entries = OrderedDict()
+        self._expiry_heap = []
+        self._index_synced_at = 0
+        self._load_index()
+
     def _list_dir(self):
         """return a list of (fully qualified) cache filenames
         """
         return [os.path.join(self._path, fn) for fn in os.listdir(self._path)
-                if not fn.endswith(self._fs_transaction_suffix)]
+                if not fn.endswith(self._fs_transaction_suffix) and fn != self._index_filename]
 
-    def _prune(self):
-        entries = self._list_dir()
-        if len(entries) > self._threshold:
-            now = time()
-            for idx, fname in enumerate(entries):
-                remove = False
-                f = None
+    @property
+    def _index_path(self):
+        return os.path.join(self._path, self._index_filename)
+
+    def _load_index(self):
+        """ Load the side index from disk, rebuilding it from the cache files if it's missing or unreadable. """
+        try:
+            with open(self._index_path, 'rb') as f:
+                entries = pickle.load(f)
+        except Exception:
+            self._rebuild_index()
+            return
+
+        with self._lock:
+            self._entries = OrderedDict((fname, [expires, size, last_access])
+                                        for fname, expires, size, last_access in entries)
+            self._rebuild_heap()
+
+    def _rebuild_index(self):
+        """ Cold start: read every cache file's expiry header and stat it to reconstruct the side index. """
+        entries = []
+        for fname in self._list_dir():
+            f = None
+            try:
                 try:
-                    try:
-                        f = open(fname, 'rb')
-                        expires = pickle.load(f)
-                        remove = expires <= now or idx % 3 == 0
-                    finally:
-                        if f is not None:
-                            f.close()
-                except Exception:
-                    pass
-                if remove:
-                    try:
-                        os.remove(fname)
-                    except (IOError, OSError):
-                        pass
+                    f = open(fname, 'rb')
+                    expires = pickle.load(f)
+                finally:
+                    if f is not None:
+                        f.close()
+                stat = os.stat(fname)
+            except Exception:
+                continue
+            entries.append((os.path.basename(fname), expires, stat.st_size, max(stat.st_atime, stat.st_mtime)))
+
+        # Least recently used first.
+        entries.sort(key=lambda entry: entry[3])
+
+        with self._lock:
+            self._entries = OrderedDict((fname, [expires, size, last_access])
+                                        for fname, expires, size, last_access in entries)
+            self._rebuild_heap()
+        self._sync_index(force=True)
+
+    def _rebuild_heap(self):
+        self._expiry_heap = [(entry[0], fname) for fname, entry in self._entries.iteritems()]
+        heapq.heapify(self._expiry_heap)
+
+    def _sync_index(self, force=False):
+        """ Write the side index to disk, at most once every `_index_sync_interval` seconds unless forced. """
+        now = time()
+        if not force and now - self._index_synced_at < self._index_sync_interval:
+            return
+
+        with self._lock:
+            entries = [(fname, entry[0], entry[1], entry[2]) for fname, entry in self._entries.iteritems()]
+            self._index_synced_at = now
+
+        try:
+            fd, tmp = tempfile.mkstemp(suffix=self._fs_transaction_suffix, dir=self._path)
+            f = os.fdopen(fd, 'wb')
+            try:
+                pickle.dump(entries, f, pickle.HIGHEST_PROTOCOL)
+            finally:
+                f.close()
+            rename(tmp, self._index_path)
+        except (IOError, OSError):
+            pass
+
+    def _record(self, fname, expires, size):
+        """ Add or refresh an entry in the side index as the most recently used. """
+        with self._lock:
+            self._entries.pop(fname, None)
+            self._entries[fname] = [expires, size, time()]
+            heapq.heappush(self._expiry_heap, (expires, fname))
+
+            # Rewrites leave stale pairs in the heap; compact it once they dominate.
+            if len(self._expiry_heap) > 2 * len(self._entries) + 64:
+                self._rebuild_heap()
+
+    def _touch(self, fname):
+        """ Mark an entry as most recently used. """
+        with self._lock:
+            entry = self._entries.pop(fname, None)
+            if entry is not None:
+                entry[2] = time()
+                self._entries[fname] = entry
+
+    def _forget(self, fname):
+        with self._lock:
+            self._entries.pop(fname, None)
+
+    def _remove(self, fname):
+        self._forget(fname)
+        try:
+            os.remove(os.path.join(self._path, fname))
+        except (IOError, OSError):
+            pass
+
+    def _prune(self):
+        """ Bring the cache back under its threshold, removing expired entries first and then the least recently used
+        ones down to two thirds of the threshold, so the sets that follow don't each have to prune again.  Costs
+        O(log n) per removed entry and never lists the cache directory. """
+        if len(self._entries) <= self._threshold:
+            return
+
+        now = time()
+        with self._lock:
+            expired = []
+            while self._expiry_heap and self._expiry_heap[0][0] <= now:
+                expires, fname = heapq.heappop(self._expiry_heap)
+                entry = self._entries.get(fname)
+                if entry is not None and entry[0] == expires:
+                    expired.append(fname)
+                    self._entries.pop(fname)
+
+            evicted = []
+            if len(self._entries) > self._threshold:
+                while len(self._entries) > self._threshold * 2 // 3:
+                    fname, entry = self._entries.popitem(last=False)
+                    evicted.append(fname)
+
+        for fname in expired + evicted:
+            self._remove(fname)
 
     def clear(self):
         for fname in self._list_dir():
@@ -81,6 +218,11 @@ class DotabankFileSystemCache(BaseCache):
             except (IOError, OSError):
                 pass
 
+        with self._lock:
+            self._entries = OrderedDict()
+            self._expiry_heap = []
+        self._sync_index(force=True)
+
     def _get_filename(self, key):
         if isinstance(key, text_type):
             key = key.encode('utf-8') #XXX unicode review
@@ -93,43 +235,399 @@ class DotabankFileSystemCache(BaseCache):
             f = open(filename, 'rb')
             try:
                 if pickle.load(f) >= time() or ignore_expiry:
-                    return pickle.load(f)
+                    value = pickle.load(f)
+                    self._touch(os.path.basename(filename))
+                    return value
             finally:
                 f.close()
         except Exception:
             return None
 
     def add(self, key, value, timeout=None):
+        """ Sets `key` only if it isn't already set, returning whether it was.  The new file is hard linked into place,
+        which fails if one's already there, so of any number of concurrent adds exactly one succeeds. """
         filename = self._get_filename(key)
-        if not os.path.exists(filename):
-            self.set(key, value, timeout)
+        if self.get(key) is None and os.path.exists(filename):
+            # Expired; clear it out of the way.  If another process beats us to replacing it our link fails.
+            self._remove(os.path.basename(filename))
+        return self._write(filename, value, timeout, replace=False)
 
     def set(self, key, value, timeout=None):
+        self._write(self._get_filename(key), value, timeout, replace=True)
+
+    def _write(self, filename, value, timeout, replace):
+        """ Writes an entry to a temporary file, then moves it into place (or, if not `replace`, links it into place
+        if there's nothing there yet).  Returns whether the entry was written. """
         if timeout is None:
             timeout = self.default_timeout
-        filename = self._get_filename(key)
-        self._prune()
+        expires = int(time() + timeout)
         try:
             fd, tmp = tempfile.mkstemp(suffix=self._fs_transaction_suffix,
                                        dir=self._path)
             f = os.fdopen(fd, 'wb')
             try:
-                pickle.dump(int(time() + timeout), f, 1)
+                pickle.dump(expires, f, 1)
                 pickle.dump(value, f, pickle.HIGHEST_PROTOCOL)
+                size = f.tell()
             finally:
                 f.close()
-            rename(tmp, filename)
-            os.chmod(filename, self._mode)
+            os.chmod(tmp, self._mode)
+            if replace:
+                rename(tmp, filename)
+            else:
+                try:
+                    os.link(tmp, filename)
+                finally:
+                    os.remove(tmp)
         except (IOError, OSError):
-            pass
+            return False
+
+        self._record(os.path.basename(filename), expires, size)
+        self._prune()
+        self._sync_index()
+        return True
 
     def delete(self, key):
+        filename = self._get_filename(key)
+        self._forget(os.path.basename(filename))
         try:
-            os.remove(self._get_filename(key))
+            os.remove(filename)
         except (IOError, OSError):
             pass
 
 
+class TieredCache(BaseCache):
+    """A bounded, per-process LRU cache with a TTL which sits in front of another cache (memcached or the file-system
+    cache), so hot keys don't cost a network round trip or a file open and unpickle on every hit.
+
+    The local tier only ever holds entries for up to `local_timeout` seconds, as deletes and overwrites made by other
+    processes can't reach it; keep that short for anything that's invalidated explicitly.
+
+    :param backend: the cache to front.
+    :param threshold: the maximum number of items held in the local tier.
+    :param default_timeout: the default timeout used for the backend if none is given to :meth:`set`.
+    :param local_timeout: the maximum time, in seconds, an item is served from the local tier.
+    """
+
+    def __init__(self, backend, threshold=500, default_timeout=300, local_timeout=60):
+        BaseCache.__init__(self, default_timeout)
+        self.backend = backend
+        self._threshold = threshold
+        self._local_timeout = local_timeout
+        self._local = OrderedDict()  # key => (expires, value), least recently used first
+        self._lock = threading.Lock()
+
+        #: hit/miss counters per tier, for this process
+        self.stats = {
+            'local': {'hits': 0, 'misses': 0},
+            'backend': {'hits': 0, 'misses': 0}
+        }
+
+    def _local_get(self, key):
+        with self._lock:
+            item = self._local.pop(key, None)
+            if item is not None and item[0] > time():
+                self._local[key] = item  # Re-insert as most recently used
+                self.stats['local']['hits'] += 1
+                return pickle.loads(item[1])
+
+            self.stats['local']['misses'] += 1
+            return None
+
+    def _local_set(self, key, value, timeout=None):
+        if value is None:
+            return
+
+        local_timeout = self._local_timeout
+        if timeout:
+            local_timeout = min(timeout, local_timeout)
+
+        # Keep a pickled copy, so callers mutating what they got back can't change what other requests and threads see.
+        value = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+        with self._lock:
+            self._local.pop(key, None)
+            self._local[key] = (time() + local_timeout, value)
+            while len(self._local) > self._threshold:
+                self._local.popitem(last=False)
+
+    def _local_delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._local.pop(key, None)
+
+    def _count_backend(self, value):
+        self.stats['backend']['hits' if value is not None else 'misses'] += 1
+
+    def get(self, key, **kwargs):
+        # Extra arguments (e.g. ignore_expiry) are backend specific, so go straight to the backend for them.
+        if kwargs:
+            return self.backend.get(key, **kwargs)
+
+        value = self._local_get(key)
+        if value is not None:
+            return value
+
+        value = self.backend.get(key)
+        self._count_backend(value)
+        self._local_set(key, value)
+        return value
+
+    def get_many(self, *keys):
+        values = [self._local_get(key) for key in keys]
+        missing = [key for key, value in zip(keys, values) if value is None]
+
+        if missing:
+            fetched = dict(zip(missing, self.backend.get_many(*missing)))
+            for key, value in fetched.iteritems():
+                self._count_backend(value)
+                self._local_set(key, value)
+            values = [fetched[key] if key in fetched else value for key, value in zip(keys, values)]
+
+        return values
+
+    def set(self, key, value, timeout=None):
+        result = self.backend.set(key, value, timeout)
+        self._local_set(key, value, timeout)
+        return result
+
+    def set_many(self, mapping, timeout=None):
+        result = self.backend.set_many(mapping, timeout)
+        for key, value in mapping.iteritems():
+            self._local_set(key, value, timeout)
+        return result
+
+    def _client_key(self, key):
+        """ The key werkzeug's MemcachedCache would send to its client for `key`. """
+        if isinstance(key, text_type):
+            key = key.encode('utf-8')
+        if self.backend.key_prefix:
+            key = self.backend.key_prefix + key
+        return key
+
+    def add(self, key, value, timeout=None):
+        """ Adds `value` only if `key` isn't already set, returning whether it was added. """
+        # Let the backend decide whether the key exists; it's the only tier shared between processes.
+        self._local_delete(key)
+
+        client = getattr(self.backend, '_client', None)
+        if client is None:
+            return bool(self.backend.add(key, value, timeout))
+
+        # werkzeug's MemcachedCache.add throws away the client's result, so ask the client directly.
+        if timeout is None:
+            timeout = self.backend.default_timeout
+        return bool(client.add(self._client_key(key), value, timeout))
+
+    def delete(self, key):
+        self._local_delete(key)
+        return self.backend.delete(key)
+
+    def delete_many(self, *keys):
+        self._local_delete(*keys)
+        return self.backend.delete_many(*keys)
+
+    def clear(self):
+        with self._lock:
+            self._local.clear()
+        return self.backend.clear()
+
+    def inc(self, key, delta=1):
+        """ Adds `delta` to the value cached under `key`, returning the new value.  Unlike werkzeug's caches, a key
+        which isn't cached is left alone (and None returned) rather than set to `delta`. """
+        self._local_delete(key)
+
+        client = getattr(self.backend, '_client', None)
+        if client is None:
+            # Not atomic, but the file system cache is only a fallback for when there's no memcached.
+            value = self.backend.get(key)
+            if value is None:
+                return None
+            self.backend.set(key, value + delta)
+            return value + delta
+
+        # memcached's incr never creates keys anyway; pylibmc raises NotFound for them, python-memcached returns None.
+        try:
+            return client.incr(self._client_key(key), delta) if delta >= 0 \
+                else client.decr(self._client_key(key), -delta)
+        except MemcachedNotFound:
+            return None
+
+    def dec(self, key, delta=1):
+        """ Subtracts `delta` from the value cached under `key`, leaving it alone if it isn't cached; see :meth:`inc`. """
+        return self.inc(key, -delta)
+
+
+class SingleFlightCache(object):
+    """Stampede-protected `cached` and `memoize` decorators, usable in place of those on a Flask-Cache `Cache`.
+
+    Values are stored alongside the time they go stale, and kept in the backend for `stale_timeout` seconds past that.
+    Once a value is stale the first worker to take a lock in the backend recomputes it, while every other worker
+    carries on serving the stale value instead of running the same query.  Within `refresh_ahead` of going stale the
+    lock holder recomputes it on a background thread instead, so nobody waits on it at all.  Workers only wait on each
+    other when there's no value at all to serve, and then for as long as the lock's held (at most `lock_timeout`).
+
+    :param cache: the Flask-Cache `Cache` instance to store values in.  Its backend's `add` must be atomic and return
+                  whether the key was added (as :class:`TieredCache`'s does); backends whose `add` returns None get
+                  no stampede protection.
+    :param stale_timeout: how long, in seconds, a stale value may be served while it's being recomputed.
+    :param lock_timeout: how long, in seconds, a recompute lock is held for before another worker may take over.
+    :param refresh_ahead: the fraction of an entry's timeout before it goes stale at which to start recomputing it.
+    """
+
+    _lock_poll_interval = 0.1
+
+    def __init__(self, cache, stale_timeout=60 * 60, lock_timeout=30, refresh_ahead=0.1):
+        self._cache = cache
+        self.stale_timeout = stale_timeout
+        self.lock_timeout = lock_timeout
+        self.refresh_ahead = refresh_ahead
+
+    @property
+    def backend(self):
+        return self._cache.cache
+
+    def _get_or_compute(self, key, timeout, f, *args, **kwargs):
+        backend = self.backend
+        timeout = timeout or backend.default_timeout
+        lock_key = key + '_lock'
+
+        envelope = backend.get(key)
+        if envelope is not None:
+            value, stale_at = envelope
+            if time() < stale_at - timeout * self.refresh_ahead:
+                return value
+
+        locked = backend.add(lock_key, 1, self.lock_timeout)
+        if locked is None:
+            # The backend can't tell us whether we got the lock, so there's no coordinating with anyone.
+            return self._compute(key, timeout, None, f, *args, **kwargs)
+
+        if not locked:
+            if envelope is not None:
+                # Someone else is already recomputing; keep serving the stale value until they're done.
+                return envelope[0]
+
+            # Someone else is computing a value we don't have at all; wait for it, taking over if they give up (or
+            # their lock expires) without storing anything.
+            deadline = time() + self.lock_timeout
+            while not locked and time() < deadline:
+                sleep(self._lock_poll_interval)
+                envelope = backend.get(key)
+                if envelope is not None:
+                    return envelope[0]
+                locked = backend.add(lock_key, 1, self.lock_timeout)
+
+        if envelope is not None:
+            # Our copy may have come from a TieredCache's local tier, so check the shared tier hasn't already been
+            # refreshed by another process before recomputing.
+            shared = getattr(backend, 'backend', backend).get(key)
+            if shared is not None and shared[1] > envelope[1]:
+                backend.delete(lock_key)
+                backend.set(key, shared, max(shared[1] - time(), 1) + self.stale_timeout)
+                return shared[0]
+
+            if time() < envelope[1]:
+                # Due a refresh but not stale yet; recompute it in the background and serve what we have.
+                self._in_background(self._refresh, key, timeout, lock_key, f, *args, **kwargs)
+                return envelope[0]
+
+        return self._compute(key, timeout, lock_key if locked else None, f, *args, **kwargs)
+
+    def _compute(self, key, timeout, lock_key, f, *args, **kwargs):
+        """ Calls `f` and stores its result under `key`, then releases `lock_key` (if we hold one). """
+        backend = self.backend
+        try:
+            value = f(*args, **kwargs)
+            backend.set(key, (value, time() + timeout), timeout + self.stale_timeout)
+        finally:
+            if lock_key is not None:
+                backend.delete(lock_key)
+
+        return value
+
+    def _refresh(self, *args, **kwargs):
+        try:
+            self._compute(*args, **kwargs)
+        except Exception:
+            if has_app_context():
+                current_app.logger.exception("Background cache refresh failed")
+
+    @staticmethod
+    def _in_background(f, *args, **kwargs):
+        """ Runs `f` on a daemon thread, in a copy of the current request (or app) context if there is one. """
+        if has_request_context():
+            f = copy_current_request_context(f)
+        elif has_app_context():
+            app = current_app._get_current_object()
+            target = f
+
+            def f(*args, **kwargs):
+                with app.app_context():
+                    return target(*args, **kwargs)
+
+        thread = threading.Thread(target=f, args=args, kwargs=kwargs, name="single_flight_refresh")
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def get_or_compute(self, key, f, timeout=None):
+        """ Returns the value cached under `key`, calling `f()` (in at most one worker at a time) to compute it. """
+        return self._get_or_compute(key, timeout, f)
+
+    def cached(self, timeout=None, key_prefix='view/%s'):
+        """ Drop-in replacement for `Cache.cached`. """
+        def decorator(f):
+            @wraps(f)
+            def decorated_function(*args, **kwargs):
+                if '%s' in key_prefix:
+                    cache_key = key_prefix % request.path
+                else:
+                    cache_key = key_prefix
+
+                return self._get_or_compute(cache_key, timeout, f, *args, **kwargs)
+
+            decorated_function.uncached = f
+            return decorated_function
+        return decorator
+
+    def memoize(self, timeout=None):
+        """ Drop-in replacement for `Cache.memoize`.  Arguments are keyed on their repr, so should be simple values. """
+        def decorator(f):
+            namespace = "memoize/{}.{}".format(f.__module__, f.__name__)
+
+            @wraps(f)
+            def decorated_function(*args, **kwargs):
+                cache_key = "{}/{}".format(
+                    namespace,
+                    md5(repr((args, sorted(kwargs.items())))).hexdigest()
+                )
+
+                return self._get_or_compute(cache_key, timeout, f, *args, **kwargs)
+
+            decorated_function.uncached = f
+            return decorated_function
+        return decorator
+
+
+def _tiered(backend, config, kwargs):
+    return TieredCache(
+        backend,
+        threshold=config.get('CACHE_LOCAL_THRESHOLD', 500),
+        default_timeout=kwargs.get('default_timeout', 300),
+        local_timeout=config.get('CACHE_LOCAL_TIMEOUT', 60)
+    )
+
+
 def dotabank_filesystem(app, config, args, kwargs):
     args.append(config['CACHE_DIR'])
     return DotabankFileSystemCache(*args, **kwargs)
+
+
+def tiered_memcached(app, config, args, kwargs):
+    from flask.ext.cache.backends import memcached
+    return _tiered(memcached(app, config, args, kwargs), config, kwargs)
+
+
+def tiered_dotabank_filesystem(app, config, args, kwargs):
+    return _tiered(dotabank_filesystem(app, config, args, kwargs), config, kwargs)
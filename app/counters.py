@@ -0,0 +1,152 @@
+"""
+Row counts kept in memcached, so paginated views don't have to COUNT(*) the table they're paging through.
+
+Each Counter counts a model's rows, optionally per value of a column (e.g. per user) and optionally only those rows where
+a column is or isn't NULL.  Counts are computed on first use, then kept up to date by mapper events as rows are inserted,
+updated and deleted.  Rows written outside of the ORM (by dotabank-gc, bulk queries, or rolled back transactions) make
+them drift, so `reconcile` recounts everything from the database periodically (`manage.py reconcile_counters`).
+"""
+
+from app import mem_cache, db
+from app.models import Log
+from app.replays.models import Replay, ReplayPlayer, ReplayFavourite, ReplayRating, ReplayDownload, Search, ReplayAlias
+from sqlalchemy import event
+from sqlalchemy.orm.attributes import get_history
+
+COUNTER_TIMEOUT = 60 * 60 * 24  # Recomputed from the database at least daily even if reconcile_counters doesn't run.
+
+
+class Counter(object):
+    """ A cached count of `model` rows.
+
+    :param name: unique name, used in cache keys.
+    :param group_by: count rows per value of this column (e.g. `ReplayFavourite.user_id`) rather than in total.
+    :param not_null: count only rows where this column is NULL (`(column, False)`) or not NULL (`(column, True)`).
+    """
+
+    def __init__(self, name, model, group_by=None, not_null=None):
+        self.name = name
+        self.model = model
+        self.group_by = group_by
+        self.not_null = not_null
+
+        event.listen(model, "after_insert", self._after_insert)
+        event.listen(model, "after_update", self._after_update)
+        event.listen(model, "after_delete", self._after_delete)
+
+    def __repr__(self):
+        return "<Counter {}>".format(self.name)
+
+    def _key(self, group=None):
+        return "counter_{}_{}".format(self.name, group)
+
+    def _query(self):
+        query = db.session.query(self.model).order_by(None)
+        if self.not_null is not None:
+            column, is_set = self.not_null
+            query = query.filter(column != None if is_set else column == None)
+        return query
+
+    def get(self, group=None):
+        """ Returns the count (of rows in `group`, for grouped counters), counting them from the database if we have
+        no cached count. """
+        count = mem_cache.get(self._key(group))
+        if count is None:
+            query = self._query()
+            if self.group_by is not None:
+                query = query.filter(self.group_by == group)
+            count = query.count()
+            mem_cache.add(self._key(group), count, timeout=COUNTER_TIMEOUT)
+        return count
+
+    def reconcile(self):
+        """ Recounts every group from the database.  Returns the number of groups counted. """
+        if self.group_by is None:
+            mem_cache.set(self._key(), self._query().count(), timeout=COUNTER_TIMEOUT)
+            return 1
+
+        counts = self._query().with_entities(self.group_by, db.func.count()).group_by(self.group_by).all()
+        mem_cache.set_many({self._key(group): count for group, count in counts}, timeout=COUNTER_TIMEOUT)
+        return len(counts)
+
+    def _membership(self, target, history=False):
+        """ Returns ((counted, group) before, (counted, group) after) for `target`, using attribute history if `history`
+        is set (i.e. during an update's flush).  Returns None if the old values aren't known. """
+        values = {}
+        for attribute in (self.group_by, self.not_null[0] if self.not_null else None):
+            if attribute is None:
+                continue
+            if history:
+                changes = get_history(target, attribute.key)
+                if not changes.has_changes():
+                    old = new = (changes.unchanged or [None])[0]
+                elif changes.deleted:
+                    old, new = changes.deleted[0], (changes.added or [None])[0]
+                else:
+                    return None  # Changed without the old value ever being loaded, so we can't tell which count it was in.
+            else:
+                old = new = getattr(target, attribute.key)
+            values[attribute.key] = (old, new)
+
+        def state(index):
+            counted = True
+            if self.not_null is not None:
+                column, is_set = self.not_null
+                counted = (values[column.key][index] is not None) == is_set
+            group = values[self.group_by.key][index] if self.group_by is not None else None
+            return counted, group
+
+        return state(0), state(1)
+
+    def add(self, delta, group=None):
+        """ Adjusts the cached count, for rows written without going through the ORM. """
+        # TieredCache's inc/dec leave a key which isn't cached alone; it'll be counted from the database when it's next
+        # needed.
+        if delta > 0:
+            mem_cache.cache.inc(self._key(group), delta)
+        elif delta < 0:
+            mem_cache.cache.dec(self._key(group), -delta)
+
+    def _adjust(self, counted, group, delta):
+        if counted:
+            self.add(delta, group)
+
+    def _after_insert(self, mapper, connection, target):
+        old, new = self._membership(target)
+        self._adjust(new[0], new[1], 1)
+
+    def _after_delete(self, mapper, connection, target):
+        old, new = self._membership(target)
+        self._adjust(old[0], old[1], -1)
+
+    def _after_update(self, mapper, connection, target):
+        if self.group_by is None and self.not_null is None:
+            return
+
+        membership = self._membership(target, history=True)
+        if membership is None:
+            return  # Left for reconcile_counters to correct.
+
+        old, new = membership
+        if old != new:
+            self._adjust(old[0], old[1], -1)
+            self._adjust(new[0], new[1], 1)
+
+
+replays = Counter("replays", Replay)
+user_replays = Counter("user_replays", ReplayPlayer, group_by=ReplayPlayer.account_id)
+user_favourites = Counter("user_favourites", ReplayFavourite, group_by=ReplayFavourite.user_id)
+user_ratings = Counter("user_ratings", ReplayRating, group_by=ReplayRating.user_id)
+user_searches = Counter("user_searches", Search, group_by=Search.user_id)
+user_downloads = Counter("user_downloads", ReplayDownload, group_by=ReplayDownload.user_id)
+user_aliases = Counter("user_aliases", ReplayAlias, group_by=ReplayAlias.user_id)
+unresolved_logs = Counter("unresolved_logs", Log, not_null=(Log.resolved_by_user_id, False))
+resolved_logs = Counter("resolved_logs", Log, not_null=(Log.resolved_by_user_id, True))
+
+all_counters = [replays, user_replays, user_favourites, user_ratings, user_searches, user_downloads, user_aliases,
+                unresolved_logs, resolved_logs]
+
+
+def reconcile():
+    """ Recounts every counter from the database.  Returns a dict of counter name => groups counted. """
+    return {counter.name: counter.reconcile() for counter in all_counters}
@@ -13,59 +13,73 @@ What do:
 Run as a cron-job reguarly.  Doesn't handle the pagination of results, so as long as a user has not played >100 games
 between runs we're good.
 
+WebAPI calls are made concurrently through app.webapi, so a run takes about (subscribers / STEAM_API_RATE_LIMIT)
+seconds, and new matches are added in bulk by fetch_league_matches.process_match_list once every call has come back.
+
 Improvements that can be made:
 1) Handle result pagination.
-2) Handle shit asyncronously; we're going to bottleneck with a lot of subs from waiting (WebAPI, DB, AWS queue)
-3) Create ReplayPlayer entries from WebAPI data. (Note: Need to change dotabank-gc behaviour to check for existance of
+2) Create ReplayPlayer entries from WebAPI data. (Note: Need to change dotabank-gc behaviour to check for existance of
 ReplayPlayer entries before doing this, else we could get duplicate DB entries.  Maybe dotabank-gc already behaves. vOv)
 
 """
 
 from app import steam, db  # .info
+from app import webapi
 from app.users.models import Subscription, SubscriptionLastMatch
-from app.replays.models import Replay, ReplayPlayer
+from app.cron.fetch_league_matches import process_match_list
+from calendar import timegm as to_timestamp
+from datetime import datetime
+
+
+def get_match_history(webapi_params):
+    """ Fetches a subscriber's recent matches; runs in the WebAPI thread pool.  Returns None if the call failed. """
+    try:
+        return webapi.call("IDOTA2Match_570", "GetMatchHistory", **webapi_params).get("matches", [])
+    except steam.api.SteamError as e:
+        print "Failed to fetch matches for {}: {}".format(webapi_params["account_id"], e)
+        return None
 
 
 def archive_subscriber_matches():
     subscriptions = Subscription.get_valid_subscriptions()
-
     print "Found {} valid subscribers".format(len(subscriptions))
+    if not subscriptions:
+        return
+
+    # Time of the latest successful match check for every subscriber, in one query.
+    user_ids = [subscription.user_id for subscription in subscriptions]
+    latest_matches = dict(db.session.query(SubscriptionLastMatch.user_id, db.func.max(SubscriptionLastMatch.created_at)).
+                          filter(SubscriptionLastMatch.user_id.in_(user_ids),
+                                 SubscriptionLastMatch.replay_found == True).
+                          group_by(SubscriptionLastMatch.user_id).
+                          all())
+
+    all_webapi_params = []
     for subscription in subscriptions:
-        webapi_params = {
+        latest_match = latest_matches.get(subscription.user_id)
+        all_webapi_params.append({
             "account_id": subscription.user_id,
-            "date_min": None,
+            "date_min": to_timestamp(latest_match.utctimetuple()) if latest_match
+            else subscription.created_at_timestamp,
             "matches_requested": 100  # 100 Max
-        }
+        })
 
-        latest_match = SubscriptionLastMatch.query.\
-            filter(SubscriptionLastMatch.user_id == subscription.user_id,
-                   SubscriptionLastMatch.replay_found == True).\
-            order_by(SubscriptionLastMatch.created_at.desc()).\
-            first()
+    # Noted before making any calls, so the next run's date_min can't skip matches which started while this one ran.
+    checked_at = datetime.utcnow()
+    match_histories = webapi.map_concurrent(get_match_history, all_webapi_params)
 
-        if latest_match:
-            webapi_params["date_min"] = latest_match.created_at_timestamp
-        else:
-            webapi_params["date_min"] = subscription.created_at_timestamp
+    # Log each match check, as well as whether or not we found a match.
+    found_matches = []
+    for webapi_params, matches in zip(all_webapi_params, match_histories):
+        if matches is None:
+            continue
 
-        matches = steam.api.interface("IDOTA2Match_570").GetMatchHistory(**webapi_params).get("result")
-
-        # Log this match check, as well as whether or not we found a match.
-        last_match_log = SubscriptionLastMatch(subscription.user_id, len(matches.get("matches")) > 0)
+        print "Found {} matches for {}".format(len(matches), webapi_params["account_id"])
+        last_match_log = SubscriptionLastMatch(webapi_params["account_id"], len(matches) > 0)
+        last_match_log.created_at = checked_at
         db.session.add(last_match_log)
-        db.session.commit()
-
-        print "Found {} matches for {}".format(len(matches.get("matches")), subscription.user_id)
-        for match in matches.get("matches"):
-            replay_exists = Replay.query.filter(Replay.id == match["match_id"]).count() > 0
-
-            if not replay_exists:
-                replay = Replay(match["match_id"])
-                db.session.add(replay)
-                db.session.commit()
+        found_matches.extend(matches)
 
-                Replay.add_gc_job(replay)
+    db.session.commit()
 
-                print "Added {} to database and job queue".format(match["match_id"])
-            else:
-                print "Match {} already in database, skipping.".format(match["match_id"])
+    process_match_list(found_matches)
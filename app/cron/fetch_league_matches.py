@@ -4,55 +4,114 @@ Downoad and archive league matches
 """
 
 from app import steam, db  # .info
+from app import webapi
 from app.replays.models import Replay, ReplayPlayer
+from app.leagues.models import League, LeagueCrawlState
 
+MATCH_CHUNK_SIZE = 100  # Matches checked, fetched and committed at a time
 
-def get_league_matches(league_id, all_pages=True):
+
+def iter_league_match_pages(league_id, start_at_match_id=None):
     """
-    Queries the WebAPI and fetches the list of matches for the given league ID.
+    Yields pages of a league's matches from the WebAPI, newest first, until there are none left.
 
     @param league_id: The league ID for which we want to find matches.
-    @param all_pages: Whether or not to paginate through the results and return every match, or just the latest 100.
+    @param start_at_match_id: The newest match id to start from, or None to start from the league's latest match.
     """
-    matches = []  # List of matches
-    match_query = None  # Results of WebAPI query.
+    while True:
+        params = {"league_id": league_id}
+        if start_at_match_id is not None:
+            params["start_at_match_id"] = start_at_match_id
+
+        match_query = webapi.call("IDOTA2Match_570", "GetMatchHistory", **params)
+        matches = match_query.get('matches') or []
+        if matches:
+            yield matches
 
-    while match_query is None or (match_query.get('results_remaining') > 0 and all_pages is True):
-        # If we already have some matches, use the last one's match id as the beginning of our query.
-        if len(matches) > 0:
-            match_query = steam.api.interface("IDOTA2Match_570").GetMatchHistory(league_id=league_id, start_at_match_id=matches[-1].get("match_id")).get("result")
-        # Otherwise get whatever
-        else:
-            match_query = steam.api.interface("IDOTA2Match_570").GetMatchHistory(league_id=league_id).get("result")
+        if not matches or match_query.get('results_remaining', 0) <= 0:
+            return
 
-        # Add the new matches to our list of matches
-        matches.extend(match_query.get('matches'))
+        # start_at_match_id is inclusive, so step past the match we've already seen.
+        start_at_match_id = matches[-1]["match_id"] - 1
 
-    return matches
+
+def get_match_details(match_id):
+    """ Fetches a match's details; runs in the WebAPI thread pool.  Returns None if the call failed. """
+    try:
+        return webapi.call("IDOTA2Match_570", "GetMatchDetails", match_id=match_id)
+    except steam.api.SteamError as e:
+        print "Failed to fetch details for match {}: {}".format(match_id, e)
+        return None
 
 
 def process_match_list(matches):
     """ Iterates through a list ofmatches and checks whether we already have them in our database. If we do not then
-    this code will add the match to our database and create an associated GC job. """
-    if len(matches) > 0:
-        for match in matches:
-            replay_exists = Replay.query.filter(Replay.id == match["match_id"]).count() > 0
+    this code will add the match to our database and create an associated GC job.
+
+    Matches are handled MATCH_CHUNK_SIZE at a time: one IN query to find which we already have, the new ones' details
+    fetched concurrently through app.webapi, then added with Replay.add_gc_jobs. """
+    match_ids = sorted(set(match["match_id"] for match in matches))
 
-            if not replay_exists:
-                replay = Replay(match["match_id"])
-                db.session.add(replay)
-                db.session.commit()
+    for i in range(0, len(match_ids), MATCH_CHUNK_SIZE):
+        chunk = match_ids[i:i + MATCH_CHUNK_SIZE]
+        existing_ids = set(_id for _id, in db.session.query(Replay.id).filter(Replay.id.in_(chunk)))
+        for match_id in sorted(existing_ids):
+            print "Match {} already in database, skipping.".format(match_id)
 
-                Replay.add_gc_job(replay)
+        new_ids = [match_id for match_id in chunk if match_id not in existing_ids]
+        if not new_ids:
+            continue
 
-                print "Added {} to database and job queue".format(match["match_id"])
-            else:
-                print "Match {} already in database, skipping.".format(match["match_id"])
+        all_match_data = webapi.map_concurrent(get_match_details, new_ids)
+        replays = [Replay(match_id, skip_webapi=True, match_data=match_data)
+                   for match_id, match_data in zip(new_ids, all_match_data)]
+        queued, failed = Replay.add_gc_jobs(replays)
+
+        for match_id in queued:
+            print "Added {} to database and job queue".format(match_id)
+        for match_id in failed:
+            print "Added {} to database, but failed to add it to the job queue".format(match_id)
 
 
 def fetch_league_matches(league_id):
-    matches = get_league_matches(league_id)
-    process_match_list(matches)
+    """ Crawls a league's match history back to the newest match we'd seen last time, adding any new matches.
+
+    Progress is committed to the league's LeagueCrawlState after every page, so an interrupted crawl resumes from the
+    page it stopped at rather than starting over. """
+    state = LeagueCrawlState.get_or_create(league_id)
+    db.session.commit()
+
+    if state.in_progress:
+        print "Resuming crawl of league {} from match {}".format(league_id, state.resume_match_id)
+
+    for matches in iter_league_match_pages(league_id, state.resume_match_id):
+        new_matches = [match for match in matches
+                       if state.last_match_id is None or match["match_id"] > state.last_match_id]
+        process_match_list(new_matches)
+
+        state.record_page(matches)
+        db.session.commit()
+
+        # Pages run newest to oldest, so once we've hit a match from the last crawl we've caught up.
+        if len(new_matches) < len(matches):
+            break
+
+    state.finish()
+    db.session.commit()
+
+
+def fetch_all_league_matches():
+    """ Runs fetch_league_matches for every league, carrying on past any league whose crawl fails. """
+    league_ids = [_id for _id, in db.session.query(League.id).order_by(League.id)]
+    print "Crawling {} leagues".format(len(league_ids))
+
+    for league_id in league_ids:
+        try:
+            fetch_league_matches(league_id)
+        except steam.api.SteamError as e:
+            db.session.rollback()
+            print "Failed to crawl league {}, will resume next run: {}".format(league_id, e)
+
 
 if __name__ == "__main__":
-    fetch_league_matches()
+    fetch_all_league_matches()
@@ -31,6 +31,12 @@ def should_fix_be_attempted(replay_id, error, extra=None):
         return False
 
 
+def report_failed_jobs(failed, queue_name):
+    """ Prints the replays Replay.add_gc_jobs / add_dl_jobs couldn't queue; they'll be picked up again next run. """
+    for replay_id in failed:
+        print("Failed to re-add replay {} to the {} queue.".format(replay_id, queue_name))
+
+
 def fix_incorrect_player_counts():
     """ Finds and attempts to fix all replays where `Replay.human_players` does not match the quantity of `ReplayPlayer`
     objects we have in the database.
@@ -65,6 +71,7 @@ def fix_incorrect_player_counts():
         )
     )
 
+    to_requeue = []
     for replay_id, human_count, player_count, auto_fix_attempts in human_players_discrepancy:
         if not should_fix_be_attempted(replay_id, _error, {'human_count': human_count, 'player_count': player_count}):
             continue
@@ -74,14 +81,17 @@ def fix_incorrect_player_counts():
             human_count,
             player_count
         ))
-        replay = Replay.query.filter(Replay.id == replay_id).one()
+        replay = Replay.lightweight_query().filter(Replay.id == replay_id).one()
         print("\tDeleting ReplayPlayer objects")
         for player in replay.players:
             db.session.delete(player)
         db.session.commit()
 
         print("\tRe-adding replay to GC queue")
-        Replay.add_gc_job(replay)
+        to_requeue.append(replay)
+
+    queued, failed = Replay.add_gc_jobs(to_requeue)
+    report_failed_jobs(failed, "GC")
 
 
 def fix_small_replays():
@@ -89,49 +99,65 @@ def fix_small_replays():
     """
     _error = "SMALL_REPLAY"
 
-    # FIXME: This step will take longer and longer the more replays we store.  It would be more efficient to store
-    # the filesize in our local database after a file has been archived, and then directly query the database.
-    small_replay_files = {replay_file.key[8:-8]: replay_file.size for replay_file in dotabank_bucket.list()
-                          if replay_file.key[:8] == "replays/" and replay_file.size < (1024 * 1024)}
-
-    small_replays = db.session.query(Replay, db.func.count(ReplayAutoFix.id)).filter(
-        Replay.state == "ARCHIVED",                 # Ignore non-archived files (they shouldnt be in s3 if they aren't archived, but vOv)
-        Replay.id.in_(small_replay_files.keys()),   # Check the replays that the S3 call above has flagged as small
-        ReplayAutoFix.replay_id == Replay.id
+    small_replays = db.session.query(Replay, db.func.count(ReplayAutoFix.id)).outerjoin(
+        ReplayAutoFix, ReplayAutoFix.replay_id == Replay.id
+    ).filter(
+        Replay.state == "ARCHIVED",                     # Ignore non-archived files (they shouldnt be in s3 if they aren't archived, but vOv)
+        Replay.file_size < Replay.SMALL_FILE_SIZE       # Indexed; sizes are recorded when a file is archived
     ).group_by(
-        ReplayAutoFix.replay_id
+        Replay.id
     ).having(
         db.func.count(ReplayAutoFix.id) < app.config.get('MAX_REPLAY_FIX_ATTEMPTS')  # Ignore replays that have exceeded max fix attempts
     ).all()
 
+    to_requeue = []
     for replay, fix_attempts in small_replays:
         if not should_fix_be_attempted(replay.id, _error, extra={
-            'file_size': small_replay_files[unicode(replay.id)]
+            'file_size': replay.file_size
         }):
             continue
 
         print ("Replay {} has a small file stored on s3 ({} bytes).  Re-adding to DL queue.".format(
             replay.id,
-            small_replay_files[unicode(replay.id)]
+            replay.file_size
         ))
         replay.state = "WAITING_GC"  # Switch state back to WAITING_GC.
-        Replay.add_dl_job(replay)
+        replay.clear_archived_file()  # Recorded again once the file's been replaced
+        to_requeue.append(replay)
+
+    queued, failed = Replay.add_dl_jobs(to_requeue)
+    report_failed_jobs(failed, "DL")
 
 
 def fix_missing_files():
     """ Finds replays set as "ARCHIVED" that are missing a corresponding file stored in S3. Re-adds them
-        to GC queue. """
+        to GC queue.
+
+        Archived replays with a recorded file size are assumed to have their file; the rest are checked against S3
+        individually, and have their file details recorded if it turns out they do. """
     _error = "MISSING_S3_FILE"
 
-    all_s3_replay_ids = [replay_file.key[8:-8] for replay_file in dotabank_bucket.list() if replay_file.key[:8] == "replays/"]
-    archived_replays_no_file = Replay.query.filter(Replay.state == 'ARCHIVED', Replay.id.notin_(all_s3_replay_ids)).all()
+    candidates = Replay.lightweight_query().filter(
+        Replay.state == 'ARCHIVED',
+        db.or_(Replay.local_uri == None, Replay.file_size == None)
+    ).all()
+
+    archived_replays_no_file = []
+    for replay in candidates:
+        key = dotabank_bucket.get_key(replay.local_uri or "replays/{}.dem.bz2".format(replay.id))
+        if key is not None:
+            replay.record_archived_file(key)
+            db.session.add(replay)
+        else:
+            archived_replays_no_file.append(replay)
+    db.session.commit()
 
+    to_requeue = []
     for replay in archived_replays_no_file:
         if not should_fix_be_attempted(replay.id, _error):
             # Tag as "DOWNLOAD_ERROR" because we can't fix this - the problem is entirely in Valve (or their partners) domain.
             replay.state = "DOWNLOAD_ERROR"
-            replay.local_uri = None
-            replay.dl_done_time = None
+            replay.clear_archived_file()
             db.session.add(replay)
             db.session.commit()
             continue
@@ -140,24 +166,27 @@ def fix_missing_files():
             replay.id
         ))
         replay.state = "WAITING_DOWNLOAD"  # Switch state back to WAITING_DOWNLOAD.
-        Replay.add_dl_job(replay)
+        to_requeue.append(replay)
+
+    queued, failed = Replay.add_dl_jobs(to_requeue)
+    report_failed_jobs(failed, "DL")
 
 
 def fix_long_waiting_download():
     """  Finds replays that have been "WAITING_DOWNLOAD" for over 24 hours, and re-adds them to the GC queue. """
     _error = "LONGEST_WAIT_OF_MY_LIFE"
 
-    replay_waiting_download_over24hrs = Replay.query.filter(
+    replay_waiting_download_over24hrs = Replay.lightweight_query().filter(
         Replay.state == "WAITING_DOWNLOAD",
         Replay.gc_done_time <= (datetime.utcnow() - timedelta(hours=24))  # Over 24 hrs ago
     ).all()
 
+    to_requeue = []
     for replay in replay_waiting_download_over24hrs:
         if not should_fix_be_attempted(replay.id, _error):
             # Tag as "DOWNLOAD_ERROR" because we can't fix this - the problem is entirely in Valve (or their partners) domain.
             replay.state = "DOWNLOAD_ERROR"
-            replay.local_uri = None
-            replay.dl_done_time = None
+            replay.clear_archived_file()
             db.session.add(replay)
             db.session.commit()
             continue
@@ -167,4 +196,7 @@ def fix_long_waiting_download():
             replay.id
         ))
         replay.state = "WAITING_DOWNLOAD"  # Switch state back to WAITING_DOWNLOAD.
-        Replay.add_dl_job(replay)
\ No newline at end of file
+        to_requeue.append(replay)
+
+    queued, failed = Replay.add_dl_jobs(to_requeue)
+    report_failed_jobs(failed, "DL")
@@ -0,0 +1,128 @@
+#!/srv/www/dotabank.com/dotabank-web/bin/python
+"""
+Re-fetch every replay's match details from the WebAPI
+"""
+
+from app import app, db, mem_cache, counters
+from app import webapi
+from app.replays.models import Replay
+from app.cron.fetch_league_matches import get_match_details
+from time import time
+import threading
+
+CHUNK_SIZE = 100  # Replays fetched and committed at a time
+PROGRESS_KEY = "replay_repopulate_progress"
+LOCK_KEY = "replay_repopulate_lock"
+LOCK_TIMEOUT = 60 * 10  # Seconds; a job which hasn't reported progress for this long is presumed dead.
+
+
+def get_progress():
+    """ Returns the progress of the current (or last) repopulate job, or None if there hasn't been one recently. """
+    return mem_cache.get(PROGRESS_KEY)
+
+
+def _lock():
+    """ Claims the job lock and resets the progress report.  Returns False if another job holds the lock. """
+    # Flask-Cache's add proxy drops the backend's result, so ask the backend (a TieredCache) directly.
+    if not mem_cache.cache.add(LOCK_KEY, True, timeout=LOCK_TIMEOUT):
+        return False
+
+    mem_cache.set(PROGRESS_KEY, {
+        "state": "starting",
+        "total": 0,
+        "done": 0,
+        "updated": 0,
+        "failed": [],
+        "started_at": time(),
+        "eta": None
+    }, timeout=LOCK_TIMEOUT)
+    return True
+
+
+def repopulate_replays(chunk_size=CHUNK_SIZE, on_progress=None, locked=False):
+    """ Re-fetches match details for every replay, `chunk_size` replays at a time: their details fetched concurrently
+    through app.webapi, then written and committed together.  Progress is kept in mem_cache for `get_progress`, and
+    passed to `on_progress` after every chunk.
+
+    Returns the final progress dict, or None if another repopulate job is already running.
+    """
+    if not locked and not _lock():
+        return None
+
+    started_at = time()
+    progress = {
+        "state": "running",
+        "total": 0,
+        "done": 0,
+        "updated": 0,
+        "failed": [],
+        "started_at": started_at,
+        "eta": None
+    }
+
+    try:
+        progress["total"] = counters.replays.get()
+        mem_cache.set(PROGRESS_KEY, progress, timeout=LOCK_TIMEOUT)
+
+        last_id = 0
+        while True:
+            replay_ids = [_id for _id, in db.session.query(Replay.id).
+                          filter(Replay.id > last_id).
+                          order_by(Replay.id.asc()).
+                          limit(chunk_size)]
+            if not replay_ids:
+                break
+
+            details = dict(zip(replay_ids, webapi.map_concurrent(get_match_details, replay_ids)))
+
+            # We only need the replays' own columns, not their players, ratings and favourites.
+            for replay in Replay.lightweight_query().filter(Replay.id.in_(replay_ids)):
+                if details.get(replay.id):
+                    replay._populate_from_webapi(details[replay.id])
+                    progress["updated"] += 1
+                else:
+                    progress["failed"].append(replay.id)
+            db.session.commit()
+
+            last_id = replay_ids[-1]
+            progress["done"] += len(replay_ids)
+            elapsed = time() - started_at
+            progress["eta"] = elapsed / progress["done"] * max(progress["total"] - progress["done"], 0)
+            mem_cache.set(PROGRESS_KEY, progress, timeout=LOCK_TIMEOUT)
+            mem_cache.set(LOCK_KEY, True, timeout=LOCK_TIMEOUT)
+            if on_progress is not None:
+                on_progress(progress)
+
+        progress["state"] = "done"
+    except Exception as e:
+        db.session.rollback()
+        progress["state"] = "error"
+        progress["error"] = repr(e)
+        raise
+    finally:
+        progress["eta"] = None
+        progress["finished_at"] = time()
+        mem_cache.set(PROGRESS_KEY, progress, timeout=60 * 60 * 24)
+        mem_cache.delete(LOCK_KEY)
+
+    return progress
+
+
+def start_repopulate_replays(chunk_size=CHUNK_SIZE):
+    """ Runs `repopulate_replays` on a background thread.  Returns False if a repopulate job is already running. """
+    if not _lock():
+        return False
+
+    def run():
+        with app.app_context():
+            try:
+                repopulate_replays(chunk_size, locked=True)
+            except Exception:
+                app.logger.exception("Replay repopulate job failed")
+            finally:
+                db.session.remove()
+
+    thread = threading.Thread(target=run, name="repopulate_replays")
+    thread.daemon = True
+    thread.start()
+    return True
@@ -1,10 +1,11 @@
 import datetime
 from sqlalchemy import distinct
-from app import steam, fs_cache, sentry, db
+from app import steam, fs_cache, mem_cache, sentry, db
 from flask import current_app, url_for, g
 import requests
 import json
 import sys
+from time import time
 
 HERO_DATA_URL = "https://raw.githubusercontent.com/dotabuff/d2vpk/master/json/dota_pak01/scripts/npc/npc_heroes.json"
 ITEM_DATA_URL = "https://raw.githubusercontent.com/dotabuff/d2vpk/master/json/dota_pak01/scripts/npc/items.json"
@@ -24,9 +25,19 @@ class Hero(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
     updated_at = db.Column(db.DateTime, onupdate=datetime.datetime.utcnow)
 
-    # Relationship with players
-    replay_players = db.relationship('ReplayPlayer', backref=db.backref('hero', lazy="joined"), lazy="dynamic")
-    replays = db.relationship('Replay', secondary='replay_players', backref=db.backref('heroes', lazy="joined"), lazy="dynamic")
+    # Relationship with players.  ReplayPlayer.hero reads from the in-process registry below instead of a backref.
+    replay_players = db.relationship('ReplayPlayer', lazy="dynamic")
+    replays = db.relationship('Replay', secondary='replay_players', lazy="dynamic")
+
+    # In-process hero registry, loaded once per worker and reloaded when update_data bumps the version in mem_cache.
+    _heroes = None  # List of all heroes, ordered by name
+    _heroes_by_id = None
+    _heroes_by_token = None
+    _heroes_by_name = None
+    _heroes_version = None  # Value of _VERSION_CACHE_KEY the registry was loaded at
+    _heroes_checked_at = None
+    _VERSION_CACHE_KEY = "hero_data_version"
+    _VERSION_CHECK_INTERVAL = 60  # Seconds between mem_cache version checks
 
     def __init__(self, _id, token):
         self.id = _id
@@ -94,12 +105,60 @@ class Hero(db.Model):
             _hero.name = cls.token_to_name(key)
             db.session.add(_hero)
 
-        return db.session.commit()
+        db.session.commit()
+
+        # Tell every worker's hero registry to reload.
+        mem_cache.set(cls._VERSION_CACHE_KEY, time(), timeout=0)
 
     @staticmethod
     def token_to_name(token):
         return token.replace('npc_dota_hero_', '')
 
+    @classmethod
+    def get_all(cls):
+        """ Returns every hero ordered by name, from the in-process registry. """
+        now = time()
+        if cls._heroes is None or now - cls._heroes_checked_at > cls._VERSION_CHECK_INTERVAL:
+            version = mem_cache.get(cls._VERSION_CACHE_KEY)
+            if cls._heroes is None or version != cls._heroes_version:
+                cls._load(version)
+            cls._heroes_checked_at = now
+
+        return cls._heroes
+
+    @classmethod
+    def _load(cls, version):
+        """ Loads every hero from the database into the registry and rebuilds its indexes. """
+        heroes = cls.query.order_by(cls.name).all()
+
+        # Detach from the session so the registry outlives this request without being expired or refreshed.
+        for hero in heroes:
+            db.session.expunge(hero)
+
+        cls._heroes_by_id = {hero.id: hero for hero in heroes}
+        cls._heroes_by_token = {hero.token: hero for hero in heroes}
+        cls._heroes_by_name = {hero.name: hero for hero in heroes}
+        cls._heroes = heroes
+        cls._heroes_version = version
+
+    @classmethod
+    def get_by_id(cls, _id):
+        """ Returns the Hero with the given id, or None. """
+        cls.get_all()
+        return cls._heroes_by_id.get(_id)
+
+    @classmethod
+    def get_by_token(cls, token):
+        """ Returns the Hero with the given token (e.g. npc_dota_hero_crystal_maiden), or None. """
+        cls.get_all()
+        return cls._heroes_by_token.get(token)
+
+    @classmethod
+    def get_by_name(cls, name):
+        """ Returns the Hero with the given name (e.g. crystal_maiden), or None. """
+        cls.get_all()
+        return cls._heroes_by_name.get(name)
+
 
 class Item:
     """ Represents a Dota 2 item """
@@ -108,7 +167,11 @@ class Item:
     token = None
 
     _items = None
+    _items_by_id = None  # id => Item index over _items
+    _items_by_token = None  # token => Item index over _items
+    _items_loaded_at = None
     _CACHE_KEY = "items"
+    _CACHE_TIMEOUT = 60 * 60
 
     def __init__(self, _id, token=None):
         self.id = _id
@@ -126,7 +189,7 @@ class Item:
         return url_for('item_icon', item_filename="{}_lg.png".format(self.token[5:]))
 
     @classmethod
-    @fs_cache.cached(timeout=60 * 60, key_prefix=_CACHE_KEY)
+    @fs_cache.cached(timeout=_CACHE_TIMEOUT, key_prefix=_CACHE_KEY)
     def fetch_items(cls):
         """ Fetch a list of items via the game's npc_items.txt
 
@@ -175,28 +238,38 @@ class Item:
 
     @classmethod
     def get_all(cls):
-        if cls._items is None:
-            cls._items = cls.fetch_items()
+        # Reload once the fs_cache entry we were built from has expired, so refreshed data reaches long-lived workers.
+        if cls._items is None or time() - cls._items_loaded_at > cls._CACHE_TIMEOUT:
+            cls._load(cls.fetch_items())
 
         return cls._items
 
+    @classmethod
+    def _load(cls, items):
+        """ Stores the given list of items and rebuilds the id and token indexes over it. """
+        items_by_id = {}
+        items_by_token = {}
+        for item in items:
+            # First definition wins, matching what a linear scan of the list would return.
+            items_by_id.setdefault(item.id, item)
+            items_by_token.setdefault(item.token, item)
+
+        cls._items = items
+        cls._items_by_id = items_by_id
+        cls._items_by_token = items_by_token
+        cls._items_loaded_at = time()
+
     @classmethod
     def get_by_id(cls, _id):
         """ Returns an Item object for the given item id. """
-        for item in cls.get_all():
-            if item.id == _id:
-                return item
-
-        return None
+        cls.get_all()
+        return cls._items_by_id.get(_id)
 
     @classmethod
     def get_by_token(cls, token):
         """ Returns an Item object for the given item name. """
-        for item in cls.get_all():
-            if item.token == token:
-                return item
-
-        return None
+        cls.get_all()
+        return cls._items_by_token.get(token)
 
 
 class Schema():
@@ -258,7 +331,11 @@ class Region():
     clusters = None
 
     _regions = None  # List of all regions
+    _regions_by_id = None  # id => Region index over _regions
+    _regions_by_cluster = None  # cluster id => Region index over _regions
+    _regions_loaded_at = None
     _CACHE_KEY = "region"  # Key for fscache of this file
+    _CACHE_TIMEOUT = 60 * 60
 
     @property
     def localized_name(self):
@@ -275,7 +352,7 @@ class Region():
         return self.localized_name
 
     @classmethod
-    @fs_cache.cached(timeout=60 * 60, key_prefix=_CACHE_KEY)
+    @fs_cache.cached(timeout=_CACHE_TIMEOUT, key_prefix=_CACHE_KEY)
     def fetch_regions(cls):
         """ Fetch a list of regions via the game's regions.txt
 
@@ -331,28 +408,39 @@ class Region():
 
     @classmethod
     def get_all(cls):
-        if cls._regions is None:
-            cls._regions = cls.fetch_regions()
+        # Reload once the fs_cache entry we were built from has expired, so refreshed data reaches long-lived workers.
+        if cls._regions is None or time() - cls._regions_loaded_at > cls._CACHE_TIMEOUT:
+            cls._load(cls.fetch_regions())
 
         return cls._regions
 
+    @classmethod
+    def _load(cls, regions):
+        """ Stores the given list of regions and rebuilds the id and cluster indexes over it. """
+        regions_by_id = {}
+        regions_by_cluster = {}
+        for region in regions:
+            # First definition wins, matching what a linear scan of the list would return.
+            regions_by_id.setdefault(region.id, region)
+            for cluster_id in region.clusters or []:
+                regions_by_cluster.setdefault(cluster_id, region)
+
+        cls._regions = regions
+        cls._regions_by_id = regions_by_id
+        cls._regions_by_cluster = regions_by_cluster
+        cls._regions_loaded_at = time()
+
     @classmethod
     def get_by_id(cls, _id):
         """ Returns a Region object for the given region id. """
-        for item in cls.get_all():
-            if item.id == _id:
-                return item
-
-        return None
+        cls.get_all()
+        return cls._regions_by_id.get(_id)
 
     @classmethod
     def get_by_cluster(cls, cluster_id):
         """ Returns a Region object for the given cluster id. """
-        for item in cls.get_all():
-            if cluster_id in item.clusters:
-                return item
-
-        return None
+        cls.get_all()
+        return cls._regions_by_cluster.get(cluster_id)
 
 
 class Localization():
@@ -1,6 +1,7 @@
-from flask import Blueprint, render_template, current_app, abort, g
+from flask import Blueprint, render_template, current_app, abort, g, redirect, url_for
 from sqlalchemy import distinct
 from app.replays.models import Replay, ReplayPlayer
+from app.pagination import KeysetPagination, approximate_count
 from app import db, mem_cache
 from models import Hero
 
@@ -8,16 +9,19 @@ hero_mod = Blueprint("heroes", __name__, url_prefix="/heroes")
 
 @hero_mod.before_app_request
 def add_heroes_to_globals():
-    g.all_heroes = Hero.query.order_by(Hero.name).all()
+    g.all_heroes = Hero.get_all()
 
 @hero_mod.route("/")
 def heroes():
-    _heroes_and_replay_counts = db.session.query(db.func.count(distinct(ReplayPlayer.replay_id)), Hero)\
-        .join(ReplayPlayer.hero)\
+    _hero_ids_and_replay_counts = db.session.query(db.func.count(distinct(ReplayPlayer.replay_id)), ReplayPlayer.hero_id)\
+        .filter(ReplayPlayer.hero_id != None)\
         .group_by(ReplayPlayer.hero_id)\
         .order_by(db.func.count(distinct(ReplayPlayer.replay_id)).desc())\
         .all()
 
+    _heroes_and_replay_counts = [(count, Hero.get_by_id(hero_id)) for count, hero_id in _hero_ids_and_replay_counts
+                                 if Hero.get_by_id(hero_id) is not None]
+
     return render_template("dota/heroes.html",
                            title="Heroes - Dotabank",
                            heroes_and_replay_counts=_heroes_and_replay_counts)
@@ -25,19 +29,26 @@ def heroes():
 
 @hero_mod.route("/<string:_name>/")
 @hero_mod.route("/<string:_name>/page/<int:page>")
-def hero(_name, page=1):
-    _hero = Hero.query.filter(Hero.name == _name).one()
+def hero(_name, page=None):
+    _hero = Hero.get_by_name(_name)
 
     if _hero is None:
         abort(404)
 
-    _replays = _hero.replays.\
-        order_by(Replay.id.desc()).\
-        paginate(page, current_app.config["REPLAYS_PER_PAGE"], False)
+    if page is not None:
+        return redirect(url_for("heroes.hero", _name=_name), 301)  # Numbered pages replaced by keyset pagination
+
+    _query = Replay.query.\
+        join(ReplayPlayer, ReplayPlayer.replay_id == Replay.id).\
+        filter(ReplayPlayer.hero_id == _hero.id)
+    _replays = KeysetPagination.from_request(Replay.list_query(_query),
+                                             (Replay.id,),
+                                             current_app.config["REPLAYS_PER_PAGE"],
+                                             total=approximate_count("hero_{}".format(_hero.id), _query))
+    Replay.prefetch_listing_profiles(_replays.items)
 
     return render_template("dota/hero.html",
                            title=u"{} - Dotabank".format(_hero.localized_name),
                            meta_description=u"Replays archived for {}".format(_hero.localized_name),
                            hero=_hero,
-                           replays=_replays,
-                           page=page)
\ No newline at end of file
+                           replays=_replays)
\ No newline at end of file
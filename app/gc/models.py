@@ -1,4 +1,5 @@
 from app import db
+from sqlalchemy import bindparam
 import datetime
 
 # noinspection PyShadowingBuiltins
@@ -27,11 +28,7 @@ class GCWorker(db.Model):
         :param hours:
         :return: Int
         """
-        return GCJob.query.filter(
-            GCJob.worker_id == self.id,
-            GCJob.type == "MATCH_REQUEST",
-            GCJob.timestamp >= (datetime.datetime.utcnow() - datetime.timedelta(hours=hours))
-        ).count()
+        return GCJobRollup.job_counts(hours).get(self.id, {}).get("MATCH_REQUEST", 0)
 
 
 # noinspection PyShadowingBuiltins
@@ -48,3 +45,150 @@ class GCJob(db.Model):
 
     def __repr__(self):
         return "<GCJob {}>".format(self.id)
+
+
+class GCJobRollupState(db.Model):
+    """ How far `GCJobRollup.roll_up` has got through gc_jobs.  A single row. """
+    __tablename__ = "gc_job_rollup_state"
+
+    ROW_ID = 1
+
+    id = db.Column(db.Integer, primary_key=True)
+    last_job_id = db.Column(db.Integer, nullable=False, default=0)
+    rolled_up_at = db.Column(db.DateTime)
+
+    def __init__(self):
+        self.id = GCJobRollupState.ROW_ID
+        self.last_job_id = 0
+
+    def __repr__(self):
+        return "<GCJobRollupState {}>".format(self.last_job_id)
+
+
+class GCJobRollup(db.Model):
+    """ GC jobs per worker, per type, per hour, rolled up from gc_jobs by `roll_up` so utilisation reports don't have to
+    count the raw jobs.  `last_job_id` is the highest job id counted into each row; how far we've got overall is kept
+    in GCJobRollupState. """
+    __tablename__ = "gc_job_rollups"
+
+    starts_at = db.Column(db.DateTime, primary_key=True)
+    worker_id = db.Column(db.Integer, db.ForeignKey("gc_workers.id", ondelete="CASCADE"), primary_key=True,
+                          autoincrement=False)
+    type = db.Column(db.String(16), primary_key=True)
+    job_count = db.Column(db.Integer, nullable=False, default=0)
+    last_job_id = db.Column(db.Integer, nullable=False, index=True)
+
+    BATCH_SIZE = 50000
+    LAG = datetime.timedelta(minutes=1)  # Leave jobs this recent for the next run, in case an earlier id commits later.
+
+    def __repr__(self):
+        return "<GCJobRollup {} {}/{}>".format(self.worker_id, self.type, self.starts_at)
+
+    @staticmethod
+    def _hour(dt):
+        return dt.replace(minute=0, second=0, microsecond=0)
+
+    @classmethod
+    def _rolled_up_to(cls):
+        """ Query for the id of the last job rolled up. """
+        return db.session.query(db.func.coalesce(db.func.max(GCJobRollupState.last_job_id), 0))
+
+    @classmethod
+    def roll_up(cls, batch_size=None):
+        """ Adds every GC job since the last run to the hourly rollups, a batch at a time, stopping at the first job
+        within LAG of now.  Returns the number of jobs rolled up. """
+        batch_size = batch_size or cls.BATCH_SIZE
+        table = cls.__table__
+        cutoff = datetime.datetime.utcnow() - cls.LAG
+
+        rolled_up = 0
+        while True:
+            # Each batch commits, so take the row lock afresh for every one; overlapping runs then take turns rather
+            # than both rolling up the same jobs.
+            state = GCJobRollupState.query.with_lockmode('update').populate_existing().get(GCJobRollupState.ROW_ID)
+            if state is None:
+                state = GCJobRollupState()
+                db.session.add(state)
+
+            jobs = db.session.query(GCJob.id, GCJob.worker_id, GCJob.type, GCJob.timestamp).\
+                filter(GCJob.id > state.last_job_id).\
+                order_by(GCJob.id.asc()).\
+                limit(batch_size).\
+                all()
+            finished = len(jobs) < batch_size
+
+            # Stop at (rather than skip) the first recent job, as jobs before it by id may still be to commit, and
+            # anything after it would move us past them for good.
+            for i, (_id, worker_id, _type, timestamp) in enumerate(jobs):
+                if timestamp is not None and timestamp >= cutoff:
+                    jobs = jobs[:i]
+                    finished = True
+                    break
+            if not jobs:
+                break
+
+            counts = {}
+            for _id, worker_id, _type, timestamp in jobs:
+                if timestamp is None:
+                    continue
+                key = (cls._hour(timestamp), worker_id, _type)
+                job_count, last_job_id = counts.get(key, (0, 0))
+                counts[key] = (job_count + 1, max(last_job_id, _id))
+
+            existing = set(db.session.query(cls.starts_at, cls.worker_id, cls.type).
+                           filter(cls.starts_at.in_(set(key[0] for key in counts))))
+            rows = [{'_starts_at': key[0], '_worker_id': key[1], '_type': key[2],
+                     '_count': value[0], '_last_id': value[1]}
+                    for key, value in counts.iteritems()]
+
+            updates = [row for row in rows if (row['_starts_at'], row['_worker_id'], row['_type']) in existing]
+            if updates:
+                db.session.execute(
+                    table.update().
+                    where(db.and_(table.c.starts_at == bindparam('_starts_at'),
+                                  table.c.worker_id == bindparam('_worker_id'),
+                                  table.c.type == bindparam('_type'))).
+                    values(job_count=table.c.job_count + bindparam('_count'),
+                           last_job_id=bindparam('_last_id')),
+                    updates
+                )
+            inserts = [{'starts_at': row['_starts_at'], 'worker_id': row['_worker_id'], 'type': row['_type'],
+                        'job_count': row['_count'], 'last_job_id': row['_last_id']}
+                       for row in rows if (row['_starts_at'], row['_worker_id'], row['_type']) not in existing]
+            if inserts:
+                db.session.execute(table.insert(), inserts)
+
+            state.last_job_id = jobs[-1][0]
+            state.rolled_up_at = datetime.datetime.utcnow()
+            db.session.commit()
+
+            rolled_up += len(jobs)
+            if finished:
+                break
+
+        db.session.commit()  # Release the state row's lock if we stopped without rolling anything up.
+        return rolled_up
+
+    @classmethod
+    def job_counts(cls, hours=24):
+        """ Returns {worker id: {job type: count}} for every worker's jobs in the past `hours` hours, in two queries:
+        one over the hourly rollups, plus one over the jobs that haven't been rolled up yet.
+
+        The window is rounded down to the start of the hour, so may cover up to an hour more than `hours`.
+        """
+        since = cls._hour(datetime.datetime.utcnow() - datetime.timedelta(hours=hours))
+
+        counts = {}
+        rolled_up = db.session.query(cls.worker_id, cls.type, db.func.sum(cls.job_count)).\
+            filter(cls.starts_at >= since).\
+            group_by(cls.worker_id, cls.type)
+        tail = db.session.query(GCJob.worker_id, GCJob.type, db.func.count(GCJob.id)).\
+            filter(GCJob.id > cls._rolled_up_to().as_scalar(),
+                   GCJob.timestamp >= since).\
+            group_by(GCJob.worker_id, GCJob.type)
+
+        for worker_id, _type, count in rolled_up.all() + tail.all():
+            worker_counts = counts.setdefault(worker_id, {})
+            worker_counts[_type] = worker_counts.get(_type, 0) + int(count)
+
+        return counts
@@ -1,16 +1,17 @@
-from app import app, mem_cache
+from app import app, locked_mem_cache
 from app.admin.views import AdminModelView
 from wtforms import PasswordField
-from models import GCWorker
+from models import GCWorker, GCJobRollup
 from helpers import AESCipher
 
 
 @app.context_processor
-@mem_cache.cached(timeout=60*60, key_prefix="gc_load")
+@locked_mem_cache.cached(timeout=60*60, key_prefix="gc_load")
 def inject_gc_load():
     gc_workers = GCWorker.query.all()
     max_capacity = app.config['GC_MATCH_REQUSTS_RATE_LIMIT'] * len(gc_workers)
-    jobs_processed = sum(w.job_count() for w in gc_workers)
+    job_counts = GCJobRollup.job_counts(24)
+    jobs_processed = sum(job_counts.get(w.id, {}).get("MATCH_REQUEST", 0) for w in gc_workers)
 
     return dict(
         gc_jobs_processed=jobs_processed,
@@ -1,30 +1,138 @@
 from app import db
 from app.models import Log
 
+from datetime import datetime
 import json
 import logging
+import os
+import Queue
+import sys
+import threading
 import traceback
 
 
 class SQLAlchemyHandler(logging.Handler):
-    """ Logging handler which commits log entries to the database. """
+    """ Logging handler which writes log entries to the database.
+
+    `emit` only puts the entry on a queue; a background thread writes them out in batches of up to `batch_size`, at
+    least every `flush_interval` seconds, with one multi-row INSERT on its own connection.  The request's session is
+    never touched.  When the queue is full new entries are dropped, and a count of what was dropped is logged once
+    there's room again.
+    """
+
+    def __init__(self, batch_size=50, flush_interval=5, queue_size=1000):
+        logging.Handler.__init__(self)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = Queue.Queue(maxsize=queue_size)
+        self.dropped = 0
+        self._stopping = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def _ensure_thread(self):
+        """ Starts the writer thread on first use, and again in forked workers, which don't inherit it. """
+        if self._pid == os.getpid() and self._thread.is_alive():
+            return
+
+        with self.lock:
+            if self._pid != os.getpid() or not self._thread.is_alive():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name="SQLAlchemyHandler")
+                self._thread.daemon = True
+                self._thread.start()
 
     def emit(self, record):  # TODO: Store IP and endpoint accessed.
         """ Catch the log entry, grab any traceback data and any extra data if provided. """
-        trace = traceback.format_exc(record.__dict__['exc_info']) if record.__dict__['exc_info'] else None
-        extra = json.dumps(record.__dict__['extra']) if "extra" in record.__dict__ else None
+        try:
+            trace = traceback.format_exc(record.__dict__['exc_info']) if record.__dict__['exc_info'] else None
+            extra = json.dumps(record.__dict__['extra']) if "extra" in record.__dict__ else None
+
+            row = {
+                'logger': record.__dict__['name'],
+                'level': record.__dict__['levelname'],
+                'trace': trace,
+                'msg': record.__dict__['msg'],
+                'extra': extra,
+                'created_at': datetime.utcfromtimestamp(record.created)
+            }
+        except Exception:
+            self.handleError(record)
+            return
+
+        self._ensure_thread()
+        try:
+            self.queue.put_nowait(row)
+        except Queue.Full:
+            self.dropped += 1
+
+    def _next_batch(self, timeout):
+        """ Waits up to `timeout` seconds for entries, returning as soon as there's a full batch. """
+        batch = []
+        try:
+            batch.append(self.queue.get(timeout=timeout))
+            while len(batch) < self.batch_size:
+                batch.append(self.queue.get_nowait())
+        except Queue.Empty:
+            pass
+        return batch
+
+    def _dropped_row(self):
+        """ A log entry recording how many entries were dropped since the last one, if any were. """
+        dropped, self.dropped = self.dropped, 0
+        if not dropped:
+            return None
+        return {
+            'logger': __name__,
+            'level': 'WARNING',
+            'trace': None,
+            'msg': "Log queue full; dropped {} log entries.".format(dropped),
+            'extra': None,
+            'created_at': datetime.utcnow()
+        }
+
+    def _write(self, rows):
+        """ Inserts `rows` on a connection of our own.  Errors go to stderr, as logging them would just requeue them. """
+        if not rows:
+            return
+        try:
+            with db.engine.begin() as connection:
+                connection.execute(Log.__table__.insert(), rows)
+
+            # These don't fire Log's mapper events, so update its counter ourselves.
+            from app import counters
+            counters.unresolved_logs.add(len(rows))
+        except Exception:
+            sys.stderr.write("SQLAlchemyHandler failed to write {} log entries:\n".format(len(rows)))
+            traceback.print_exc(file=sys.stderr)
 
-        log = Log(
-            logger=record.__dict__['name'],
-            level=record.__dict__['levelname'],
-            trace=trace,
-            msg=record.__dict__['msg'],
-            extra=extra)
+    def _run(self):
+        while not self._stopping.is_set():
+            batch = self._next_batch(self.flush_interval)
+            dropped = self._dropped_row()
+            if dropped is not None:
+                batch.append(dropped)
+            self._write(batch)
 
-        # If we hit an error we need to ROLL THE FUCK BACK so we can save to database.
-        if log.level >= logging.ERROR:
-            db.session.rollback()
+    def flush(self):
+        """ Writes everything queued so far, from the calling thread. """
+        rows = []
+        while True:
+            try:
+                rows.append(self.queue.get_nowait())
+            except Queue.Empty:
+                break
+        dropped = self._dropped_row()
+        if dropped is not None:
+            rows.append(dropped)
 
-        db.session.add(log)
-        db.session.commit()
+        for i in range(0, len(rows), self.batch_size):
+            self._write(rows[i:i + self.batch_size])
 
+    def close(self):
+        """ Stops the writer thread and writes anything left in the queue. """
+        self._stopping.set()
+        if self._thread is not None and self._pid == os.getpid():
+            self._thread.join(self.flush_interval + 1)
+        self.flush()
+        logging.Handler.close(self)
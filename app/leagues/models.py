@@ -128,6 +128,55 @@ class League(db.Model):
             return None, None
 
 
+class LeagueCrawlState(db.Model):
+    """ How far we've got crawling a league's match history (see app.cron.fetch_league_matches).
+
+    GetMatchHistory pages from the newest match backwards.  A crawl starts at the newest page, notes the newest match id
+    it saw in `crawl_high_water`, and walks back until it reaches `last_match_id` (the newest match of the last complete
+    crawl), recording where it's got to in `resume_match_id` after every page.  When it finishes `crawl_high_water`
+    becomes the new `last_match_id`; if it's interrupted the next crawl picks up from `resume_match_id` instead.
+    """
+    __tablename__ = "league_crawl_states"
+
+    league_id = db.Column(db.Integer, db.ForeignKey("leagues.id", ondelete="CASCADE"), primary_key=True,
+                          autoincrement=False)
+    last_match_id = db.Column(db.BigInteger)  # Newest match id of the last complete crawl
+    crawl_high_water = db.Column(db.BigInteger)  # Newest match id seen by the crawl in progress
+    resume_match_id = db.Column(db.BigInteger)  # start_at_match_id for the next page of the crawl in progress
+    updated_at = db.Column(db.DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+
+    def __init__(self, league_id=None):
+        self.league_id = league_id
+
+    def __repr__(self):
+        return "<LeagueCrawlState {}: {}>".format(self.league_id, self.last_match_id)
+
+    @classmethod
+    def get_or_create(cls, league_id):
+        state = cls.query.get(league_id)
+        if state is None:
+            state = cls(league_id)
+            db.session.add(state)
+        return state
+
+    @property
+    def in_progress(self):
+        return self.crawl_high_water is not None
+
+    def record_page(self, matches):
+        """ Notes that a page of matches (newest first) has been processed. """
+        if not self.in_progress:
+            self.crawl_high_water = matches[0]["match_id"]
+        self.resume_match_id = matches[-1]["match_id"] - 1
+
+    def finish(self):
+        """ Marks the crawl in progress as complete. """
+        if self.in_progress:
+            self.last_match_id = max(self.last_match_id or 0, self.crawl_high_water)
+        self.crawl_high_water = None
+        self.resume_match_id = None
+
+
 class LeagueView(db.Model):
     """ Saved filters for a league view - allowing league replays to be broken down into sub-views """
     __tablename__ = "league_views"
@@ -1,6 +1,7 @@
-from flask import Blueprint, render_template, current_app, abort
+from flask import Blueprint, render_template, current_app, abort, redirect, url_for
 from app.replays.models import Replay
-from app import db, mem_cache
+from app.pagination import KeysetPagination, approximate_count
+from app import db, locked_mem_cache
 from models import League, LeagueView
 from sqlalchemy.orm.exc import NoResultFound
 from app.admin.views import AdminModelView
@@ -8,7 +9,7 @@ from app.admin.views import AdminModelView
 mod = Blueprint("leagues", __name__, url_prefix="/leagues")
 
 
-@mem_cache.cached(timeout=60 * 60, key_prefix="leagues_data")
+@locked_mem_cache.cached(timeout=60 * 60, key_prefix="leagues_data")
 def _leagues_data():
     _leagues_and_count = db.session.query(
         League,
@@ -39,26 +40,33 @@ def leagues():
 @mod.route("/<int:_id>/page/<int:page>")
 @mod.route("/<int:_id>/<int:view>")
 @mod.route("/<int:_id>/<int:view>/page/<int:page>")
-def league(_id, view=None, page=1):
+def league(_id, view=None, page=None):
     _league = League.query.get(_id)
     _view = None
 
     if _league is None:
         abort(404)
 
+    if page is not None:
+        # Numbered pages replaced by keyset pagination
+        return redirect(url_for("leagues.league", _id=_id, view=view), 301)
+
     if view is None:
-        _replays = _league.replays.\
-            order_by(Replay.id.desc()).\
-            paginate(page, current_app.config["REPLAYS_PER_PAGE"], False)
+        _query = _league.replays
     else:
         try:
             _view = LeagueView.query.filter(LeagueView.id == view, LeagueView.league_id == _id).one()
         except NoResultFound:
             abort(404)
 
-        _replays = _league.replays.filter(*_view.get_filters()).\
-            order_by(Replay.id.desc()).\
-            paginate(page, current_app.config["REPLAYS_PER_PAGE"], False)
+        _query = _league.replays.filter(*_view.get_filters())
+
+    _replays = KeysetPagination.from_request(Replay.list_query(_query),
+                                             (Replay.id,),
+                                             current_app.config["REPLAYS_PER_PAGE"],
+                                             total=approximate_count("league_{}_{}".format(_id, view), _query))
+
+    Replay.prefetch_listing_profiles(_replays.items)
 
     # Get all views
     views = LeagueView.query.filter(LeagueView.league_id == _id).all()
@@ -69,7 +77,6 @@ def league(_id, view=None, page=1):
                            league=_league,
                            replays=_replays,
                            current_view=_view,
-                           page=page,
                            views=views)
 
 class LeagueAdmin(AdminModelView):
@@ -1,8 +1,10 @@
-from app import mem_cache, dotabank_bucket, db, steam
+from app import locked_mem_cache, dotabank_bucket, db, steam
 from app.replays.models import Replay, ReplayDownload
 from app.users.models import User
 from datetime import datetime, timedelta
 from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.orm.attributes import get_history
 import os
 import json
 
@@ -13,7 +15,7 @@ class Stats:
         pass
 
     @staticmethod
-    @mem_cache.memoize(timeout=60 * 60)
+    @locked_mem_cache.memoize(timeout=60 * 60)
     def replays_count(hours=None):
         """ Counts how many replays have been added to the database since `hours` ago, or all-time if `hours` is None. """
         if hours:
@@ -23,18 +25,22 @@ class Stats:
             return Replay.query.count()
 
     @staticmethod
-    @mem_cache.memoize(timeout=60 * 60)
     def archived_count(hours=None):
         """ Counts how many replays have been archived since `hours` ago, or all-time if `hours` is None. """
         if hours:
-            _time_ago = datetime.utcnow() - timedelta(hours=hours)
-            return Replay.query.filter(Replay.local_uri != None,
-                                            Replay.added_to_site_time >= _time_ago).count()  # Have to use != instead of 'is not' here, because sqlalchemy.
+            return Stats._archived_since(hours)
         else:
-            return Replay.query.filter(Replay.local_uri != None).count()  # Have to use != instead of 'is not' here, because sqlalchemy.
+            return BucketStats.get().archived_count
+
+    @staticmethod
+    @locked_mem_cache.memoize(timeout=60 * 60)
+    def _archived_since(hours):
+        _time_ago = datetime.utcnow() - timedelta(hours=hours)
+        return Replay.query.filter(Replay.local_uri != None,
+                                   Replay.added_to_site_time >= _time_ago).count()  # Have to use != instead of 'is not' here, because sqlalchemy.
 
     @staticmethod
-    @mem_cache.memoize(timeout=60 * 60)
+    @locked_mem_cache.memoize(timeout=60 * 60)
     def downloads_count(hours=None):
         """ Counts how many times users have initiated a download since `hours` ago, or all-time if `hours` is None. """
         if hours:
@@ -44,7 +50,7 @@ class Stats:
             return ReplayDownload.query.count()
 
     @staticmethod
-    @mem_cache.memoize(timeout=60 * 60)
+    @locked_mem_cache.memoize(timeout=60 * 60)
     def users_count(hours=None):
         """ Counts how many users have registered (first login) since `hours` ago, or all-time if `hours` is None. """
         if hours:
@@ -54,14 +60,131 @@ class Stats:
             return User.query.count()
 
     @staticmethod
-    @mem_cache.memoize(timeout=60 * 60)
     def bucket_size():
-        """ Sums up and returns how much space we're taking up on our dotabank S3 bucket. """
-        total_bytes = 0
-        for key in dotabank_bucket:
-            total_bytes += key.size
+        """ Returns how much space our archived replays take up on our dotabank S3 bucket. """
+        return BucketStats.get().total_bytes
+
+
+class BucketStats(db.Model):
+    """ Running totals of the replays we've archived to S3, so the home page doesn't have to count them or LIST the
+    bucket.  A single row, kept up to date by the Replay mapper events below and corrected by `reconcile`. """
+    __tablename__ = "bucket_stats"
+
+    ROW_ID = 1
+
+    id = db.Column(db.Integer, primary_key=True)
+    archived_count = db.Column(db.Integer, nullable=False, default=0)
+    total_bytes = db.Column(db.BigInteger, nullable=False, default=0)
+    reconciled_at = db.Column(db.DateTime)
+
+    def __init__(self, archived_count=0, total_bytes=0):
+        self.id = BucketStats.ROW_ID
+        self.archived_count = archived_count
+        self.total_bytes = total_bytes
+
+    def __repr__(self):
+        return "<BucketStats {} replays, {} bytes>".format(self.archived_count, self.total_bytes)
+
+    @classmethod
+    def get(cls):
+        """ Returns the stats row, or an empty unsaved one if it hasn't been created yet. """
+        return cls.query.get(cls.ROW_ID) or cls()
+
+    @classmethod
+    def apply_delta(cls, connection, archived_count=0, total_bytes=0):
+        """ Adjusts the running totals in place, on the given connection so it's part of the caller's transaction. """
+        if not archived_count and not total_bytes:
+            return
+
+        table = cls.__table__
+        connection.execute(
+            table.update().
+            where(table.c.id == cls.ROW_ID).
+            values(archived_count=table.c.archived_count + archived_count,
+                   total_bytes=table.c.total_bytes + total_bytes)
+        )
+
+    @classmethod
+    def reconcile(cls, fill_sizes=500, verify_bucket=False):
+        """ Recomputes the running totals from the replays table, correcting any drift.
+
+        Replays archived by processes which don't go through the ORM (or bulk Query.update calls) never fire the mapper
+        events, so first up to `fill_sizes` archived replays with no known file size have it recorded from S3.  If
+        `verify_bucket` is set the bucket itself is listed and compared too, which is as slow as it sounds.
+
+        Returns:
+            A dict of the stored totals, the recomputed totals and (if verify_bucket) the bucket's own totals.
+        """
+        missing_sizes = Replay.query.filter(
+            Replay.state == "ARCHIVED",
+            Replay.local_uri != None,
+            Replay.file_size == None
+        ).limit(fill_sizes).all()
+        for replay in missing_sizes:
+            key = replay.get_s3_file()
+            if key is not None:
+                replay.record_archived_file(key)
+        db.session.commit()
+
+        stats = cls.query.get(cls.ROW_ID)
+        if stats is None:
+            stats = cls()
+            db.session.add(stats)
+
+        result = {"stored": (stats.archived_count, stats.total_bytes)}
+        actual_count, actual_bytes = db.session.query(
+            db.func.count(Replay.id),
+            db.func.coalesce(db.func.sum(Replay.file_size), 0)
+        ).filter(Replay.local_uri != None).one()
+        result["actual"] = (actual_count, int(actual_bytes))
+
+        stats.archived_count, stats.total_bytes = result["actual"]
+        stats.reconciled_at = datetime.utcnow()
+        db.session.commit()
 
-        return total_bytes
+        if verify_bucket:
+            bucket_count = bucket_bytes = 0
+            for key in dotabank_bucket.list(prefix="replays/"):
+                bucket_count += 1
+                bucket_bytes += key.size
+            result["bucket"] = (bucket_count, bucket_bytes)
+
+        return result
+
+
+def _bucket_contribution(local_uri, file_size):
+    """ What a replay with this local_uri and file_size adds to BucketStats. """
+    if local_uri is None:
+        return 0, 0
+    return 1, file_size or 0
+
+
+def _history_values(target, key):
+    """ Returns the (old, new) values of a column attribute during a flush. """
+    history = get_history(target, key)
+    new = (history.added or history.unchanged or [None])[0]
+    old = (history.deleted or history.unchanged or [None])[0] if history.has_changes() else new
+    return old, new
+
+
+@event.listens_for(Replay, "after_insert")
+def _bucket_stats_replay_inserted(mapper, connection, target):
+    BucketStats.apply_delta(connection, *_bucket_contribution(target.local_uri, target.file_size))
+
+
+@event.listens_for(Replay, "after_update")
+def _bucket_stats_replay_updated(mapper, connection, target):
+    old_uri, new_uri = _history_values(target, "local_uri")
+    old_size, new_size = _history_values(target, "file_size")
+    old_count, old_bytes = _bucket_contribution(old_uri, old_size)
+    new_count, new_bytes = _bucket_contribution(new_uri, new_size)
+    BucketStats.apply_delta(connection, new_count - old_count, new_bytes - old_bytes)
+
+
+@event.listens_for(Replay, "before_delete")
+def _bucket_stats_replay_deleted(mapper, connection, target):
+    count, total_bytes = _bucket_contribution(target.local_uri, target.file_size)
+    BucketStats.apply_delta(connection, -count, -total_bytes)
 
 
 class Log(db.Model):
@@ -108,6 +231,43 @@ class Log(db.Model):
         return self.resolved_by_user_id is not None
 
 
+class ArchivedRows(db.Model):
+    """ Daily counts of rows app.retention has moved out of a table into its archive files, by category (e.g. log
+    level), so reports can still include them. """
+    __tablename__ = "archived_rows"
+
+    table_name = db.Column(db.String(32), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    category = db.Column(db.String(32), primary_key=True)
+    row_count = db.Column(db.Integer, nullable=False, default=0)
+
+    def __init__(self, table_name=None, day=None, category=None, row_count=0):
+        self.table_name = table_name
+        self.day = day
+        self.category = category
+        self.row_count = row_count
+
+    def __repr__(self):
+        return "<ArchivedRows {} {}/{}: {}>".format(self.table_name, self.day, self.category, self.row_count)
+
+    @classmethod
+    def add(cls, table_name, counts):
+        """ Adds `counts`, a dict of (day, category) => rows, to the summaries for `table_name`.  Doesn't commit. """
+        for (day, category), count in counts.iteritems():
+            summary = cls.query.get((table_name, day, category))
+            if summary is None:
+                db.session.add(cls(table_name, day, category, count))
+            else:
+                summary.row_count += count
+
+    @classmethod
+    def total(cls, table_name):
+        """ Returns the number of rows archived from `table_name`. """
+        return db.session.query(db.func.coalesce(db.func.sum(cls.row_count), 0)).\
+            filter(cls.table_name == table_name).\
+            scalar()
+
+
 class UGCFile(db.Model):
     __tablename__ = "ugcfiles"
 
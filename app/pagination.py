@@ -0,0 +1,119 @@
+"""
+Keyset ("seek") pagination for long listings.
+
+Flask-SQLAlchemy's `paginate` runs a COUNT(*) and an OFFSET query for every page, so the deeper the page the slower it
+is.  KeysetPagination instead filters on the last row of the current page, e.g. `WHERE id < :last_id ORDER BY id DESC
+LIMIT n`, which costs the same wherever you are in the listing.  Pages are addressed by opaque cursors rather than
+numbers, and totals are approximate (cached counts) rather than exact.
+"""
+
+from app import locked_mem_cache, db
+from datetime import datetime
+from flask import request, abort
+from flask.ext.sqlalchemy import Pagination
+from math import ceil
+
+CURSOR_DATETIME_FORMAT = "%Y%m%d%H%M%S%f"
+
+
+class KeysetPagination(object):
+    """ A page of `query`'s results, ordered newest first by `columns`, which together must be unique (e.g.
+    `(Replay.added_to_site_time, Replay.id)` or just `Replay.id`).  Rows with a NULL in any of `columns` can't be
+    seeked past, so are left out of the listing.
+
+    :param after: cursor of the row to start after (i.e. the last row of the previous, newer, page).
+    :param before: cursor of the row to end before (i.e. the first row of the next, older, page).
+    :param total: an approximate count of the rows in the whole listing, for display.
+    """
+
+    def __init__(self, query, columns, per_page, after=None, before=None, total=None):
+        self.columns = columns
+        self.per_page = per_page
+        self.total = total
+        query = query.order_by(None).filter(*[column != None for column in columns])
+
+        if before is not None:
+            # Walk back towards the newest rows, then flip the page the right way round.
+            rows = query.filter(self._seek(self.decode_cursor(before), newer=True)).\
+                order_by(*[column.asc() for column in columns]).\
+                limit(per_page + 1).\
+                all()
+            self.items = list(reversed(rows[:per_page]))
+            self.has_prev = len(rows) > per_page
+            self.has_next = True
+        else:
+            if after is not None:
+                query = query.filter(self._seek(self.decode_cursor(after), newer=False))
+            rows = query.order_by(*[column.desc() for column in columns]).\
+                limit(per_page + 1).\
+                all()
+            self.items = rows[:per_page]
+            self.has_prev = after is not None
+            self.has_next = len(rows) > per_page
+
+    @classmethod
+    def from_request(cls, query, columns, per_page, total=None):
+        """ Builds the page addressed by the current request's `after` / `before` arguments; 400s on a bad cursor. """
+        try:
+            return cls(query, columns, per_page,
+                       after=request.args.get('after'),
+                       before=request.args.get('before'),
+                       total=total)
+        except ValueError:
+            abort(400)
+
+    def _seek(self, values, newer):
+        """ Filter for rows newer (or older) than the row with the given column values. """
+        clauses = []
+        for i, column in enumerate(self.columns):
+            equal_so_far = [c == v for c, v in zip(self.columns[:i], values[:i])]
+            clauses.append(db.and_(*(equal_so_far + [column > values[i] if newer else column < values[i]])))
+        return db.or_(*clauses)
+
+    def encode_cursor(self, row):
+        values = []
+        for column in self.columns:
+            value = getattr(row, column.key)
+            if value is None:
+                raise ValueError("Can't build a cursor from a NULL {}".format(column.key))
+            values.append(value.strftime(CURSOR_DATETIME_FORMAT) if isinstance(value, datetime) else str(value))
+        return "_".join(values)
+
+    def decode_cursor(self, cursor):
+        """ Raises ValueError if the cursor doesn't match our columns. """
+        parts = cursor.split("_")
+        if len(parts) != len(self.columns):
+            raise ValueError("Expected {} cursor values, got {}".format(len(self.columns), len(parts)))
+
+        values = []
+        for column, part in zip(self.columns, parts):
+            if part == "None":
+                raise ValueError("NULL {} in cursor".format(column.key))
+            if isinstance(column.type, db.DateTime):
+                values.append(datetime.strptime(part, CURSOR_DATETIME_FORMAT))
+            else:
+                values.append(int(part))
+        return values
+
+    @property
+    def prev_cursor(self):
+        return self.encode_cursor(self.items[0]) if self.has_prev and self.items else None
+
+    @property
+    def next_cursor(self):
+        return self.encode_cursor(self.items[-1]) if self.has_next and self.items else None
+
+
+def approximate_count(cache_key, query, timeout=60 * 60):
+    """ COUNT(*) of `query`, cached in mem_cache for `timeout` seconds.  Once cached, only one worker at a time
+    recomputes it while the others serve the stale count; see SingleFlightCache for how long a cold key waits. """
+    return locked_mem_cache.get_or_compute("approximate_count_" + cache_key, query.order_by(None).count, timeout)
+
+
+def paginate_with_total(query, page, per_page, total):
+    """ Like Flask-SQLAlchemy's `paginate(page, per_page, False)`, but takes the total from the caller (e.g. one of
+    app.counters) instead of running a COUNT(*).  `page` defaults to the last page. """
+    if not page:
+        page = max(int(ceil(float(total) / per_page)), 1)
+    items = query.limit(per_page).offset((page - 1) * per_page).all()
+    return Pagination(query, page, per_page, total, items)
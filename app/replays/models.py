@@ -1,7 +1,13 @@
 from app import db, sqs_gc_queue, sqs_dl_queue, mem_cache, dotabank_bucket, steam
+from flask import g
+from sqlalchemy import bindparam, event
+from sqlalchemy.orm import lazyload, joinedload, subqueryload
+from sqlalchemy.orm.attributes import get_history
 from flask.ext.login import current_user
 import datetime
 from boto.sqs.message import RawMessage as sqsMessage
+from boto.exception import SQSError
+from time import sleep
 from app.leagues.models import League
 from app.dota.models import Hero, Item, Region
 from app.users.models import User
@@ -16,7 +22,10 @@ class Replay(db.Model):
     #################
 
     id = db.Column(db.Integer, primary_key=True)  # optional uint32 match_id = 6;
-    local_uri = db.Column(db.String(128), index=True)
+    # active_history so the bucket stats events (app.models) always see the value being replaced.
+    local_uri = db.column_property(db.Column(db.String(128), index=True), active_history=True)
+    file_size = db.column_property(db.Column(db.BigInteger, index=True), active_history=True)  # Bytes stored on S3 at local_uri
+    file_md5 = db.Column(db.String(32))  # md5 (S3 ETag) of the file stored at local_uri
     state = db.Column(db.Enum(
         "WAITING_GC",
         "WAITING_DOWNLOAD",
@@ -88,13 +97,15 @@ class Replay(db.Model):
     # Relationships #
     #################
 
+    # Nothing is eager loaded by default; use list_query or detail_query for pages which need players or stats.
+
     # GC relationships
-    players = db.relationship('ReplayPlayer', backref="replay", lazy="join", cascade="all, delete-orphan")  # repeated .CMsgDOTAMatch.Player players = 5;
+    players = db.relationship('ReplayPlayer', backref="replay", lazy="select", cascade="all, delete-orphan")  # repeated .CMsgDOTAMatch.Player players = 5;
     # repeated .CMatchHeroSelectEvent picks_bans = 32;  # TODO
 
     # Site relationships
-    ratings = db.relationship('ReplayRating', backref='replay', lazy='joined', cascade="all, delete-orphan")
-    favourites = db.relationship('ReplayFavourite', backref='replay', lazy='joined', cascade="all, delete-orphan")
+    ratings = db.relationship('ReplayRating', backref='replay', lazy='select', cascade="all, delete-orphan")
+    favourites = db.relationship('ReplayFavourite', backref='replay', lazy='select', cascade="all, delete-orphan")
     downloads = db.relationship('ReplayDownload', backref="replay", lazy="dynamic", cascade="all, delete-orphan")
     aliases = db.relationship('ReplayAlias', backref="replay", lazy="dynamic", cascade="all, delete-orphan")
 
@@ -102,6 +113,10 @@ class Replay(db.Model):
     # Static data #
     ###############
 
+    SMALL_FILE_SIZE = 1024 * 1024  # Archived files smaller than this are probably an error page, not a replay.
+    SQS_BATCH_SIZE = 10  # Max messages SQS accepts per SendMessageBatch
+    SQS_BATCH_RETRIES = 2  # Times to retry messages SQS fails to accept
+
     # Game mode data interpreted from the game's protobufs:
     # https://github.com/SteamRE/SteamKit/blob/master/Resources/Protobufs/dota/dota_gcmessages_common.proto#L407
     game_mode_strings = [
@@ -148,12 +163,15 @@ class Replay(db.Model):
     # Object cache
     _team_players = None  # Object cache for team_players so if it's poked before being cached we dont need to call the database for this info.
 
-    def __init__(self, id=None, replay_state="UNKNOWN", state="WAITING_GC", skip_webapi=False):
+    def __init__(self, id=None, replay_state="UNKNOWN", state="WAITING_GC", skip_webapi=False, match_data=None):
         self.id = id
         self.replay_state = replay_state
         self.state = state
 
-        if not skip_webapi:
+        # Callers creating replays in bulk fetch GetMatchDetails themselves (see app.webapi) and pass it in.
+        if match_data:
+            self._populate_from_webapi(match_data)
+        elif not skip_webapi:
             self._populate_from_webapi()
 
     def __repr__(self):
@@ -248,6 +266,77 @@ class Replay(db.Model):
     def region(self):
         return Region.get_by_cluster(self.replay_cluster)
 
+    @classmethod
+    def lightweight_query(cls):
+        """ Replays with none of their relationships loaded, for crons and admin tasks which only need their columns. """
+        return cls.query.options(lazyload('*'))
+
+    @classmethod
+    def list_query(cls, query=None):
+        """ `query` (Replay.query by default) set up for listings: each page's players in one extra query, and their
+        favourite/rating/download counts joined from replay_stats. """
+        return (query if query is not None else cls.query).options(subqueryload(cls.players), joinedload(cls.stats))
+
+    @classmethod
+    def detail_query(cls):
+        """ Replays set up for the single-replay pages: players and stats joined into the one query, which is cheaper
+        than subqueryload's extra round trip when there's only one replay. """
+        return cls.query.options(joinedload(cls.players), joinedload(cls.stats))
+
+    @staticmethod
+    def prefetch_listing_profiles(replays):
+        """ Batch-fetches Steam profiles for the lone players replays_table.html shows in place of a team name, and the
+        current user's ratings and favourites of the listed replays. """
+        ReplayPlayer.prefetch_profiles([team[0] for replay in replays for team in replay.team_players if len(team) == 1])
+        Replay.prefetch_user_actions(replays)
+
+    @staticmethod
+    def prefetch_user_actions(replays):
+        """ Looks up the current user's ratings and favourites of `replays` with one IN query each, for `user_rating`
+        and `user_favourite`.  Kept on `g` rather than the replays, which may be shared through mem_cache. """
+        if not current_user.is_authenticated():
+            return
+
+        user_ratings = _request_dict('replay_user_ratings')
+        user_favourites = _request_dict('replay_user_favourites')
+        replay_ids = [replay.id for replay in replays if replay.id not in user_ratings]
+        if not replay_ids:
+            return
+
+        ratings = ReplayRating.query.filter(ReplayRating.user_id == current_user.id,
+                                            ReplayRating.replay_id.in_(replay_ids)).all()
+        favourites = ReplayFavourite.query.filter(ReplayFavourite.user_id == current_user.id,
+                                                  ReplayFavourite.replay_id.in_(replay_ids)).all()
+
+        user_ratings.update((_id, None) for _id in replay_ids)
+        user_ratings.update((rating.replay_id, rating) for rating in ratings)
+        user_favourites.update((_id, False) for _id in replay_ids)
+        user_favourites.update((favourite.replay_id, favourite) for favourite in favourites)
+
+    @property
+    def favourite_count(self):
+        if self.stats is not None:
+            return self.stats.favourite_count
+        return ReplayFavourite.query.filter(ReplayFavourite.replay_id == self.id).count()
+
+    @property
+    def positive_rating_count(self):
+        if self.stats is not None:
+            return self.stats.positive_rating_count
+        return ReplayRating.query.filter(ReplayRating.replay_id == self.id, ReplayRating.positive == True).count()
+
+    @property
+    def negative_rating_count(self):
+        if self.stats is not None:
+            return self.stats.negative_rating_count
+        return ReplayRating.query.filter(ReplayRating.replay_id == self.id, ReplayRating.positive == False).count()
+
+    @property
+    def download_count(self):
+        if self.stats is not None:
+            return self.stats.download_count
+        return self.downloads.count()
+
     def get_s3_file(self):
         key = None
         if self.local_uri:
@@ -255,6 +344,50 @@ class Replay(db.Model):
 
         return key
 
+    def record_archived_file(self, key):
+        """ Stores the location, size and md5 of the S3 key this replay has been archived to. """
+        self.local_uri = key.name
+        self.file_size = key.size
+        self.file_md5 = key.etag.replace("\"", "") if key.etag else None
+
+    def clear_archived_file(self):
+        """ Forgets about this replay's archived file, e.g. because it's broken and needs downloading again. """
+        self.local_uri = None
+        self.file_size = None
+        self.file_md5 = None
+        self.dl_done_time = None
+
+    @classmethod
+    def backfill_file_data(cls, chunk_size=1000):
+        """ Fills in file_size and file_md5 for every archived replay from a single listing of the bucket.
+
+        Writes go straight to the replays table, bypassing the bucket stats mapper events, so BucketStats should be
+        reconciled afterwards.  Returns the number of S3 keys seen.
+        """
+        replays_table = cls.__table__
+        update = replays_table.update().\
+            where(replays_table.c.local_uri == bindparam('_local_uri')).\
+            values(file_size=bindparam('_file_size'), file_md5=bindparam('_file_md5'))
+
+        seen = 0
+        chunk = []
+        for key in dotabank_bucket.list(prefix="replays/"):
+            chunk.append({
+                '_local_uri': key.name,
+                '_file_size': key.size,
+                '_file_md5': key.etag.replace("\"", "") if key.etag else None
+            })
+            if len(chunk) >= chunk_size:
+                db.engine.execute(update, chunk)
+                seen += len(chunk)
+                chunk = []
+
+        if chunk:
+            db.engine.execute(update, chunk)
+            seen += len(chunk)
+
+        return seen
+
     def get_alias(self, formatted=True):
         if current_user.is_anonymous() is True:
             return None
@@ -291,20 +424,28 @@ class Replay(db.Model):
             else:
                 return "Expired"
 
-    # TODO: What is this?
     def user_rating(self):
-        if current_user.is_authenticated():
-            return next((rating for rating in self.ratings if rating.user_id == current_user.id), None)
-        else:
+        """ The current user's rating of this replay, or None. """
+        if not current_user.is_authenticated():
             return None
 
-    # TODO: What is this?
+        ratings = _request_dict('replay_user_ratings')
+        if self.id not in ratings:
+            ratings[self.id] = ReplayRating.query.filter(ReplayRating.user_id == current_user.id,
+                                                         ReplayRating.replay_id == self.id).first()
+        return ratings[self.id]
+
     def user_favourite(self):
-        if current_user.is_authenticated():
-            return next((favourite for favourite in self.favourites if favourite.user_id == current_user.id), False)
-        else:
+        """ The current user's favourite of this replay, or False. """
+        if not current_user.is_authenticated():
             return False
 
+        favourites = _request_dict('replay_user_favourites')
+        if self.id not in favourites:
+            favourites[self.id] = ReplayFavourite.query.filter(ReplayFavourite.user_id == current_user.id,
+                                                               ReplayFavourite.replay_id == self.id).first() or False
+        return favourites[self.id]
+
     @classmethod
     def get_or_create(cls, **kwargs):
         # Get instance, filter skip_webapi from kwargs as that's the only non-database argument __init__ can take.
@@ -345,10 +486,67 @@ class Replay(db.Model):
         msg.set_body(str(_replay.id))
         return sqs_dl_queue.write(msg)
 
+    @staticmethod
+    def add_gc_jobs(replays):
+        """ Bulk version of add_gc_job: one commit, and GC jobs written to SQS in batches.
+
+        Returns:
+            A tuple of (queued replay ids, failed replay ids).
+        """
+        for _replay in replays:
+            _replay.gc_fails = 0
+            _replay.gc_done_time = None
+        return Replay._queue_jobs(sqs_gc_queue, replays)
+
+    @staticmethod
+    def add_dl_jobs(replays):
+        """ Bulk version of add_dl_job: one commit, and DL jobs written to SQS in batches.
+
+        Returns:
+            A tuple of (queued replay ids, failed replay ids).
+        """
+        for _replay in replays:
+            _replay.dl_fails = 0
+            _replay.dl_done_time = None
+        return Replay._queue_jobs(sqs_dl_queue, replays)
+
+    @staticmethod
+    def _queue_jobs(queue, replays):
+        """ Commits the given replays, then writes a message for each to `queue`, SQS_BATCH_SIZE per request.  Entries
+        SQS rejects (or whole batches that error) are retried up to SQS_BATCH_RETRIES times. """
+        db.session.add_all(replays)
+        replay_ids = [_replay.id for _replay in replays]  # Before the commit expires them
+        db.session.commit()
+
+        queued = []
+        failed = []
+        for i in range(0, len(replay_ids), Replay.SQS_BATCH_SIZE):
+            pending = replay_ids[i:i + Replay.SQS_BATCH_SIZE]
+            attempt = 0
+            while pending:
+                try:
+                    result = queue.write_batch([(str(n), str(_id), 0) for n, _id in enumerate(pending)])
+                    errors = [pending[int(error["id"])] for error in result.errors]
+                except SQSError:
+                    errors = pending
+
+                queued.extend(_id for _id in pending if _id not in errors)
+                if errors and attempt >= Replay.SQS_BATCH_RETRIES:
+                    failed.extend(errors)
+                    break
+
+                attempt += 1
+                pending = errors
+                if pending:
+                    sleep(0.5 * attempt)
+
+        return queued, failed
+
 
 # noinspection PyShadowingBuiltins
 class ReplayRating(db.Model):
     __tablename__ = "replay_ratings"
+    __table_args__ = (db.Index("ix_replay_ratings_user_id_replay_id", "user_id", "replay_id"),)
 
     id = db.Column(db.Integer, primary_key=True)
     replay_id = db.Column(db.Integer, db.ForeignKey("replays.id", ondelete="CASCADE"), nullable=False)
@@ -368,6 +566,7 @@ class ReplayRating(db.Model):
 # noinspection PyShadowingBuiltins
 class ReplayFavourite(db.Model):
     __tablename__ = "replay_favs"
+    __table_args__ = (db.Index("ix_replay_favs_user_id_replay_id", "user_id", "replay_id"),)
 
     id = db.Column(db.Integer, primary_key=True)
     replay_id = db.Column(db.Integer, db.ForeignKey("replays.id", ondelete="CASCADE"), nullable=False)
@@ -389,7 +588,7 @@ class ReplayDownload(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     replay_id = db.Column(db.Integer, db.ForeignKey("replays.id", ondelete="CASCADE"), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey("users.id", ondelete="CASCADE"), nullable=True)
-    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow, index=True)
 
     def __init__(self, replay_id=None, user_id=None):
         self.replay_id = replay_id
@@ -399,6 +598,396 @@ class ReplayDownload(db.Model):
         return "<Download {}/{}>".format(self.replay_id, self.user_id)
 
 
+class ReplayDownloadRollup(db.Model):
+    """ Downloads of a replay per hour or per day, filled in by `DownloadRollupState.roll_up`. """
+    __tablename__ = "replay_download_rollups"
+
+    period = db.Column(db.String(4), primary_key=True)  # "hour" or "day"
+    starts_at = db.Column(db.DateTime, primary_key=True)
+    replay_id = db.Column(db.Integer, db.ForeignKey("replays.id", ondelete="CASCADE"), primary_key=True,
+                          autoincrement=False)
+    download_count = db.Column(db.Integer, nullable=False, default=0)
+
+    def __init__(self, period=None, starts_at=None, replay_id=None, download_count=0):
+        self.period = period
+        self.starts_at = starts_at
+        self.replay_id = replay_id
+        self.download_count = download_count
+
+    def __repr__(self):
+        return "<ReplayDownloadRollup {} {}/{}>".format(self.replay_id, self.period, self.starts_at)
+
+
+class UserDownloadRollup(db.Model):
+    """ Downloads by a user per hour or per day, filled in by `DownloadRollupState.roll_up`.  Anonymous downloads
+    aren't counted. """
+    __tablename__ = "user_download_rollups"
+
+    period = db.Column(db.String(4), primary_key=True)  # "hour" or "day"
+    starts_at = db.Column(db.DateTime, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id", ondelete="CASCADE"), primary_key=True,
+                        autoincrement=False)
+    download_count = db.Column(db.Integer, nullable=False, default=0)
+
+    def __init__(self, period=None, starts_at=None, user_id=None, download_count=0):
+        self.period = period
+        self.starts_at = starts_at
+        self.user_id = user_id
+        self.download_count = download_count
+
+    def __repr__(self):
+        return "<UserDownloadRollup {} {}/{}>".format(self.user_id, self.period, self.starts_at)
+
+
+def _period_start(period, dt):
+    """ Start of the hour or day `dt` falls in. """
+    if period == "hour":
+        return dt.replace(minute=0, second=0, microsecond=0)
+    return dt.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _window_start(hours):
+    """ Start of the oldest bucket in a sliding window of `hours`: hourly buckets for windows of up to a day, daily
+    buckets otherwise, so a 30 day window reads at most 30 buckets per replay or user.  Returns (period, start). """
+    now = datetime.datetime.utcnow()
+    if hours <= 24:
+        return "hour", _period_start("hour", now) - datetime.timedelta(hours=hours - 1)
+    return "day", _period_start("day", now) - datetime.timedelta(days=hours // 24 - 1)
+
+
+class DownloadRollupState(db.Model):
+    """ How far `roll_up` has got through replay_downloads.  A single row. """
+    __tablename__ = "download_rollup_state"
+
+    ROW_ID = 1
+    PERIODS = ("hour", "day")
+    BATCH_SIZE = 50000
+    LAG = datetime.timedelta(minutes=1)  # Leave downloads this recent for the next run, in case an earlier id commits later.
+    HOURLY_RETENTION = datetime.timedelta(days=7)  # Hourly buckets are only used for windows of up to a day.
+
+    id = db.Column(db.Integer, primary_key=True)
+    last_download_id = db.Column(db.Integer, nullable=False, default=0)
+    rolled_up_at = db.Column(db.DateTime)
+
+    def __init__(self):
+        self.id = DownloadRollupState.ROW_ID
+        self.last_download_id = 0
+
+    def __repr__(self):
+        return "<DownloadRollupState {}>".format(self.last_download_id)
+
+    @classmethod
+    def roll_up(cls, batch_size=None):
+        """ Adds every download since the last run to the hourly and daily rollups, a batch at a time, and prunes old
+        hourly buckets.  Returns the number of downloads rolled up. """
+        batch_size = batch_size or cls.BATCH_SIZE
+        cutoff = datetime.datetime.utcnow() - cls.LAG
+        rolled_up = 0
+        while True:
+            # Each batch commits, so take the row lock afresh for every one; overlapping runs then take turns rather
+            # than both rolling up the same downloads.
+            state = cls.query.with_lockmode('update').populate_existing().get(cls.ROW_ID)
+            if state is None:
+                state = cls()
+                db.session.add(state)
+
+            downloads = db.session.query(ReplayDownload.id, ReplayDownload.replay_id, ReplayDownload.user_id,
+                                         ReplayDownload.created_at).\
+                filter(ReplayDownload.id > state.last_download_id,
+                       ReplayDownload.created_at < cutoff).\
+                order_by(ReplayDownload.id.asc()).\
+                limit(batch_size).\
+                all()
+            if not downloads:
+                break
+
+            replay_counts = {}
+            user_counts = {}
+            for _id, replay_id, user_id, created_at in downloads:
+                for period in cls.PERIODS:
+                    starts_at = _period_start(period, created_at)
+                    key = (period, starts_at, replay_id)
+                    replay_counts[key] = replay_counts.get(key, 0) + 1
+                    if user_id is not None:
+                        key = (period, starts_at, user_id)
+                        user_counts[key] = user_counts.get(key, 0) + 1
+
+            cls._add_counts(ReplayDownloadRollup, ReplayDownloadRollup.replay_id, replay_counts)
+            cls._add_counts(UserDownloadRollup, UserDownloadRollup.user_id, user_counts)
+
+            state.last_download_id = downloads[-1][0]
+            state.rolled_up_at = datetime.datetime.utcnow()
+            db.session.commit()
+            rolled_up += len(downloads)
+
+            if len(downloads) < batch_size:
+                break
+
+        prune_before = _period_start("hour", datetime.datetime.utcnow() - cls.HOURLY_RETENTION)
+        for model in (ReplayDownloadRollup, UserDownloadRollup):
+            model.query.filter(model.period == "hour", model.starts_at < prune_before).delete(synchronize_session=False)
+        db.session.commit()
+
+        return rolled_up
+
+    @staticmethod
+    def _add_counts(model, id_column, counts):
+        """ Adds `counts`, a dict of (period, starts_at, id) => downloads, to the rollup table `model`. """
+        if not counts:
+            return
+
+        table = model.__table__
+        existing = set()
+        starts = set(starts_at for period, starts_at, _id in counts)
+        for period, starts_at, _id in db.session.query(model.period, model.starts_at, id_column).\
+                filter(model.starts_at.in_(starts),
+                       id_column.in_(set(_id for period, starts_at, _id in counts))):
+            existing.add((period, starts_at, _id))
+
+        updates = [{'_period': period, '_starts_at': starts_at, '_id': _id, '_count': count}
+                   for (period, starts_at, _id), count in counts.iteritems() if (period, starts_at, _id) in existing]
+        inserts = [{'period': period, 'starts_at': starts_at, id_column.key: _id, 'download_count': count}
+                   for (period, starts_at, _id), count in counts.iteritems() if (period, starts_at, _id) not in existing]
+
+        if updates:
+            db.session.execute(
+                table.update().
+                where(db.and_(table.c.period == bindparam('_period'),
+                              table.c.starts_at == bindparam('_starts_at'),
+                              table.c[id_column.key] == bindparam('_id'))).
+                values(download_count=table.c.download_count + bindparam('_count')),
+                updates
+            )
+        if inserts:
+            db.session.execute(table.insert(), inserts)
+
+    @staticmethod
+    def top(model, id_column, hours, limit=None):
+        """ Query for (id, downloads) of the most downloaded replays or most downloading users in the last `hours`,
+        or all time if `hours` is None. """
+        downloads = db.func.sum(model.download_count).label("downloads")
+        if hours:
+            period, since = _window_start(hours)
+            query = db.session.query(id_column, downloads).filter(model.period == period, model.starts_at >= since)
+        else:
+            query = db.session.query(id_column, downloads).filter(model.period == "day")
+
+        query = query.group_by(id_column).order_by(downloads.desc())
+        if limit:
+            query = query.limit(limit)
+        return query
+
+
+class ReplayStats(db.Model):
+    """ Per-replay favourite, rating and download counts, so the home page leaderboards are a top-N scan of an index
+    rather than a GROUP BY over every favourite, rating and download.
+
+    Kept up to date by the mapper events below.  `download_30d_count` only ever goes up between runs of
+    `refresh_recent_downloads`, which winds it back to a true rolling 30 days; `rebuild` recounts everything.
+    """
+    __tablename__ = "replay_stats"
+
+    replay_id = db.Column(db.Integer, db.ForeignKey("replays.id", ondelete="CASCADE"), primary_key=True,
+                          autoincrement=False)
+    favourite_count = db.Column(db.Integer, nullable=False, default=0, index=True)
+    positive_rating_count = db.Column(db.Integer, nullable=False, default=0, index=True)
+    negative_rating_count = db.Column(db.Integer, nullable=False, default=0)
+    download_count = db.Column(db.Integer, nullable=False, default=0, index=True)
+    download_30d_count = db.Column(db.Integer, nullable=False, default=0, index=True)
+
+    replay = db.relationship('Replay', backref=db.backref('stats', uselist=False, passive_deletes=True,
+                                                          cascade="all, delete-orphan"))
+
+    RECENT_DOWNLOADS_DAYS = 30
+    REBUILD_CHUNK_SIZE = 5000
+
+    def __init__(self, replay_id=None):
+        self.replay_id = replay_id
+
+    def __repr__(self):
+        return "<ReplayStats {}>".format(self.replay_id)
+
+    @classmethod
+    def apply_delta(cls, connection, replay_id, **deltas):
+        """ Adjusts a replay's counts in place, on the given connection so it's part of the caller's transaction.
+
+        Replays without a stats row (i.e. added before the table was, and not yet rebuilt) are left alone.
+        """
+        deltas = {column: delta for column, delta in deltas.iteritems() if delta}
+        if not deltas:
+            return
+
+        table = cls.__table__
+        connection.execute(
+            table.update().
+            where(table.c.replay_id == replay_id).
+            values(**{column: table.c[column] + delta for column, delta in deltas.iteritems()})
+        )
+
+    @classmethod
+    def top(cls, column, limit, *entities):
+        """ Query for `entities` of the `limit` replays with the highest non-zero `column`. """
+        return db.session.query(*entities).\
+            join(cls, cls.replay_id == Replay.id).\
+            filter(column > 0).\
+            order_by(column.desc()).\
+            limit(limit)
+
+    @classmethod
+    def _counts(cls, replay_ids):
+        """ Recounts the stats of the given replays from the favourites, ratings and downloads tables. """
+        counts = {_id: {"replay_id": _id,
+                        "favourite_count": 0,
+                        "positive_rating_count": 0,
+                        "negative_rating_count": 0,
+                        "download_count": 0,
+                        "download_30d_count": 0} for _id in replay_ids}
+
+        favourites = db.session.query(ReplayFavourite.replay_id, db.func.count(ReplayFavourite.id)).\
+            filter(ReplayFavourite.replay_id.in_(replay_ids)).\
+            group_by(ReplayFavourite.replay_id)
+        for replay_id, count in favourites:
+            counts[replay_id]["favourite_count"] = count
+
+        ratings = db.session.query(ReplayRating.replay_id, ReplayRating.positive, db.func.count(ReplayRating.id)).\
+            filter(ReplayRating.replay_id.in_(replay_ids)).\
+            group_by(ReplayRating.replay_id, ReplayRating.positive)
+        for replay_id, positive, count in ratings:
+            counts[replay_id]["positive_rating_count" if positive else "negative_rating_count"] = count
+
+        downloads = db.session.query(ReplayDownload.replay_id, db.func.count(ReplayDownload.id)).\
+            filter(ReplayDownload.replay_id.in_(replay_ids)).\
+            group_by(ReplayDownload.replay_id)
+        for replay_id, count in downloads:
+            counts[replay_id]["download_count"] = count
+
+        for replay_id, count in cls._recent_downloads(replay_ids):
+            counts[replay_id]["download_30d_count"] = count
+
+        return counts.values()
+
+    @classmethod
+    def _recent_downloads(cls, replay_ids=None):
+        """ (replay id, download count) of every replay downloaded in the last RECENT_DOWNLOADS_DAYS, from the daily
+        download rollups. """
+        query = DownloadRollupState.top(ReplayDownloadRollup, ReplayDownloadRollup.replay_id,
+                                        cls.RECENT_DOWNLOADS_DAYS * 24)
+        if replay_ids is not None:
+            query = query.filter(ReplayDownloadRollup.replay_id.in_(replay_ids))
+        return query.all()
+
+    @classmethod
+    def rebuild(cls, chunk_size=None):
+        """ Recounts every replay's stats from scratch, creating any missing rows.  Returns the number of replays. """
+        chunk_size = chunk_size or cls.REBUILD_CHUNK_SIZE
+        table = cls.__table__
+        DownloadRollupState.roll_up()
+
+        rebuilt = 0
+        last_id = 0
+        while True:
+            replay_ids = [_id for _id, in db.session.query(Replay.id).
+                          filter(Replay.id > last_id).
+                          order_by(Replay.id.asc()).
+                          limit(chunk_size)]
+            if not replay_ids:
+                break
+
+            rows = cls._counts(replay_ids)
+            db.session.execute(table.delete().where(table.c.replay_id.in_(replay_ids)))
+            db.session.execute(table.insert(), rows)
+            db.session.commit()
+
+            rebuilt += len(replay_ids)
+            last_id = replay_ids[-1]
+
+        return rebuilt
+
+    @classmethod
+    def refresh_recent_downloads(cls):
+        """ Recounts download_30d_count, letting downloads older than RECENT_DOWNLOADS_DAYS drop out of it.  Returns
+        the number of replays with recent downloads. """
+        DownloadRollupState.roll_up()
+
+        table = cls.__table__
+        recent = dict(cls._recent_downloads())
+        current = dict(db.session.query(table.c.replay_id, table.c.download_30d_count).
+                       filter(table.c.download_30d_count > 0))
+
+        # Only touch the rows whose count has actually changed; most of them won't have between runs.
+        stale = [replay_id for replay_id in current if replay_id not in recent]
+        changed = [{'_replay_id': replay_id, '_count': count} for replay_id, count in recent.iteritems()
+                   if current.get(replay_id) != count]
+
+        for i in range(0, len(stale), cls.REBUILD_CHUNK_SIZE):
+            db.session.execute(
+                table.update().
+                where(table.c.replay_id.in_(stale[i:i + cls.REBUILD_CHUNK_SIZE])).
+                values(download_30d_count=0)
+            )
+        if changed:
+            db.session.execute(
+                table.update().
+                where(table.c.replay_id == bindparam('_replay_id')).
+                values(download_30d_count=bindparam('_count')),
+                changed
+            )
+        db.session.commit()
+
+        return len(recent)
+
+
+def _rating_deltas(positive, sign):
+    """ ReplayStats deltas for adding (sign=1) or removing (sign=-1) a rating. """
+    if positive:
+        return {"positive_rating_count": sign}
+    return {"negative_rating_count": sign}
+
+
+@event.listens_for(Replay, "after_insert")
+def _replay_stats_replay_inserted(mapper, connection, target):
+    connection.execute(ReplayStats.__table__.insert(), replay_id=target.id)
+
+
+@event.listens_for(ReplayFavourite, "after_insert")
+def _replay_stats_favourite_inserted(mapper, connection, target):
+    ReplayStats.apply_delta(connection, target.replay_id, favourite_count=1)
+
+
+@event.listens_for(ReplayFavourite, "after_delete")
+def _replay_stats_favourite_deleted(mapper, connection, target):
+    ReplayStats.apply_delta(connection, target.replay_id, favourite_count=-1)
+
+
+@event.listens_for(ReplayRating, "after_insert")
+def _replay_stats_rating_inserted(mapper, connection, target):
+    ReplayStats.apply_delta(connection, target.replay_id, **_rating_deltas(target.positive, 1))
+
+
+@event.listens_for(ReplayRating, "after_update")
+def _replay_stats_rating_updated(mapper, connection, target):
+    history = get_history(target, "positive")
+    if history.deleted and history.added and history.deleted[0] != history.added[0]:
+        ReplayStats.apply_delta(connection, target.replay_id, **_rating_deltas(history.deleted[0], -1))
+        ReplayStats.apply_delta(connection, target.replay_id, **_rating_deltas(history.added[0], 1))
+
+
+@event.listens_for(ReplayRating, "after_delete")
+def _replay_stats_rating_deleted(mapper, connection, target):
+    ReplayStats.apply_delta(connection, target.replay_id, **_rating_deltas(target.positive, -1))
+
+
+@event.listens_for(ReplayDownload, "after_insert")
+def _replay_stats_download_inserted(mapper, connection, target):
+    ReplayStats.apply_delta(connection, target.replay_id, download_count=1, download_30d_count=1)
+
+
+@event.listens_for(ReplayDownload, "after_delete")
+def _replay_stats_download_deleted(mapper, connection, target):
+    # Whether it was still counted in download_30d_count is left for refresh_recent_downloads to sort out.
+    ReplayStats.apply_delta(connection, target.replay_id, download_count=-1)
+
+
 class ReplayPlayer(db.Model):
     __tablename__ = "replay_players"
 
@@ -460,6 +1049,10 @@ class ReplayPlayer(db.Model):
     def __init__(self, replay_id):
         self.replay_id = replay_id
 
+    @property
+    def hero(self):
+        return Hero.get_by_id(self.hero_id)
+
     @property
     def team(self):
         if self.player_slot < 128:
@@ -467,39 +1060,50 @@ class ReplayPlayer(db.Model):
         else:
             return "Dire"
 
-    @mem_cache.memoize(60*60)  # Cache for 1 hour.
+    @staticmethod
+    def prefetch_profiles(players):
+        """ Fetches Steam profile data for every given player in as few WebAPI calls as possible, and stores it for the
+        rest of this request so `name` and `avatar` don't need to go upstream per player. """
+        if not hasattr(g, "steam_profiles"):
+            g.steam_profiles = {}
+
+        account_ids = [p.account_id for p in players if p.account_id and p.account_id not in g.steam_profiles]
+        g.steam_profiles.update(User.get_steam_profiles(account_ids))
+
     def get_profile_data(self):
-        """ Gets this user's data from the Web API.
-        TODO: Find a nice elegant way to batch these requests together - on pages showing many ReplayPlayers. """
+        """ Gets this user's data from the Web API, via the batched profile cache. """
         # Check if bot or not
         if self.account_id:
-            data = steam.user.profile(self.account_id + User.ACCOUNT_ID_TO_STEAM_ID_CORRECTION)
-            data.persona  # Touch an element to ensure steamodd loads some data
-            return data
+            steam_profiles = getattr(g, "steam_profiles", None)
+            if steam_profiles is not None and self.account_id in steam_profiles:
+                return steam_profiles[self.account_id]
+
+            return User.get_steam_profiles([self.account_id]).get(self.account_id)
         return None
 
     @property
     def name(self):
-        """ Queries the Steam Web API and grabs the name for this player.
+        """ Grabs the name for this player from their Steam profile.
         :return: Unicode - a player's name
         """
-        try:
-            profile_data = self.get_profile_data()
-            if profile_data:
-                return profile_data.persona
-            else:
-                return "Bot"
-        except steam.api.SteamError:
+        if not self.account_id:
+            return "Bot"
+
+        profile_data = self.get_profile_data()
+        if profile_data:
+            return profile_data["persona"]
+        else:
             return self.account_id
 
     @property
     def avatar(self):
-        """ Queries the Steam Web API and grabs the URL for this player's avatar.
+        """ Grabs the URL for this player's avatar from their Steam profile.
         :return: Unicode - URL to a player's avatar
         """
-        try:
-            return self.get_profile_data().avatar_large
-        except steam.api.SteamError:
+        profile_data = self.get_profile_data()
+        if profile_data:
+            return profile_data["avatar"]
+        else:
             return None
 
     @property
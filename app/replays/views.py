@@ -1,4 +1,3 @@
-from math import ceil
 from datetime import datetime, timedelta
 import re
 import unicodedata
@@ -12,6 +11,8 @@ from models import Replay, ReplayRating, ReplayFavourite, ReplayDownload, Search
 from app.admin.views import AdminModelView
 from forms import DownloadForm, SearchForm, AliasForm
 from app.filters import timestamp_to_datestring
+from app.pagination import KeysetPagination
+from app import counters
 
 
 mod = Blueprint("replays", __name__, url_prefix="/replays")
@@ -21,10 +22,14 @@ mod = Blueprint("replays", __name__, url_prefix="/replays")
 @mod.route("/page/<int:page>/")
 def replays(page=None):
     # TODO: Filters & ordering
-    if not page:
-        page = int(ceil(float(Replay.query.count() or 1) / float(current_app.config["REPLAYS_PER_PAGE"]))) # Default to last page
-
-    _replays = Replay.query.order_by(Replay.added_to_site_time.asc()).paginate(page, current_app.config["REPLAYS_PER_PAGE"], False)
+    if page is not None:
+        return redirect(url_for("replays.replays"), 301)  # Numbered pages replaced by keyset pagination
+
+    _replays = KeysetPagination.from_request(Replay.list_query(),
+                                             (Replay.added_to_site_time, Replay.id),
+                                             current_app.config["REPLAYS_PER_PAGE"],
+                                             total=counters.replays.get())
+    Replay.prefetch_listing_profiles(_replays.items)
     return render_template("replays/replays.html",
                            title="Replays - Dotabank",
                            replays=_replays)
@@ -32,19 +37,26 @@ def replays(page=None):
 
 @mod.route("/<int:_id>/")
 def replay(_id):
-    _replay = Replay.query.filter(Replay.id == _id).first()
+    _replay = Replay.detail_query().filter(Replay.id == _id).first()
     if _replay is None:
         abort(404)
 
-    key = _replay.get_s3_file()
     s3_data = None
-
-    if key:
+    if _replay.local_uri and _replay.file_size is not None:
         s3_data = {
-            "filename": key.name,
-            "md5": key.etag.replace("\"", ""),
-            "filesize": key.size
+            "filename": _replay.local_uri,
+            "md5": _replay.file_md5,
+            "filesize": _replay.file_size
         }
+    else:
+        # File details not recorded yet; ask S3.
+        key = _replay.get_s3_file()
+        if key:
+            s3_data = {
+                "filename": key.name,
+                "md5": key.etag.replace("\"", ""),
+                "filesize": key.size
+            }
 
     # Split bitmasks into a simple object store.
     if _replay.radiant_tower_status is not None\
@@ -104,7 +116,7 @@ def replay_alias(_id):
     """ Allows a user to set a custom name for a replay. """
 
     # Get replay
-    _replay = Replay.query.filter(Replay.id == _id).first_or_404()
+    _replay = Replay.detail_query().filter(Replay.id == _id).first_or_404()
 
     # Get existing or create new alias
     current_alias = ReplayAlias.query.filter(ReplayAlias.replay_id == _id, ReplayAlias.user_id == current_user.get_id()).first() or ReplayAlias(_id, current_user.get_id())
@@ -172,7 +184,7 @@ def add_gc_job(_id):
         return redirect(request.referrer or url_for("index"))
 
     # Check replay exists
-    _replay = Replay.query.filter(Replay.id == _id).first()
+    _replay = Replay.lightweight_query().filter(Replay.id == _id).first()
     if _replay is None:
         flash("Replay {} doesn't exist.".format(_id), "danger")
         return redirect(request.referrer or url_for("index"))
@@ -203,7 +215,7 @@ def add_dl_job(_id):
         return redirect(request.referrer or url_for("index"))
 
     # Check replay exists
-    _replay = Replay.query.filter(Replay.id == _id).first()
+    _replay = Replay.lightweight_query().filter(Replay.id == _id).first()
     if _replay is None:
         flash("Replay {} doesn't exist.".format(_id), "danger")
         return redirect(request.referrer or url_for("index"))
@@ -255,7 +267,7 @@ def api_populate(_id):
         return redirect(request.referrer or url_for("index"))
 
     # Check replay exists
-    _replay = Replay.query.filter(Replay.id == _id).first()
+    _replay = Replay.lightweight_query().filter(Replay.id == _id).first()
     if _replay is None:
         flash("Replay {} doesn't exist.".format(_id), "danger")
         return redirect(request.referrer or url_for("index"))
@@ -300,12 +312,13 @@ def replay_favourite(_id):
 @mod.route("/<int:_id>/download/", methods=['GET', 'POST'])
 @login_required
 def download(_id):
-    _replay = Replay.query.filter(Replay.id == _id).first()
+    _replay = Replay.detail_query().filter(Replay.id == _id).first()
     if _replay is None:
         flash("Replay {} not found.".format(_id), "danger")
         return redirect(request.referrer or url_for("index"))
 
-    if _replay.get_s3_file() is None:
+    key = _replay.get_s3_file()
+    if key is None:
         if _replay.state != 'ARCHIVED':
             flash("Replay {} not yet stored in Dotabank.".format(_id), "danger")
         else:
@@ -313,7 +326,6 @@ def download(_id):
         return redirect(request.referrer or url_for("index"))
 
     form = DownloadForm()
-    key = _replay.get_s3_file()
 
     expires_at = (datetime.utcnow() + timedelta(seconds=current_app.config["REPLAY_DOWNLOAD_TIMEOUT"])).ctime()
     name = key.name
@@ -371,7 +383,7 @@ def search():
                 match_id = search.group(1)
 
         if unicode.isdecimal(match_id):
-            _replay = Replay.query.filter(Replay.id == match_id).first()
+            _replay = Replay.lightweight_query().filter(Replay.id == match_id).first()
 
             # If we don't have match_id in database, check if it's a valid match via the WebAPI and if so add it to DB.
             if not _replay:
@@ -0,0 +1,138 @@
+"""
+Retention for the append-only tables: gc_jobs, logs and searches.
+
+Rows older than RETENTION_MAX_AGE_DAYS are moved, a chunk at a time, into gzipped JSON lines files under
+RETENTION_ARCHIVE_DIR and deleted from the database.  Each chunk is its own short transaction, deleting by primary key,
+so nothing is locked for long.  Daily per-category counts of everything archived are kept in ArchivedRows so reports
+can still include historical totals; GC jobs are only archived once GCJobRollup has counted them.
+"""
+
+from app import app, db, counters
+from app.gc.models import GCJob, GCJobRollup
+from app.models import Log, ArchivedRows
+from app.replays.models import Search
+from datetime import datetime, date, timedelta
+from time import sleep
+import gzip
+import json
+import os
+
+
+class RetentionPolicy(object):
+    """ What to archive from `model`'s table, and how to summarise it.
+
+    :param timestamp: column rows are aged by.
+    :param category: function of an archived row (a dict) returning the category it's summarised under.
+    :param where: extra conditions rows must meet to be archived.
+    :param on_delete: function called with the archived rows after they're deleted, e.g. to correct counters.
+    """
+
+    def __init__(self, name, model, timestamp, category, where=None, on_delete=None):
+        self.name = name
+        self.model = model
+        self.timestamp = timestamp
+        self.category = category
+        self.where = where or []
+        self.on_delete = on_delete
+
+    def __repr__(self):
+        return "<RetentionPolicy {}>".format(self.name)
+
+
+def _resolved_logs_deleted(rows):
+    counters.resolved_logs.add(-len(rows))
+
+
+def _searches_deleted(rows):
+    per_user = {}
+    for row in rows:
+        per_user[row["user_id"]] = per_user.get(row["user_id"], 0) + 1
+    for user_id, count in per_user.iteritems():
+        counters.user_searches.add(-count, user_id)
+
+
+POLICIES = [
+    RetentionPolicy("gc_jobs", GCJob, GCJob.timestamp,
+                    category=lambda row: row["type"] or "UNKNOWN",
+                    where=[GCJob.id <= db.select([db.func.coalesce(db.func.max(GCJobRollup.last_job_id), 0)]).
+                           as_scalar()]),  # Only jobs the hourly rollups have already counted.
+    RetentionPolicy("logs", Log, Log.created_at,
+                    category=lambda row: row["level"] or "UNKNOWN",
+                    where=[Log.resolved_by_user_id != None],  # Never archive anything nobody has looked at.
+                    on_delete=_resolved_logs_deleted),
+    RetentionPolicy("searches", Search, Search.created_at,
+                    category=lambda row: "success" if row["success"] else "failure",
+                    on_delete=_searches_deleted),
+]
+
+
+def _json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError("{!r} is not JSON serializable".format(value))
+
+
+def archive(policy, max_age_days=None, chunk_size=None, pause=None):
+    """ Moves `policy`'s rows older than `max_age_days` into this run's archive file.  Returns the number of rows
+    archived. """
+    if max_age_days is None:
+        max_age_days = app.config["RETENTION_MAX_AGE_DAYS"][policy.name]
+    chunk_size = chunk_size or app.config["RETENTION_CHUNK_SIZE"]
+    pause = app.config["RETENTION_CHUNK_PAUSE"] if pause is None else pause
+
+    table = policy.model.__table__
+    cutoff = datetime.utcnow() - timedelta(days=max_age_days)
+    directory = os.path.join(app.config["RETENTION_ARCHIVE_DIR"], policy.name)
+    path = os.path.join(directory, "{}-{}.jsonl.gz".format(policy.name, datetime.utcnow().strftime("%Y%m%d%H%M%S")))
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    archived = 0
+    last_id = 0
+    while True:
+        rows = [dict(row) for row in db.session.execute(
+            table.select().
+            where(db.and_(table.c.id > last_id, policy.timestamp < cutoff, *policy.where)).
+            order_by(table.c.id.asc()).
+            limit(chunk_size)
+        )]
+        if not rows:
+            break
+
+        # Appending makes a multi-member gzip file, which gzip reads back as one stream.
+        archive_file = gzip.open(path, "ab")
+        try:
+            for row in rows:
+                archive_file.write(json.dumps(row, default=_json_default) + "\n")
+        finally:
+            archive_file.close()
+
+        summary = {}
+        for row in rows:
+            key = (row[policy.timestamp.key].date(), policy.category(row))
+            summary[key] = summary.get(key, 0) + 1
+        ArchivedRows.add(policy.name, summary)
+
+        ids = [row["id"] for row in rows]
+        db.session.execute(table.delete().where(table.c.id.in_(ids)))
+        db.session.commit()
+        if policy.on_delete is not None:
+            # The rows are gone either way, so don't let a failure here stop the rest of the run; counters are
+            # recounted by reconcile_counters anyway.
+            try:
+                policy.on_delete(rows)
+            except Exception:
+                app.logger.exception("Retention policy {} failed to handle deleted rows".format(policy.name))
+
+        archived += len(rows)
+        last_id = ids[-1]
+        if len(rows) < chunk_size:
+            break
+        sleep(pause)  # Let everything else at the table between chunks.
+
+    return archived
+
+
+def run():
+    """ Archives old rows from every table with a retention policy.  Returns a dict of policy name => rows archived. """
+    return {policy.name: archive(policy) for policy in POLICIES}
@@ -0,0 +1,212 @@
+"""
+Stand-ins for Dotabank's SQS queues and S3 bucket, backed by the local file-system, so the queue and archive code can be
+run (and benchmarked) without AWS.  Enabled by setting STORAGE_BACKEND = "local"; see app/__init__.py.
+
+Only the parts of boto's Queue, Bucket and Key APIs that Dotabank uses are implemented.
+
+Also provides `lazy_proxy`, which app/__init__.py uses so neither backend is connected to until it's first used.
+"""
+
+import os
+import errno
+import shutil
+import threading
+import uuid
+from collections import namedtuple
+from hashlib import md5
+from time import time
+from werkzeug.local import LocalProxy
+
+BatchResults = namedtuple("BatchResults", ["results", "errors"])
+MultiDeleteResult = namedtuple("MultiDeleteResult", ["deleted", "errors"])
+
+
+def lazy_proxy(factory):
+    """ Returns a proxy to the object `factory` returns, calling `factory` once, the first time the proxy is used. """
+    lock = threading.Lock()
+    instance = []
+
+    def get_instance():
+        if not instance:
+            with lock:
+                if not instance:
+                    instance.append(factory())
+        return instance[0]
+
+    return LocalProxy(get_instance)
+
+
+def _makedirs(path):
+    try:
+        os.makedirs(path)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+
+class LocalMessage(object):
+    """ A message read from a LocalQueue. """
+
+    def __init__(self, queue, filename, body):
+        self.queue = queue
+        self.filename = filename
+        self._body = body
+
+    def get_body(self):
+        return self._body
+
+    def delete(self):
+        return self.queue.delete_message(self)
+
+
+class LocalQueue(object):
+    """ A queue stored as one file per message in `path`, read oldest first.  Messages which have been read are moved
+    to an `inflight` sub-directory until they're deleted. """
+
+    def __init__(self, path):
+        self.path = path
+        self._inflight_path = os.path.join(path, "inflight")
+        _makedirs(self._inflight_path)
+
+    def __repr__(self):
+        return "<LocalQueue {}>".format(self.path)
+
+    def _write_body(self, body):
+        # Zero-padded timestamp first so a directory listing sorts oldest first.
+        filename = "{:020.6f}-{}".format(time(), uuid.uuid4().hex)
+        tmp_path = os.path.join(self.path, "." + filename)
+        with open(tmp_path, "wb") as f:
+            f.write(body)
+        os.rename(tmp_path, os.path.join(self.path, filename))
+        return filename
+
+    def write(self, message, delay_seconds=None):
+        self._write_body(message.get_body())
+        return message
+
+    def write_batch(self, messages):
+        """ Takes a list of (id, body, delay_seconds) tuples, like boto's Queue.write_batch. """
+        results = []
+        for message_id, body, delay_seconds in messages:
+            filename = self._write_body(body)
+            results.append({"id": message_id, "message_id": filename, "md5_of_message_body": md5(body).hexdigest()})
+        return BatchResults(results=results, errors=[])
+
+    def read(self, visibility_timeout=None):
+        for filename in sorted(os.listdir(self.path)):
+            if filename.startswith(".") or filename == "inflight":
+                continue
+            try:
+                # Renaming is atomic, so only one concurrent reader gets each message.
+                os.rename(os.path.join(self.path, filename), os.path.join(self._inflight_path, filename))
+            except OSError:
+                continue
+
+            with open(os.path.join(self._inflight_path, filename), "rb") as f:
+                return LocalMessage(self, filename, f.read())
+        return None
+
+    def delete_message(self, message):
+        try:
+            os.remove(os.path.join(self._inflight_path, message.filename))
+            return True
+        except OSError:
+            return False
+
+    def count(self):
+        return len([filename for filename in os.listdir(self.path)
+                    if not filename.startswith(".") and filename != "inflight"])
+
+    def clear(self):
+        shutil.rmtree(self.path)
+        _makedirs(self._inflight_path)
+
+
+class LocalKey(object):
+    """ A file stored in a LocalBucket. """
+
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+        self.size = None
+        self.etag = None
+
+    def __repr__(self):
+        return "<LocalKey {}>".format(self.name)
+
+    @property
+    def key(self):
+        return self.name
+
+    @property
+    def path(self):
+        return os.path.join(self.bucket.path, self.name)
+
+    def _load_metadata(self):
+        self.size = os.path.getsize(self.path)
+        with open(self.path, "rb") as f:
+            self.etag = '"{}"'.format(md5(f.read()).hexdigest())
+        return self
+
+    def set_contents_from_string(self, data):
+        _makedirs(os.path.dirname(self.path))
+        with open(self.path, "wb") as f:
+            f.write(data)
+        self._load_metadata()
+
+    def set_contents_from_filename(self, filename):
+        _makedirs(os.path.dirname(self.path))
+        shutil.copyfile(filename, self.path)
+        self._load_metadata()
+
+    def get_contents_as_string(self):
+        with open(self.path, "rb") as f:
+            return f.read()
+
+    def generate_url(self, expires_in):
+        return "file://" + os.path.abspath(self.path)
+
+    def delete(self):
+        return self.bucket.delete_key(self.name)
+
+
+class LocalBucket(object):
+    """ A bucket stored as a directory tree in `path`, with key names as relative paths. """
+
+    def __init__(self, path):
+        self.path = path
+        _makedirs(path)
+
+    def __repr__(self):
+        return "<LocalBucket {}>".format(self.path)
+
+    def __iter__(self):
+        return iter(self.list())
+
+    def new_key(self, name):
+        return LocalKey(self, name)
+
+    def get_key(self, name):
+        key = LocalKey(self, name)
+        if not os.path.isfile(key.path):
+            return None
+        return key._load_metadata()
+
+    def list(self, prefix=""):
+        for root, dirs, files in os.walk(self.path):
+            dirs.sort()
+            for filename in sorted(files):
+                name = os.path.relpath(os.path.join(root, filename), self.path).replace(os.sep, "/")
+                if name.startswith(prefix):
+                    yield LocalKey(self, name)._load_metadata()
+
+    def delete_key(self, name):
+        try:
+            os.remove(LocalKey(self, name).path)
+        except OSError:
+            pass
+
+    def delete_keys(self, names):
+        for name in names:
+            self.delete_key(name)
+        return MultiDeleteResult(deleted=list(names), errors=[])
@@ -1,21 +1,34 @@
-from flask import Blueprint, render_template, current_app, abort, url_for
+from flask import Blueprint, render_template, current_app, abort, url_for, redirect
 from app.replays.models import Replay
+from app.pagination import KeysetPagination, approximate_count
 from sqlalchemy import or_
 
 
 mod = Blueprint("teams", __name__, url_prefix="/teams")
 @mod.route("/<int:_id>/")
 @mod.route("/<int:_id>/page/<int:page>")
-def team(_id, page=1):
+def team(_id, page=None):
+    if page is not None:
+        return redirect(url_for("teams.team", _id=_id), 301)  # Numbered pages replaced by keyset pagination
 
-    _replays = Replay.query.filter(or_(Replay.radiant_team_id == _id, Replay.dire_team_id == _id)).order_by(Replay.id.desc()).paginate(page, current_app.config["REPLAYS_PER_PAGE"])
-    if _replays.total <= 0:
+    _query = Replay.query.filter(or_(Replay.radiant_team_id == _id, Replay.dire_team_id == _id))
+
+    # Teams only exist through their replays, so take the team's details from its latest one.  A stale or past-the-end
+    # cursor gets an empty page rather than a 404.
+    _latest = _query.order_by(Replay.id.desc()).first()
+    if _latest is None:
         abort(404)
 
+    _replays = KeysetPagination.from_request(Replay.list_query(_query),
+                                             (Replay.id,),
+                                             current_app.config["REPLAYS_PER_PAGE"],
+                                             total=approximate_count("team_{}".format(_id), _query))
+    Replay.prefetch_listing_profiles(_replays.items)
+
     _team = {
         'id': _id,
-        'name': _replays.items[0].radiant_team_name if _replays.items[0].radiant_team_id == _id else _replays.items[0].dire_team_name,
-        'logo': url_for('ugcfile', _id=_replays.items[0].radiant_team_logo) if _replays.items[0].radiant_team_id == _id else url_for('ugcfile', _id=_replays.items[0].dire_team_logo)
+        'name': _latest.radiant_team_name if _latest.radiant_team_id == _id else _latest.dire_team_name,
+        'logo': url_for('ugcfile', _id=_latest.radiant_team_logo) if _latest.radiant_team_id == _id else url_for('ugcfile', _id=_latest.dire_team_logo)
     }
 
     return render_template("teams/team.html",
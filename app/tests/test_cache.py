@@ -0,0 +1,238 @@
+import os
+import sys
+sys.path.append(os.path.join(os.getcwd(), '..'))
+
+import unittest
+import shutil
+import tempfile
+import threading
+from time import sleep, time
+from app.cache import DotabankFileSystemCache, TieredCache, SingleFlightCache, MemcachedNotFound
+from werkzeug.contrib.cache import MemcachedCache
+
+
+class DotabankFileSystemCacheTestCase(unittest.TestCase):
+    """ Testing cache/DotabankFileSystemCache """
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.cache = DotabankFileSystemCache(self.cache_dir, threshold=30)
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_prune_least_recently_used(self):
+        """ Test pruning drops the least recently used entries, down to two thirds of the threshold """
+        for i in range(31):
+            self.cache.set("key_{}".format(i), i)
+
+        self.assertEqual(len(self.cache._entries), 20)
+        self.assertIsNone(self.cache.get("key_0"))
+        self.assertEqual(self.cache.get("key_30"), 30)
+
+    def test_prune_expired_first(self):
+        """ Test expired entries are pruned before any live ones """
+        self.cache.set("expired", 1, timeout=-1)
+        for i in range(30):
+            self.cache.set("key_{}".format(i), i)
+
+        self.assertNotIn(os.path.basename(self.cache._get_filename("expired")), self.cache._entries)
+        self.assertEqual(len(self.cache._entries), 30)
+        self.assertEqual(self.cache.get("key_0"), 0)
+
+    def test_prune_doesnt_sync_index(self):
+        """ Test pruning leaves the side index to its periodic sync """
+        self.cache.set("key", 1)
+        synced_at = self.cache._index_synced_at
+        for i in range(40):
+            self.cache.set("key_{}".format(i), i)
+
+        self.assertEqual(self.cache._index_synced_at, synced_at)
+
+    def test_add(self):
+        """ Test add only sets keys which aren't already set (or have expired) """
+        self.assertTrue(self.cache.add("key", 1))
+        self.assertFalse(self.cache.add("key", 2))
+        self.assertEqual(self.cache.get("key"), 1)
+
+        self.cache.set("expired", 1, timeout=-1)
+        self.assertTrue(self.cache.add("expired", 2))
+        self.assertEqual(self.cache.get("expired"), 2)
+
+    def test_add_concurrent(self):
+        """ Test exactly one of many concurrent adds succeeds """
+        results = []
+        threads = [threading.Thread(target=lambda i=i: results.append(self.cache.add("key", i))) for i in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results.count(True), 1)
+
+
+class TieredCacheTestCase(unittest.TestCase):
+    """ Testing cache/TieredCache """
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.cache = TieredCache(DotabankFileSystemCache(self.cache_dir))
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_local_hit(self):
+        """ Test repeat gets are served from the local tier """
+        self.cache.set("key", 1)
+        self.assertEqual(self.cache.get("key"), 1)
+        self.assertEqual(self.cache.stats['local']['hits'], 1)
+        self.assertEqual(self.cache.stats['backend']['hits'], 0)
+
+    def test_local_copies(self):
+        """ Test mutating a value we got back doesn't change what the next caller gets """
+        self.cache.set("key", [1])
+        self.cache.get("key").append(2)
+        self.assertEqual(self.cache.get("key"), [1])
+
+    def test_add(self):
+        """ Test add reports whether the key was added, and isn't fooled by the local tier """
+        self.assertTrue(self.cache.add("key", 1))
+        self.assertFalse(self.cache.add("key", 2))
+        self.assertEqual(self.cache.get("key"), 1)
+
+        self.cache.backend.delete("key")  # e.g. by another process
+        self.assertTrue(self.cache.add("key", 3))
+        self.assertEqual(self.cache.get("key"), 3)
+
+
+    def test_inc_cold(self):
+        """ Test inc and dec leave keys which aren't cached alone """
+        self.assertIsNone(self.cache.inc("key", 2))
+        self.assertIsNone(self.cache.dec("key", 2))
+        self.assertIsNone(self.cache.get("key"))
+
+    def test_inc(self):
+        """ Test inc and dec adjust cached keys, and the local tier doesn't serve the old value """
+        self.cache.set("key", 5)
+        self.assertEqual(self.cache.get("key"), 5)
+        self.assertEqual(self.cache.inc("key", 2), 7)
+        self.assertEqual(self.cache.dec("key"), 6)
+        self.assertEqual(self.cache.get("key"), 6)
+
+
+class TieredMemcachedCacheTestCase(unittest.TestCase):
+    """ Testing cache/TieredCache in front of werkzeug's MemcachedCache """
+
+    class Client(object):
+        """ Behaves like pylibmc's client for the calls TieredCache makes directly. """
+        def __init__(self):
+            self.values = {}
+
+        def add(self, key, value, timeout):
+            if key in self.values:
+                return False
+            self.values[key] = value
+            return True
+
+        def incr(self, key, delta):
+            if key not in self.values:
+                raise MemcachedNotFound()
+            self.values[key] += delta
+            return self.values[key]
+
+        def decr(self, key, delta):
+            if key not in self.values:
+                raise MemcachedNotFound()
+            self.values[key] = max(self.values[key] - delta, 0)
+            return self.values[key]
+
+    def setUp(self):
+        self.client = self.Client()
+        self.cache = TieredCache(MemcachedCache(self.client, key_prefix="prefix_"))
+
+    def test_add(self):
+        """ Test add reports the client's result, under the backend's key prefix """
+        self.assertTrue(self.cache.add(u"key", 1))
+        self.assertFalse(self.cache.add("key", 2))
+        self.assertEqual(self.client.values, {"prefix_key": 1})
+
+    def test_inc_cold(self):
+        """ Test inc and dec of keys which aren't cached don't raise, or create them """
+        self.assertIsNone(self.cache.inc("key"))
+        self.assertIsNone(self.cache.dec("key"))
+        self.assertEqual(self.client.values, {})
+
+    def test_inc(self):
+        """ Test inc and dec adjust cached keys """
+        self.client.values["prefix_key"] = 5
+        self.assertEqual(self.cache.inc("key", 2), 7)
+        self.assertEqual(self.cache.dec("key", 3), 4)
+
+
+class SingleFlightCacheTestCase(unittest.TestCase):
+    """ Testing cache/SingleFlightCache """
+
+    class Cache(object):
+        """ Stands in for a Flask-Cache `Cache`, which SingleFlightCache only needs the backend of. """
+        def __init__(self, cache):
+            self.cache = cache
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.cache = SingleFlightCache(self.Cache(TieredCache(DotabankFileSystemCache(self.cache_dir))),
+                                       lock_timeout=5)
+        self.calls = []
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def compute(self, value=42, duration=0):
+        self.calls.append(value)
+        sleep(duration)
+        return value
+
+    def test_cold_key_computed_once(self):
+        """ Test concurrent gets of a cold key compute it once, the rest waiting for that worker's value """
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(
+            self.cache.get_or_compute("key", lambda: self.compute(duration=1), timeout=60))) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results, [42] * 5)
+        self.assertEqual(len(self.calls), 1)
+
+    def test_take_over_failed_lock(self):
+        """ Test a waiting worker computes the value itself once the lock's released without one """
+        self.cache.backend.add("key_lock", 1, 60)
+        threading.Timer(0.3, self.cache.backend.delete, ["key_lock"]).start()
+
+        started_at = time()
+        self.assertEqual(self.cache.get_or_compute("key", self.compute, timeout=60), 42)
+        self.assertLess(time() - started_at, 2)
+
+    def test_refresh_ahead(self):
+        """ Test a value due a refresh is served as is while it's recomputed in the background """
+        self.cache.backend.set("key", (1, time() + 1), 60)  # Within refresh_ahead of a 60 second timeout
+
+        self.assertEqual(self.cache.get_or_compute("key", lambda: self.compute(2, 0.5), timeout=60), 1)
+        for thread in threading.enumerate():
+            if thread.name == "single_flight_refresh":
+                thread.join(5)
+
+        self.assertEqual(self.calls, [2])
+        self.assertEqual(self.cache.get_or_compute("key", self.compute, timeout=60), 2)
+
+    def test_stale_served_while_locked(self):
+        """ Test a stale value is served, rather than recomputed, while another worker holds the lock """
+        self.cache.backend.set("key", (1, time() - 1), 60)
+        self.cache.backend.add("key_lock", 1, 60)
+
+        self.assertEqual(self.cache.get_or_compute("key", self.compute, timeout=60), 1)
+        self.assertEqual(self.calls, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import os
+import sys
+sys.path.append(os.path.join(os.getcwd(), '..'))
+
+from test_base import DotabankTestCase
+import unittest
+import shutil
+import tempfile
+from app import app, db, mem_cache
+from app.cache import TieredCache, DotabankFileSystemCache
+from app.replays.models import Search
+from app import counters
+
+
+class CounterTestCase(DotabankTestCase):
+    """ Testing counters/Counter against a real (file system) cache """
+
+    USER_ID = 1
+
+    def setUp(self):
+        super(CounterTestCase, self).setUp()
+
+        self.cache_dir = tempfile.mkdtemp()
+        self.null_cache = app.extensions['cache'][mem_cache]
+        app.extensions['cache'][mem_cache] = TieredCache(DotabankFileSystemCache(self.cache_dir))
+
+    def tearDown(self):
+        app.extensions['cache'][mem_cache] = self.null_cache
+        shutil.rmtree(self.cache_dir)
+        super(CounterTestCase, self).tearDown()
+
+    def add_search(self):
+        search = Search(user_id=self.USER_ID, search_query="1", success=False)
+        db.session.add(search)
+        db.session.commit()
+        return search
+
+    def test_insert_cold(self):
+        """ Test inserting a row with nothing cached for its counter doesn't cache a count """
+        self.add_search()
+
+        self.assertIsNone(mem_cache.get(counters.user_searches._key(self.USER_ID)))
+        self.assertEqual(counters.user_searches.get(self.USER_ID), 1)
+
+    def test_delete_cold(self):
+        """ Test deleting a row with nothing cached for its counter doesn't cache a count """
+        search = self.add_search()
+        db.session.delete(search)
+        db.session.commit()
+
+        self.assertIsNone(mem_cache.get(counters.user_searches._key(self.USER_ID)))
+        self.assertEqual(counters.user_searches.get(self.USER_ID), 0)
+
+    def test_insert_warm(self):
+        """ Test inserting a row adjusts a cached count """
+        self.assertEqual(counters.user_searches.get(self.USER_ID), 0)
+        self.add_search()
+
+        self.assertEqual(mem_cache.get(counters.user_searches._key(self.USER_ID)), 1)
+
+    def test_add_cold(self):
+        """ Test adjusting a count which isn't cached leaves it to be counted from the database """
+        counters.unresolved_logs.add(5)
+
+        self.assertIsNone(mem_cache.get(counters.unresolved_logs._key()))
+
+
+if __name__ == '__main__':
+    unittest.main()
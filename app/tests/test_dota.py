@@ -4,7 +4,7 @@ sys.path.append(os.path.join(os.getcwd(), '..'))
 
 from test_base import DotabankTestCase
 import unittest
-from app.dota.models import Hero, Item, Schema, Localization
+from app.dota.models import Hero, Item, Region, Schema, Localization
 from flask import url_for, g
 from app import steam
 
@@ -67,6 +67,16 @@ class HeroTestCase(DotaTestCase):
         self.assertEqual(crystal_maiden.localized_name, self.CRYSTAL_MAIDEN['localized_name'])
         self.assertEqual(crystal_maiden.image, url_for('hero_image', hero_name=self.CRYSTAL_MAIDEN['image_name']))
 
+    def test_registry_lookups(self):
+        """ Test the in-process hero registry's id, token and name indexes agree """
+        crystal_maiden = Hero.get_by_id(self.CRYSTAL_MAIDEN['id'])
+
+        self.assertIsNotNone(crystal_maiden)
+        self.assertIs(Hero.get_by_token(self.CRYSTAL_MAIDEN['token']), crystal_maiden)
+        self.assertIs(Hero.get_by_name(self.CRYSTAL_MAIDEN['name']), crystal_maiden)
+        self.assertIn(crystal_maiden, Hero.get_all())
+        self.assertIsNone(Hero.get_by_name('not_a_hero'))
+
 
 class ItemTestCase(DotaTestCase):
     """ Testing dota/models/Item """
@@ -106,6 +116,32 @@ class ItemTestCase(DotaTestCase):
         self.assertEqual(blink_dagger.localized_name, self.BLINK_DAGGER['localized_name'])
         self.assertEqual(blink_dagger.icon, url_for('item_icon', item_filename=self.BLINK_DAGGER['image_filename']))
 
+    def test_indexes_follow_refresh(self):
+        """ Test the id and token indexes are rebuilt when the item list is reloaded """
+        Item._load([Item(1, 'item_blink'), Item(2, 'item_blades_of_attack')])
+        self.assertEqual(Item.get_by_id(2).token, 'item_blades_of_attack')
+
+        Item._load([Item(1, 'item_blink')])
+        self.assertIsNone(Item.get_by_id(2))
+        self.assertIsNone(Item.get_by_token('item_blades_of_attack'))
+        self.assertEqual(Item.get_by_token('item_blink').id, 1)
+
+        Item._items = None  # Force a real fetch for other tests
+
+
+class RegionTestCase(DotaTestCase):
+    """ Testing dota/models/Region """
+
+    def test_get_by_cluster(self):
+        """ Test we can get a region by any of its clusters """
+        Region._load([Region(1, clusters=[111, 112]), Region(2, clusters=[121])])
+
+        self.assertEqual(Region.get_by_cluster(112).id, 1)
+        self.assertEqual(Region.get_by_cluster(121).id, 2)
+        self.assertIsNone(Region.get_by_cluster(999))
+
+        Region._regions = None  # Force a real fetch for other tests
+
 
 class SchemaTestCase(DotabankTestCase):
 
@@ -0,0 +1,65 @@
+import os
+import sys
+sys.path.append(os.path.join(os.getcwd(), '..'))
+
+from test_base import DotabankTestCase
+import unittest
+from flask import url_for
+from flask.ext.login import login_user
+from app import app, db
+from app.replays.models import Replay, ReplayRating, ReplayFavourite
+from app.users.models import User
+
+
+class ReplayUserActionsTestCase(DotabankTestCase):
+    """ Testing replays/models/Replay's per-user ratings and favourites, as rendered in listings """
+
+    USER_ID = 4000000001
+    REPLAY_ID = 4000000001
+
+    def setUp(self):
+        super(ReplayUserActionsTestCase, self).setUp()
+        self.user = User(self.USER_ID, u"Test user")
+        self.replay = Replay(self.REPLAY_ID, skip_webapi=True)
+        db.session.add(self.user)
+        db.session.add(self.replay)
+        db.session.commit()
+        db.session.add(ReplayRating(self.REPLAY_ID, self.USER_ID, True))
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.rollback()
+        ReplayRating.query.filter(ReplayRating.user_id == self.USER_ID).delete()
+        ReplayFavourite.query.filter(ReplayFavourite.user_id == self.USER_ID).delete()
+        Replay.query.filter(Replay.id == self.REPLAY_ID).delete()
+        User.query.filter(User.id == self.USER_ID).delete()
+        db.session.commit()
+        super(ReplayUserActionsTestCase, self).tearDown()
+
+    def test_user_actions(self):
+        """ Test the current user's rating and favourite are looked up, prefetched or not """
+        with app.test_request_context():
+            login_user(self.user)
+            Replay.prefetch_user_actions([self.replay])
+
+            self.assertTrue(self.replay.user_rating().positive)
+            self.assertFalse(self.replay.user_favourite())
+
+        with app.test_request_context():
+            login_user(self.user)
+
+            self.assertTrue(self.replay.user_rating().positive)
+            self.assertFalse(self.replay.user_favourite())
+
+    def test_listing_authenticated(self):
+        """ Test the replay listing renders for a logged in user """
+        with self.app.session_transaction() as session:
+            session['user_id'] = unicode(self.USER_ID)
+            session['_fresh'] = True
+
+        response = self.app.get(url_for('replays.replays'))
+        self.assertEqual(response.status_code, 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
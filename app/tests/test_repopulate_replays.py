@@ -0,0 +1,67 @@
+import os
+import sys
+sys.path.append(os.path.join(os.getcwd(), '..'))
+
+from test_base import DotabankTestCase
+import unittest
+import threading
+import shutil
+import tempfile
+from app import app, mem_cache
+from app.cache import TieredCache, DotabankFileSystemCache
+from app.cron import repopulate_replays
+
+
+class RepopulateReplaysTestCase(DotabankTestCase):
+    """ Testing cron/repopulate_replays job locking """
+
+    def setUp(self):
+        super(RepopulateReplaysTestCase, self).setUp()
+
+        # The job lock needs a cache with a working add, which the null cache used for tests doesn't have.
+        self.cache_dir = tempfile.mkdtemp()
+        self.null_cache = app.extensions['cache'][mem_cache]
+        app.extensions['cache'][mem_cache] = TieredCache(DotabankFileSystemCache(self.cache_dir))
+
+        self.release = threading.Event()
+        self.repopulate = repopulate_replays.repopulate_replays
+
+        def held_repopulate(*args, **kwargs):
+            self.release.wait(10)
+            return self.repopulate(*args, **kwargs)
+        repopulate_replays.repopulate_replays = held_repopulate
+
+    def tearDown(self):
+        self.release.set()
+        for thread in threading.enumerate():
+            if thread.name == "repopulate_replays":
+                thread.join(10)
+
+        repopulate_replays.repopulate_replays = self.repopulate
+        app.extensions['cache'][mem_cache] = self.null_cache
+        shutil.rmtree(self.cache_dir)
+        super(RepopulateReplaysTestCase, self).tearDown()
+
+    def test_start_once(self):
+        """ Test a job starts, and a second can't start while it's running """
+        self.assertTrue(repopulate_replays.start_repopulate_replays())
+        self.assertEqual(repopulate_replays.get_progress()["state"], "starting")
+
+        self.assertFalse(repopulate_replays.start_repopulate_replays())
+        self.assertIsNone(self.repopulate())
+
+    def test_start_after_finish(self):
+        """ Test the lock is released once a job finishes """
+        self.assertTrue(repopulate_replays.start_repopulate_replays())
+
+        self.release.set()
+        for thread in threading.enumerate():
+            if thread.name == "repopulate_replays":
+                thread.join(10)
+
+        self.assertIn("finished_at", repopulate_replays.get_progress())
+        self.assertTrue(repopulate_replays.start_repopulate_replays())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,12 @@
-from app import db, steam
+from app import db, steam, mem_cache
+from flask import current_app
 from flask.ext.login import AnonymousUserMixin
+from sqlalchemy import bindparam
+import atexit
 import datetime
+import threading
 from calendar import timegm as to_timestamp
+from time import time
 
 
 # noinspection PyMethodMayBeStatic
@@ -25,7 +30,8 @@ class User(db.Model):
     email = db.Column(db.String(64), unique=False, nullable=True)
     enabled = db.Column(db.Boolean, default=True, nullable=False)
     first_seen = db.Column(db.DateTime, default=datetime.datetime.utcnow, index=True)
-    last_seen = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    last_seen = db.Column(db.DateTime, default=datetime.datetime.utcnow, index=True)
+    name_updated_at = db.Column(db.DateTime, index=True)  # Last time we refreshed `name` from Steam
     admin = db.Column(db.Boolean, default=False)
     show_ads = db.Column(db.Boolean, default=True)
 
@@ -45,6 +51,13 @@ class User(db.Model):
     }
 
     ACCOUNT_ID_TO_STEAM_ID_CORRECTION = 76561197960265728
+    STEAM_PROFILE_CACHE_KEY = "steam_profile_{}"
+    STEAM_PROFILE_BATCH_SIZE = 100  # Max steamids GetPlayerSummaries will accept per request
+
+    # Write-behind buffer of user id => last seen time, written to the database in bulk by flush_last_seen.
+    _last_seen_buffer = {}
+    _last_seen_flushed_at = time()
+    _last_seen_lock = threading.Lock()
 
     def __init__(self, _id=None, name=None, enabled=True):
         self.id = _id
@@ -70,10 +83,42 @@ class User(db.Model):
         return self.admin
 
     def update_last_seen(self):
-        # Called every page load for current_user
-        self.last_seen = datetime.datetime.utcnow()
-        db.session.add(self)
-        db.session.commit()
+        """ Called every page load for current_user.  Doesn't write anything if we've seen the user within
+        LAST_SEEN_UPDATE_WINDOW, otherwise buffers the timestamp for the next bulk flush. """
+        now = datetime.datetime.utcnow()
+        window = datetime.timedelta(seconds=current_app.config['LAST_SEEN_UPDATE_WINDOW'])
+        if self.last_seen is not None and now - self.last_seen < window:
+            return
+
+        with User._last_seen_lock:
+            User._last_seen_buffer[self.id] = now
+            flush_due = time() - User._last_seen_flushed_at >= current_app.config['LAST_SEEN_FLUSH_INTERVAL']
+
+        if flush_due:
+            User.flush_last_seen()
+
+    @classmethod
+    def flush_last_seen(cls):
+        """ Writes every buffered last seen timestamp to the database in one bulk UPDATE.
+
+        Runs on its own connection rather than the request's session, so flushing never commits or rolls back anything
+        the current request is doing.
+        """
+        with cls._last_seen_lock:
+            pending = cls._last_seen_buffer
+            cls._last_seen_buffer = {}
+            cls._last_seen_flushed_at = time()
+
+        if not pending:
+            return
+
+        users_table = cls.__table__
+        db.engine.execute(
+            users_table.update().
+            where(users_table.c.id == bindparam('_id')).
+            values(last_seen=bindparam('_last_seen')),
+            [{'_id': _id, '_last_seen': last_seen} for _id, last_seen in pending.iteritems()]
+        )
 
     def update_steam_name(self):
         """ Update user's name from their name on Steam."""
@@ -82,11 +127,67 @@ class User(db.Model):
             if steam_account_info is not None:
                 if self.name != steam_account_info.persona:
                     self.name = steam_account_info.persona
-                    db.session.add(self)
-                    db.session.commit()
+                self.name_updated_at = datetime.datetime.utcnow()
+                db.session.add(self)
+                db.session.commit()
         except steam.api.SteamError:
             pass
 
+    @classmethod
+    def refresh_steam_names(cls, limit=None):
+        """ Refreshes the Steam names of recently active users whose names have gone stale.
+
+        The refresh queue is fed by logins and page views via `last_seen`: any user seen within
+        USER_NAME_REFRESH_ACTIVE_WINDOW whose name hasn't been refreshed for USER_NAME_REFRESH_INTERVAL is due.  At
+        most `limit` users (USER_NAME_REFRESH_LIMIT by default) are handled per run, fetched through the batched
+        profile lookup and written back in one transaction.
+
+        Returns:
+            A list of (user id, old name, new name) tuples for the users whose name changed.
+        """
+        now = datetime.datetime.utcnow()
+        active_since = now - datetime.timedelta(seconds=current_app.config['USER_NAME_REFRESH_ACTIVE_WINDOW'])
+        stale_before = now - datetime.timedelta(seconds=current_app.config['USER_NAME_REFRESH_INTERVAL'])
+
+        stale_users = db.session.query(cls.id, cls.name).\
+            filter(cls.last_seen >= active_since,
+                   db.or_(cls.name_updated_at == None, cls.name_updated_at < stale_before)).\
+            order_by(cls.name_updated_at.asc()).\
+            limit(limit or current_app.config['USER_NAME_REFRESH_LIMIT']).\
+            all()
+
+        if not stale_users:
+            return []
+
+        profiles = cls.get_steam_profiles([_id for _id, name in stale_users])
+
+        # Nothing came back at all; Steam's probably having a bad time, so leave everyone queued for the next run.
+        if not profiles:
+            return []
+
+        # Only users we actually got a profile for count as refreshed; the rest (e.g. from a batch which failed) stay
+        # queued for the next run.
+        refreshed = [(_id, name) for _id, name in stale_users if _id in profiles]
+        renamed = [(_id, name, profiles[_id]["persona"]) for _id, name in refreshed
+                   if profiles[_id]["persona"] and profiles[_id]["persona"] != name]
+
+        users_table = cls.__table__
+        if renamed:
+            db.session.execute(
+                users_table.update().
+                where(users_table.c.id == bindparam('_id')).
+                values(name=bindparam('_name')),
+                [{'_id': _id, '_name': new_name} for _id, old_name, new_name in renamed]
+            )
+        db.session.execute(
+            users_table.update().
+            where(users_table.c.id.in_([_id for _id, name in refreshed])).
+            values(name_updated_at=now)
+        )
+        db.session.commit()
+
+        return renamed
+
     def allows_ads(self):
         return self.show_ads
 
@@ -105,6 +206,52 @@ class User(db.Model):
     def steam_id(self):
         return self.id + User.ACCOUNT_ID_TO_STEAM_ID_CORRECTION
 
+    @classmethod
+    def get_steam_profiles(cls, account_ids):
+        """ Returns a dict of account_id => profile data (persona and avatar) for the given account ids.
+
+        Profiles are served from mem_cache where possible, and any misses are fetched from the WebAPI's
+        GetPlayerSummaries in batches of 100, so rendering a page of players costs one or two upstream calls instead of
+        one per player.  Account ids Steam didn't return data for are omitted from the result.
+        """
+        account_ids = set(_id for _id in account_ids if _id)
+        if not account_ids:
+            return {}
+
+        # Serve what we can from mem_cache in one round trip.
+        account_ids = list(account_ids)
+        cached = mem_cache.get_many(*[cls.STEAM_PROFILE_CACHE_KEY.format(_id) for _id in account_ids])
+        profiles = {_id: data for _id, data in zip(account_ids, cached) if data is not None}
+
+        missing = [_id for _id in account_ids if _id not in profiles]
+        for i in range(0, len(missing), cls.STEAM_PROFILE_BATCH_SIZE):
+            batch = missing[i:i + cls.STEAM_PROFILE_BATCH_SIZE]
+            try:
+                players = steam.api.interface("ISteamUser").GetPlayerSummaries(
+                    version=2,
+                    steamids=",".join(str(_id + cls.ACCOUNT_ID_TO_STEAM_ID_CORRECTION) for _id in batch)
+                ).get("response", {}).get("players", [])
+            except steam.api.SteamError:
+                continue
+
+            fetched = {}
+            for player in players:
+                account_id = int(player["steamid"]) - cls.ACCOUNT_ID_TO_STEAM_ID_CORRECTION
+                fetched[account_id] = {
+                    "persona": player.get("personaname"),
+                    "avatar": player.get("avatarfull")
+                }
+
+            mem_cache.set_many({cls.STEAM_PROFILE_CACHE_KEY.format(_id): data for _id, data in fetched.iteritems()},
+                               timeout=60 * 60)  # Cache for 1 hour.
+            profiles.update(fetched)
+
+        return profiles
+
+
+# Don't lose buffered last seen times when a worker shuts down.
+atexit.register(User.flush_last_seen)
+
 
 class Subscription(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -1,14 +1,16 @@
 from flask import Blueprint, render_template, flash, redirect, request, url_for, current_app, g
 
-from app import oid, db, login_manager, mem_cache
+from app import oid, db, login_manager
 from models import User, AnonymousUser
 from app.replays.models import ReplayPlayer, ReplayFavourite, ReplayRating, ReplayDownload, Search, ReplayAlias
 from app.dota.models import Localization
 from forms import SettingsForm
 from flask.ext.login import login_user, logout_user, current_user, login_required
 from app.admin.views import AdminModelView
-from math import ceil
+from app.pagination import paginate_with_total
+from app import counters
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
 
 mod = Blueprint("users", __name__, url_prefix="/users")
 
@@ -18,17 +20,11 @@ login_manager.anonymous_user = AnonymousUser
 # User authentication
 @login_manager.user_loader
 def load_user(user_id):
-    name_updated_key = 'league_info_updated_{}'.format(user_id)
-    name_lock_key = 'league_info_update_lock_{}'.format(user_id)
-
     _user = User.query.filter(User.id == user_id).outerjoin(User.replay_aliases).first()
     if _user:
+        # Also queues the user for the refresh_user_names cron, which keeps their Steam name up to date.
         _user.update_last_seen()
 
-        # Update the user's Steam name once per hour.
-        if not mem_cache.get(name_updated_key) and not mem_cache.get(name_lock_key):
-            _user.update_steam_name()
-
         # Load replay_aliases for current user for easy alias-grabbing. (faster than a new query for every replay)
         _user.replay_aliases_dict = {x.replay_id: x for x in _user.replay_aliases}
 
@@ -141,9 +137,9 @@ def user_replays(_id, page=None):
     if _user is None:
         flash("User {} not found.".format(_id), "danger")
         return redirect(request.referrer or url_for("index"))
-    if not page:
-        page = int(ceil(float(ReplayPlayer.query.filter(ReplayPlayer.account_id == _user.id).count() or 1) / float(current_app.config["REPLAYS_PER_PAGE"])))  # Default to last page
-    _replays = _user.replay_players.paginate(page, current_app.config["REPLAYS_PER_PAGE"], False)
+    _replays = paginate_with_total(_user.replay_players.options(joinedload(ReplayPlayer.replay)), page,
+                                   current_app.config["REPLAYS_PER_PAGE"],
+                                   counters.user_replays.get(_user.id))
     return render_template("users/replays.html",
                            title=u"{}'s replays - Dotabank".format(_user.name),
                            user=_user,
@@ -157,9 +153,8 @@ def user_favourites(_id, page=None):
     if _user is None:
         flash("User {} not found.".format(_id), "danger")
         return redirect(request.referrer or url_for("index"))
-    if not page:
-        page = int(ceil(float(ReplayFavourite.query.filter(ReplayFavourite.user_id == _user.id).count() or 1) / float(current_app.config["REPLAYS_PER_PAGE"])))  # Default to last page
-    _favourites = _user.favourites.paginate(page, current_app.config["REPLAYS_PER_PAGE"], False)
+    _favourites = paginate_with_total(_user.favourites, page, current_app.config["REPLAYS_PER_PAGE"],
+                                      counters.user_favourites.get(_user.id))
     return render_template("users/favourites.html",
                            title=u"{}'s favourites - Dotabank".format(_user.name),
                            user=_user,
@@ -173,10 +168,8 @@ def user_ratings(_id, page=None):
     if _user is None:
         flash("User {} not found.".format(_id), "danger")
         return redirect(request.referrer or url_for("index"))
-    if not page:
-        pass
-    page = int(ceil(float(ReplayRating.query.filter(ReplayRating.user_id == _user.id).count() or 1) / float(current_app.config["REPLAYS_PER_PAGE"])))  # Default to last page
-    _ratings = _user.replay_ratings.paginate(page, current_app.config["REPLAYS_PER_PAGE"], False)
+    _ratings = paginate_with_total(_user.replay_ratings, page, current_app.config["REPLAYS_PER_PAGE"],
+                                   counters.user_ratings.get(_user.id))
     return render_template("users/ratings.html",
                            title=u"{}'s ratings - Dotabank".format(_user.name),
                            user=_user,
@@ -190,9 +183,8 @@ def user_searches(_id, page=None):
     if _user is None:
         flash("User {} not found.".format(_id), "danger")
         return redirect(request.referrer or url_for("index"))
-    if not page:
-        page = int(ceil(float(Search.query.filter(Search.user_id == _user.id).count() or 1) / float(current_app.config["REPLAYS_PER_PAGE"])))  # Default to last page
-    _searches = _user.searches.paginate(page, current_app.config["REPLAYS_PER_PAGE"], False)
+    _searches = paginate_with_total(_user.searches, page, current_app.config["REPLAYS_PER_PAGE"],
+                                    counters.user_searches.get(_user.id))
     return render_template("users/searches.html",
                            title=u"{}'s searches - Dotabank".format(_user.name),
                            user=_user,
@@ -206,9 +198,8 @@ def user_downloads(_id, page=None):
     if _user is None:
         flash("User {} not found.".format(_id), "danger")
         return redirect(request.referrer or url_for("index"))
-    if not page:
-        page = int(ceil(float(ReplayDownload.query.filter(ReplayDownload.user_id == _user.id).count() or 1) / float(current_app.config["REPLAYS_PER_PAGE"])))  # Default to last page
-    _downloads = _user.downloads.paginate(page, current_app.config["REPLAYS_PER_PAGE"], False)
+    _downloads = paginate_with_total(_user.downloads, page, current_app.config["REPLAYS_PER_PAGE"],
+                                     counters.user_downloads.get(_user.id))
     return render_template("users/downloads.html",
                            title=u"{}'s downloads - Dotabank".format(_user.name),
                            user=_user,
@@ -220,10 +211,8 @@ def user_downloads(_id, page=None):
 def user_aliases(_id, page=None):
     _user = User.query.filter(User.id == _id).first_or_404()
 
-    if not page:
-        page = int(ceil(float(ReplayAlias.query.filter(ReplayAlias.user_id == _user.id).count() or 1) / float(current_app.config["REPLAYS_PER_PAGE"])))  # Default to last page
-
-    _aliases = _user.replay_aliases.paginate(page, current_app.config["REPLAYS_PER_PAGE"], False)
+    _aliases = paginate_with_total(_user.replay_aliases, page, current_app.config["REPLAYS_PER_PAGE"],
+                                   counters.user_aliases.get(_user.id))
     return render_template("users/aliases.html",
                            title=u"{}'s aliases - Dotabank".format(_user.name),
                            user=_user,
@@ -1,12 +1,11 @@
 from flask import render_template, abort, send_file, flash, redirect, url_for, request
-from app import app, db, mem_cache
+from app import app, db, locked_mem_cache
 from app.models import Stats, UGCFile, Donation
-from app.replays.models import Replay, ReplayFavourite, ReplayRating, ReplayDownload
+from app.replays.models import Replay, ReplayStats
 from app.replays.forms import SearchForm
 from flask.ext.login import current_user
 import requests
 import os
-from datetime import datetime, timedelta
 import stripe
 
 
@@ -16,45 +15,32 @@ def inject_search_form():
     return dict(search_form=SearchForm())
 
 
-@mem_cache.cached(key_prefix="homepage_added_replays", timeout=10*60)  # 10 minutes
+@locked_mem_cache.cached(key_prefix="homepage_added_replays", timeout=10*60)  # 10 minutes
 def get_last_added_replays():
-    return Replay.query.order_by(Replay.added_to_site_time.desc()).limit(app.config["LATEST_REPLAYS_LIMIT"]).all()
+    return Replay.list_query().order_by(Replay.added_to_site_time.desc()).limit(app.config["LATEST_REPLAYS_LIMIT"]).all()
 
 
-@mem_cache.cached(key_prefix="homepage_archived_replays", timeout=10*60)  # 10 minutes
+@locked_mem_cache.cached(key_prefix="homepage_archived_replays", timeout=10*60)  # 10 minutes
 def get_last_archived_replays():
-    return Replay.query.filter(Replay.state == "ARCHIVED").order_by(Replay.dl_done_time.desc()).limit(app.config["LATEST_REPLAYS_LIMIT"]).all()
+    return Replay.list_query().filter(Replay.state == "ARCHIVED").order_by(Replay.dl_done_time.desc()).limit(app.config["LATEST_REPLAYS_LIMIT"]).all()
 
 
-@mem_cache.cached(key_prefix="homepage_favourite_replays", timeout=10*60)  # 10 minutes
+@locked_mem_cache.cached(key_prefix="homepage_favourite_replays", timeout=10*60)  # 10 minutes
 def get_most_favourited_replays():
-    return db.session.query(Replay.id, Replay.added_to_site_time, db.func.count(ReplayFavourite)).\
-        join(ReplayFavourite.replay).\
-        order_by(db.func.count(ReplayFavourite).desc()).\
-        group_by(ReplayFavourite.replay_id).\
-        limit(app.config["LATEST_REPLAYS_LIMIT"]).\
-        all()
+    return ReplayStats.top(ReplayStats.favourite_count, app.config["LATEST_REPLAYS_LIMIT"],
+                           Replay.id, Replay.added_to_site_time, ReplayStats.favourite_count).all()
 
 
-@mem_cache.cached(key_prefix="homepage_liked_replays", timeout=10*60)  # 10 minutes
+@locked_mem_cache.cached(key_prefix="homepage_liked_replays", timeout=10*60)  # 10 minutes
 def get_most_liked_replays():
-    return db.session.query(Replay.id, Replay.added_to_site_time, db.func.count(ReplayRating)).\
-        filter(ReplayRating.positive == True).\
-        join(ReplayRating.replay).\
-        order_by(db.func.count(ReplayRating).desc()).\
-        group_by(ReplayRating.replay_id).\
-        limit(app.config["LATEST_REPLAYS_LIMIT"]).\
-        all()
+    return ReplayStats.top(ReplayStats.positive_rating_count, app.config["LATEST_REPLAYS_LIMIT"],
+                           Replay.id, Replay.added_to_site_time, ReplayStats.positive_rating_count).all()
 
 
-@mem_cache.cached(key_prefix="homepage_downloaded_replays", timeout=10*60)  # 10 minutes
+@locked_mem_cache.cached(key_prefix="homepage_downloaded_replays", timeout=10*60)  # 10 minutes
 def get_most_downloaded_replays():
-    replays = db.session.query(Replay, db.func.count(ReplayDownload)).\
-        join(ReplayDownload.replay).\
-        order_by(db.func.count(ReplayDownload).desc()).\
-        group_by(ReplayDownload.replay_id).\
-        limit(app.config["LATEST_REPLAYS_LIMIT"]).\
-        all()
+    replays = Replay.list_query(ReplayStats.top(ReplayStats.download_count, app.config["LATEST_REPLAYS_LIMIT"],
+                                                Replay, ReplayStats.download_count)).all()
 
     for replay, count in replays:
         replay.team_players  # Touch so the data is stored in the object before we push it to mem_cache
@@ -62,16 +48,10 @@ def get_most_downloaded_replays():
     return replays
 
 
-@mem_cache.cached(key_prefix="homepage_downloaded_30d_replays", timeout=10*60)  # 10 minutes
+@locked_mem_cache.cached(key_prefix="homepage_downloaded_30d_replays", timeout=10*60)  # 10 minutes
 def get_most_downloaded_30days_replays():
-    THIRTY_DAYS_AGO = datetime.utcnow() - timedelta(days=30)
-    replays = db.session.query(Replay,  db.func.count(ReplayDownload)).\
-        join(ReplayDownload.replay).\
-        filter(ReplayDownload.created_at >= THIRTY_DAYS_AGO).\
-        order_by(db.func.count(ReplayDownload).desc()).\
-        group_by(ReplayDownload.replay_id).\
-        limit(app.config["LATEST_REPLAYS_LIMIT"]).\
-        all()
+    replays = Replay.list_query(ReplayStats.top(ReplayStats.download_30d_count, app.config["LATEST_REPLAYS_LIMIT"],
+                                                Replay, ReplayStats.download_30d_count)).all()
 
     for replay, count in replays:
         replay.team_players  # Touch so the data is stored in the object before we push it to mem_cache
@@ -94,6 +74,8 @@ def index():
     most_liked_replays = get_most_liked_replays()
     most_downloaded = get_most_downloaded_replays()
     most_downloaded_30days = get_most_downloaded_30days_replays()
+    Replay.prefetch_listing_profiles(last_added_replays + last_archived_replays +
+                                     [replay for replay, count in most_downloaded + most_downloaded_30days])
 
     stats = Stats()
 
@@ -0,0 +1,71 @@
+"""
+Helpers for making lots of Steam WebAPI calls at once without tripping Valve's rate limits.
+
+Calls made through `call` share a per-process token bucket (STEAM_API_RATE_LIMIT calls per second), and `map_concurrent`
+runs them on a bounded pool of threads (STEAM_API_CONCURRENCY), so crons which make a call per subscriber or per match
+finish in time proportional to the rate limit rather than to the sum of every request's latency.
+
+The functions handed to `map_concurrent` run outside of the app context, so they mustn't touch the database; do the
+WebAPI calls in the pool and the database writes afterwards, in bulk.
+"""
+
+from app import app, steam
+from multiprocessing.pool import ThreadPool
+from time import time, sleep
+import threading
+
+
+class RateLimiter(object):
+    """ A thread-safe token bucket.  `acquire` blocks until a token is available.
+
+    :param rate: tokens added per second.
+    :param burst: the most tokens the bucket holds, i.e. how many calls may be made at once after a quiet spell.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = burst or max(int(rate), 1)
+        self._tokens = float(self.burst)
+        self._updated_at = time()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate)
+                self._updated_at = now
+
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+
+                wait = (1 - self._tokens) / self.rate
+            sleep(wait)
+
+
+rate_limiter = RateLimiter(app.config['STEAM_API_RATE_LIMIT'])
+
+
+def call(interface, method, result_key="result", **params):
+    """ Makes a rate-limited WebAPI call and returns the `result_key` of its response, e.g.
+    `call("IDOTA2Match_570", "GetMatchDetails", match_id=1)`.  Raises steam.api.SteamError (or one of its
+    subclasses) on failure. """
+    rate_limiter.acquire()
+    return getattr(steam.api.interface(interface), method)(**params).get(result_key)
+
+
+def map_concurrent(func, items, concurrency=None):
+    """ Returns `[func(item) for item in items]`, evaluated on a pool of up to `concurrency` threads
+    (STEAM_API_CONCURRENCY by default).  `func` should handle its own errors; any exception it raises is re-raised here
+    once every call has finished. """
+    items = list(items)
+    if not items:
+        return []
+
+    pool = ThreadPool(min(concurrency or app.config['STEAM_API_CONCURRENCY'], len(items)))
+    try:
+        return pool.map(func, items)
+    finally:
+        pool.close()
+        pool.join()
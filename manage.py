@@ -31,6 +31,70 @@ def update_hero_data():
     Hero.update_data()
 
 
+@manager.command
+def refresh_user_names():
+    from app.users.models import User
+    renamed = User.refresh_steam_names()
+    print "Refreshed names for {} users".format(len(renamed))
+
+
+@manager.command
+def reconcile_bucket_stats(verify_bucket=False):
+    from app.models import BucketStats
+    result = BucketStats.reconcile(verify_bucket=verify_bucket)
+    print "Stored: {} replays, {} bytes".format(*result["stored"])
+    print "Actual: {} replays, {} bytes".format(*result["actual"])
+    if "bucket" in result:
+        print "Bucket: {} files, {} bytes".format(*result["bucket"])
+
+
+@manager.command
+def reconcile_counters():
+    from app import counters
+    for name, groups in sorted(counters.reconcile().iteritems()):
+        print "{}: {} counts".format(name, groups)
+
+
+@manager.command
+def archive_old_rows():
+    from app import retention
+    for name, archived in sorted(retention.run().iteritems()):
+        print "{}: archived {} rows".format(name, archived)
+
+
+@manager.command
+def roll_up_gc_jobs():
+    from app.gc.models import GCJobRollup
+    print "Rolled up {} GC jobs".format(GCJobRollup.roll_up())
+
+
+@manager.command
+def roll_up_downloads():
+    from app.replays.models import DownloadRollupState
+    print "Rolled up {} downloads".format(DownloadRollupState.roll_up())
+
+
+@manager.command
+def rebuild_replay_stats():
+    from app.replays.models import ReplayStats
+    print "Rebuilt stats for {} replays".format(ReplayStats.rebuild())
+
+
+@manager.command
+def refresh_recent_downloads():
+    from app.replays.models import ReplayStats
+    print "{} replays downloaded in the last {} days".format(ReplayStats.refresh_recent_downloads(),
+                                                              ReplayStats.RECENT_DOWNLOADS_DAYS)
+
+
+@manager.command
+def backfill_replay_files():
+    from app.replays.models import Replay
+    from app.models import BucketStats
+    print "Recorded file details for {} S3 keys".format(Replay.backfill_file_data())
+    BucketStats.reconcile(fill_sizes=0)
+
+
 @manager.command
 def fix_incorrect_player_counts():
     from app.cron.fix_replay_errors import fix_incorrect_player_counts
@@ -58,7 +122,45 @@ def fix_long_waiting_download():
 @manager.command
 def fetch_league_matches(league_id):
     from app.cron.fetch_league_matches import fetch_league_matches
-    fetch_league_matches(league_id)
+    fetch_league_matches(int(league_id))
+
+
+@manager.command
+def fetch_all_league_matches():
+    from app.cron.fetch_league_matches import fetch_all_league_matches
+    fetch_all_league_matches()
+
+
+@manager.command
+def repopulate_replays(chunk_size=100):
+    from app.cron.repopulate_replays import repopulate_replays as _repopulate_replays
+
+    def report(progress):
+        print "{done}/{total} replays, {updated} updated, {failed_count} failed, ETA {eta:.0f}s".format(
+            failed_count=len(progress["failed"]), **progress)
+
+    progress = _repopulate_replays(int(chunk_size), on_progress=report)
+    if progress is None:
+        print "A repopulate job is already running."
+    elif progress["failed"]:
+        print "Failed: {}".format(", ".join(str(_id) for _id in progress["failed"]))
+
+
+@manager.command
+def benchmark_import(runs=5):
+    """ Times `import app` in fresh interpreters, as paid by every cron run and worker boot. """
+    import os
+    import subprocess
+    import sys
+    code = "from time import time; started = time(); import app; print time() - started"
+    timings = []
+    for _ in range(int(runs)):
+        output = subprocess.check_output([sys.executable, "-c", code], cwd=os.path.dirname(os.path.abspath(__file__)))
+        timings.append(float(output.strip().splitlines()[-1]))
+
+    timings.sort()
+    print "import app over {} runs: min {:.3f}s, median {:.3f}s, max {:.3f}s".format(
+        len(timings), timings[0], timings[len(timings) // 2], timings[-1])
 
 
 if __name__ == "__main__":
@@ -5,24 +5,32 @@ UGC_FILES_DIR = os.path.join(APP_DIR, 'ugcfiles')
 
 STEAM_API_KEY = ""  # TODO
 STEAM_API_TIMEOUT = 10
+STEAM_API_RATE_LIMIT = 5  # WebAPI calls per second made through app.webapi, across all of a process' threads.
+STEAM_API_CONCURRENCY = 8  # Max WebAPI calls in flight at once through app.webapi.
 DEBUG = False
 TESTING = False
 SECRET_KEY = ""  # TODO
 SQLALCHEMY_DATABASE_URI = ''  # TODO
 DEBUG_TB_INTERCEPT_REDIRECTS = False
 
+# Both caches are fronted by a per-process LRU (app.cache.TieredCache); use "memcached" and
+# "app.cache.dotabank_filesystem" as the CACHE_TYPEs to go without it.
 CACHE_MEMCACHED = {
-    'CACHE_TYPE': "memcached",
+    'CACHE_TYPE': "app.cache.tiered_memcached",
     'CACHE_MEMCACHED_SERVERS': ["127.0.0.1:11211"],
     'CACHE_KEY_PREFIX': "dotabank",
+    'CACHE_LOCAL_THRESHOLD': 1000,  # Max items held in each process' local tier
+    'CACHE_LOCAL_TIMEOUT': 60,  # Max seconds an item is served from the local tier
     #'CACHE_DEFAULT_TIMEOUT',
     #'CACHE_ARGS',
     #'CACHE_OPTIONS'
 }
 
 CACHE_FS = {
-    'CACHE_TYPE': "app.cache.dotabank_filesystem",
+    'CACHE_TYPE': "app.cache.tiered_dotabank_filesystem",
     'CACHE_DIR': APP_DIR + os.sep + '.cache',
+    'CACHE_LOCAL_THRESHOLD': 100,  # Max items held in each process' local tier
+    'CACHE_LOCAL_TIMEOUT': 60 * 5,  # Max seconds an item is served from the local tier
     #'CACHE_DEFAULT_TIMEOUT',
     #'CACHE_ARGS',
     #'CACHE_OPTIONS'
@@ -37,6 +45,8 @@ AWS_SECRET_ACCESS_KEY = ""  # TODO
 AWS_BUCKET = ""  # TODO
 AWS_SQS_GC = ""  # TODO
 AWS_SQS_DL = ""  # TODO
+STORAGE_BACKEND = "aws"  # "aws", or "local" to use app.storage's file-system stand-ins for SQS and S3
+LOCAL_STORAGE_DIR = os.path.join(APP_DIR, '.storage')  # Where the "local" storage backend keeps its queues and bucket
 
 # Recaptcha info
 
@@ -65,6 +75,26 @@ CAPTCHA_LEAGUE_EXCEPTIONS = []  # Captcha-less downloading of TI4
 
 MAX_REPLAY_FIX_ATTEMPTS = 5
 
+LAST_SEEN_UPDATE_WINDOW = 60 * 5  # Seconds; don't record a user's last_seen more often than every 5 minutes.
+LAST_SEEN_FLUSH_INTERVAL = 60  # Seconds between bulk writes of buffered last_seen times.
+
+LOG_HANDLER_BATCH_SIZE = 50  # Max log entries written to the database per INSERT.
+LOG_HANDLER_FLUSH_INTERVAL = 5  # Seconds; max time a log entry waits in the queue before being written.
+LOG_HANDLER_QUEUE_SIZE = 1000  # Log entries queued beyond this are dropped (and the number dropped logged).
+
+RETENTION_ARCHIVE_DIR = os.path.join(APP_DIR, 'archive')  # Where app.retention writes archived rows, as .jsonl.gz files.
+RETENTION_MAX_AGE_DAYS = {  # Rows older than this are archived by manage.py archive_old_rows.
+    "gc_jobs": 90,
+    "logs": 180,  # Resolved logs only.
+    "searches": 365
+}
+RETENTION_CHUNK_SIZE = 5000  # Rows archived per transaction.
+RETENTION_CHUNK_PAUSE = 0.5  # Seconds to pause between chunks.
+
+USER_NAME_REFRESH_INTERVAL = 60 * 60  # Seconds; refresh a user's Steam name at most once an hour.
+USER_NAME_REFRESH_ACTIVE_WINDOW = 60 * 60 * 24  # Seconds; only refresh names of users seen in the past day.
+USER_NAME_REFRESH_LIMIT = 1000  # Max users refresh_user_names handles per run.
+
 # Stripe payments
 STRIPE_DEBUG_SECRET_KEY = ""
 STRIPE_DEBUG_PUBLISHABLE_KEY = ""